@@ -0,0 +1,239 @@
+import asyncio
+import threading
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+
+from common.distance_metrics import DistanceMetric
+from common.indexing_structures import IndexingStructure
+
+# Structures that return the exact neighbors, and the approximate ones that are only
+# used when no exact structure fits the latency budget
+EXACT_INDEXINGS = [
+    IndexingStructure.KD_TREE,
+    IndexingStructure.BALL_TREE,
+    IndexingStructure.BRUTE_FORCE,
+    IndexingStructure.BRUTE_FORCE_FUSED,
+    IndexingStructure.PIVOT,
+]
+APPROXIMATE_INDEXINGS = [
+    IndexingStructure.CASCADE,
+    IndexingStructure.CLASS_SHORTLIST,
+]
+
+
+class QueueFull(RuntimeError):
+    """
+    Raised when a request arrives while the work queue is full.
+    """
+
+
+class LatencyTracker:
+    """
+    Live per-(indexing, metric) latency estimates, as an exponentially weighted moving
+    average of the observed prediction times.
+    """
+
+    def __init__(self, alpha=0.2):
+        """
+        Parameters:
+        - alpha (float): Weight of the newest observation.
+        """
+        self.alpha = alpha
+        self._estimates = {}
+        self._lock = threading.Lock()
+
+    def record(self, indexing, metric, seconds):
+        key = (IndexingStructure(indexing), DistanceMetric(metric))
+        with self._lock:
+            previous = self._estimates.get(key)
+            self._estimates[key] = seconds if previous is None else previous + self.alpha * (seconds - previous)
+
+    def estimate(self, indexing, metric):
+        """
+        Returns:
+        - float or None: Estimated seconds, or None if the combination was never measured.
+        """
+        return self._estimates.get((IndexingStructure(indexing), DistanceMetric(metric)))
+
+    def snapshot(self):
+        with self._lock:
+            return {f"{indexing.value}/{metric.value}": round(seconds * 1000, 3)
+                    for (indexing, metric), seconds in self._estimates.items()}
+
+
+class AdmissionController:
+    """
+    Bounds the work the server accepts.
+
+    At most `max_concurrency` predictions run at once and at most `max_queue` more wait
+    for a slot. Requests beyond that are rejected immediately instead of queueing up and
+    missing their deadlines anyway. Requests wait on the event loop, so a queued request
+    does not hold one of the server's worker threads.
+    """
+
+    def __init__(self, max_concurrency=4, max_queue=32):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self.admitted = 0
+        self.rejected = 0
+        self.waiting = 0
+        self.running = 0
+
+    @asynccontextmanager
+    async def admit(self):
+        """
+        Holds a prediction slot for the duration of the block. Used from async routes,
+        which then run the prediction in the threadpool.
+
+        Usage:
+            async with admission.admit() as queue_seconds:
+                await run_in_threadpool(...)
+
+        Yields:
+        - float: Seconds spent waiting in the queue.
+
+        Raises:
+        - QueueFull: If max_concurrency requests are running and max_queue are waiting.
+        """
+        with self._lock:
+            if self.running + self.waiting >= self.max_concurrency + self.max_queue:
+                self.rejected += 1
+                raise QueueFull("Prediction queue is full.")
+            self.waiting += 1
+            self.admitted += 1
+
+        start = time.perf_counter()
+        try:
+            await self._slots.acquire()
+        except BaseException:
+            # Cancelled while waiting, e.g. because the client went away
+            with self._lock:
+                self.waiting -= 1
+            raise
+        with self._lock:
+            self.waiting -= 1
+            self.running += 1
+        try:
+            yield time.perf_counter() - start
+        finally:
+            with self._lock:
+                self.running -= 1
+            self._slots.release()
+
+    def metrics(self):
+        with self._lock:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "max_queue": self.max_queue,
+                "running": self.running,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+            }
+
+
+class DeadlineRouter:
+    """
+    Chooses the index structure (and k) that serves a request within its latency budget.
+
+    The requested structure is used if its estimate fits the remaining budget. Otherwise
+    the cheapest exact structure that fits is used, then the cheapest approximate one,
+    and if nothing fits the cheapest structure runs with a smaller k.
+    """
+
+    def __init__(self, tracker=None):
+        self.tracker = tracker or LatencyTracker()
+        self.strategies = Counter()
+        self._lock = threading.Lock()
+        self._calibrated = set()
+
+    def _candidates(self, indexings, metric, has_kd_tree):
+        for indexing in indexings:
+            if indexing == IndexingStructure.KD_TREE and (metric != DistanceMetric.EUCLIDEAN or not has_kd_tree):
+                continue
+            estimate = self.tracker.estimate(indexing, metric)
+            if estimate is not None:
+                yield estimate, indexing
+
+    def choose(self, indexing, k, metric, budget_seconds=None, has_kd_tree=True):
+        """
+        Parameters:
+        - indexing (IndexingStructure): Structure the caller asked for.
+        - k (int): Number of neighbors the caller asked for.
+        - metric (DistanceMetric): Distance metric of the request.
+        - budget_seconds (float, optional): Time left for the prediction. None serves the request as asked.
+        - has_kd_tree (bool): Whether the model has a KD tree.
+
+        Returns:
+        - dict: indexing, k, the strategy used ("requested", "rerouted", "approximate",
+          "reduced_k" or "best_effort") and the estimated milliseconds.
+        """
+        indexing = IndexingStructure(indexing)
+        metric = DistanceMetric(metric)
+        requested = self.tracker.estimate(indexing, metric)
+
+        if budget_seconds is None or requested is None or requested <= budget_seconds:
+            choice = (indexing, k, "requested", requested)
+        else:
+            exact = sorted(self._candidates(EXACT_INDEXINGS, metric, has_kd_tree), key=lambda c: c[0])
+            approximate = sorted(self._candidates(APPROXIMATE_INDEXINGS, metric, has_kd_tree), key=lambda c: c[0])
+            fitting_exact = [c for c in exact if c[0] <= budget_seconds]
+            fitting_approximate = [c for c in approximate if c[0] <= budget_seconds]
+            cheapest = min(exact + approximate, key=lambda c: c[0], default=(requested, indexing))
+
+            if fitting_exact:
+                choice = (fitting_exact[0][1], k, "rerouted", fitting_exact[0][0])
+            elif fitting_approximate:
+                choice = (fitting_approximate[0][1], k, "approximate", fitting_approximate[0][0])
+            elif k > 1:
+                choice = (cheapest[1], max(1, k // 2), "reduced_k", cheapest[0])
+            else:
+                choice = (cheapest[1], k, "best_effort", cheapest[0])
+
+        with self._lock:
+            self.strategies[choice[2]] += 1
+
+        return {
+            "indexing": choice[0].value,
+            "k": choice[1],
+            "strategy": choice[2],
+            "estimated_ms": None if choice[3] is None else round(choice[3] * 1000, 3),
+        }
+
+    def calibrate(self, model, points, metrics=(DistanceMetric.EUCLIDEAN, DistanceMetric.MANHATTAN)):
+        """
+        Seeds the latency estimates by timing a few predictions on every structure the
+        router can choose for the given metrics.
+        """
+        for metric in metrics:
+            for indexing in EXACT_INDEXINGS + APPROXIMATE_INDEXINGS:
+                if indexing == IndexingStructure.KD_TREE and (metric != DistanceMetric.EUCLIDEAN or model.kd_tree is None):
+                    continue
+                # The first query builds lazily created indexes and is not timed
+                model.adaptive_prediction(points[0], k=model.best_k, metric=metric, indexing=indexing)
+                for point in points:
+                    start = time.perf_counter()
+                    model.adaptive_prediction(point, k=model.best_k, metric=metric, indexing=indexing)
+                    self.tracker.record(indexing, metric, time.perf_counter() - start)
+
+    def calibrate_in_background(self, model, metric, n_points=4):
+        """
+        Calibrates a metric in a daemon thread, once. Meant to be called when a request with
+        a latency budget arrives, so servers whose requests have none never pay for it;
+        until the estimates exist such requests are served as asked.
+        """
+        metric = DistanceMetric(metric)
+        with self._lock:
+            if metric in self._calibrated:
+                return
+            self._calibrated.add(metric)
+        threading.Thread(target=self.calibrate, args=(model, model.training_features[:n_points], (metric,)),
+                         daemon=True).start()
+
+    def metrics(self):
+        with self._lock:
+            strategies = dict(self.strategies)
+        return {"strategies": strategies, "estimates_ms": self.tracker.snapshot()}
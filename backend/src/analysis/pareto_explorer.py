@@ -0,0 +1,265 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import hashlib
+import json
+import time
+import tracemalloc
+
+import joblib
+import numpy as np
+import matplotlib.pyplot as plt
+from sklearn.model_selection import train_test_split
+
+from common.distance_metrics import DistanceMetric
+from common.indexing_structures import IndexingStructure
+from common.precision import Precision
+from config import CACHE_DIR
+from knn import KNN
+from main import PRECISION, RANDOM_STATE, TEST_SIZE
+from model_pool import estimate_nbytes
+from preprocessor import Preprocessor
+
+PARETO_DIR = os.path.join(CACHE_DIR, "pareto")
+RESULTS_FILE = "results.jsonl"
+# Bump to invalidate the cached results after changing how a configuration is measured
+VERSION = 2
+
+
+def dataset_fingerprint():
+    """
+    Identifies the cached rasters, so results measured on another dataset are not reused.
+    """
+    paths = [os.path.join(CACHE_DIR, name) for name in ("X_raster.npy", "y_raster.npy")]
+    return [[os.path.basename(path), os.stat(path).st_size, os.stat(path).st_mtime] for path in paths]
+
+
+def split_rows(y):
+    """
+    Train and test rows of the pipeline's split. `main.py` splits with the same test size
+    and seed, so the test rows are those of the cached test split.
+    """
+    return train_test_split(np.arange(len(y)), test_size=TEST_SIZE, random_state=RANDOM_STATE)
+
+
+def reduced_features(X, n_components, fingerprint):
+    """
+    PCA features of every raster for one component count, fitted like the pipeline's
+    preprocess stage. Cached, since the fit is the slowest step of the sweep.
+
+    Returns:
+    - tuple: (features, preprocessor bytes)
+    """
+    key = hash_key({"components": n_components, "precision": Precision(PRECISION).value, "data": fingerprint})
+    path = os.path.join(PARETO_DIR, f"features-{n_components}-{key}.joblib")
+    if os.path.exists(path):
+        return joblib.load(path)
+
+    print(f"Fitting PCA with {n_components} components...")
+    preprocessor = Preprocessor(n_components=n_components, precision=PRECISION)
+    result = (preprocessor.fit_transform(X), estimate_nbytes(preprocessor))
+    joblib.dump(result, path)
+    return result
+
+
+def hash_key(description):
+    return hashlib.sha256(json.dumps(description, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def per_class_rows(labels, rows, per_class):
+    """
+    The first `per_class` training rows of every class, or all of them if per_class is None.
+    """
+    if per_class is None:
+        return rows
+    keep = np.concatenate([rows[labels[rows] == label][:per_class] for label in np.unique(labels[rows])])
+    return np.sort(keep)
+
+
+def batch_predict(model, queries, k, metric, indexing):
+    """
+    Predicts all queries at once with the batch path of the structure.
+
+    Returns:
+    - np.ndarray or None: Predictions, or None for structures that only answer single queries.
+    """
+    if indexing == IndexingStructure.CLASS_SHORTLIST:
+        return None
+    if indexing == IndexingStructure.BRUTE_FORCE_FUSED:
+        return model.predict_weighted_fused_batch(queries, k=k, metric=metric)
+    dists, labels = model.query_neighbors(queries, k=k, metric=metric, indexing=indexing)
+    return np.array([model.weighted_vote(d, l) for d, l in zip(dists, labels)])
+
+
+def measure(model, queries, labels, k, metric, indexing):
+    """
+    Accuracy, single-query and batch latency, and memory of one search configuration.
+    """
+    # The first query builds lazily created state (kernel compilation, label codes); its
+    # allocations count towards the configuration's memory but not towards its latency
+    tracemalloc.start()
+    model.adaptive_prediction(queries[0], k=k, metric=metric, indexing=indexing)
+    batch_predict(model, queries, k, metric, indexing)
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    predictions = []
+    single_seconds = []
+    for query in queries:
+        start = time.perf_counter()
+        predictions.append(model.adaptive_prediction(query, k=k, metric=metric, indexing=indexing))
+        single_seconds.append(time.perf_counter() - start)
+    single_ms = np.array(single_seconds) * 1000
+
+    start = time.perf_counter()
+    batch = batch_predict(model, queries, k, metric, indexing)
+    batch_seconds = time.perf_counter() - start
+
+    return {
+        "accuracy": float(np.mean(np.array(predictions) == labels)),
+        "single_ms_p50": float(np.median(single_ms)),
+        "single_ms_p99": float(np.percentile(single_ms, 99)),
+        "batch_us_per_query": None if batch is None else batch_seconds / len(queries) * 1e6,
+        "batch_accuracy": None if batch is None else float(np.mean(batch == labels)),
+        "query_peak_bytes": traced_peak,
+    }
+
+
+def pareto_front(rows, cost):
+    """
+    The rows no other row beats on both accuracy and `cost`, sorted by cost.
+    """
+    candidates = sorted((row for row in rows if row[cost] is not None), key=lambda row: (row[cost], -row["accuracy"]))
+    front = []
+    for row in candidates:
+        if not front or row["accuracy"] > front[-1]["accuracy"]:
+            front.append(row)
+    return front
+
+
+def load_results(path):
+    results = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    results[row["key"]] = row
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy against serving latency and memory over PCA size, "
+                                                 "training set size, k, metric and index structure.")
+    parser.add_argument("--components", type=int, nargs="+", default=[16, 32, 64])
+    parser.add_argument("--samples-per-class", type=int, nargs="+", default=[500, 1000, 0],
+                        help="training points per class; 0 uses the whole training split")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 9])
+    parser.add_argument("--metrics", nargs="+", default=[metric.value for metric in DistanceMetric])
+    parser.add_argument("--indexings", nargs="+", default=[indexing.value for indexing in IndexingStructure])
+    parser.add_argument("--queries", type=int, default=300, help="test points measured per configuration")
+    args = parser.parse_args()
+
+    os.makedirs(PARETO_DIR, exist_ok=True)
+    results_path = os.path.join(PARETO_DIR, RESULTS_FILE)
+    results = load_results(results_path)
+
+    # uint8 rasters, memory-mapped; the Preprocessor normalizes them in chunks
+    X = np.load(os.path.join(CACHE_DIR, "X_raster.npy"), mmap_mode="r")
+    y = np.load(os.path.join(CACHE_DIR, "y_raster.npy"))
+    fingerprint = dataset_fingerprint()
+    train_rows, test_rows = split_rows(y)
+    test_rows = test_rows[:args.queries]
+    test_labels = y[test_rows]
+
+    metrics = [DistanceMetric(metric) for metric in args.metrics]
+    indexings = [IndexingStructure(indexing) for indexing in args.indexings]
+    with open(results_path, "a") as results_file:
+        for n_components in args.components:
+            features = None
+            for per_class in args.samples_per_class:
+                per_class = per_class or None
+                model = None
+                for k in args.k:
+                    for metric in metrics:
+                        for indexing in indexings:
+                            if indexing == IndexingStructure.KD_TREE and metric != DistanceMetric.EUCLIDEAN:
+                                continue
+                            config = {"components": n_components, "per_class": per_class, "k": k,
+                                      "metric": metric.value, "indexing": indexing.value}
+                            key = hash_key({**config, "queries": args.queries, "data": fingerprint,
+                                            "precision": Precision(PRECISION).value, "version": VERSION})
+                            if key in results:
+                                continue
+
+                            # Features and models are only built for configurations still to run
+                            if features is None:
+                                features, preprocessor_bytes = reduced_features(X, n_components, fingerprint)
+                            if model is None:
+                                rows = per_class_rows(y, train_rows, per_class)
+                                model = KNN.from_data(features[rows], y[rows], k=5, precision=PRECISION)
+                                model_bytes = estimate_nbytes(model)
+
+                            print(f"Measuring {config}...")
+                            row = {"key": key, **config, "n_train": len(model.training_features),
+                                   "model_bytes": model_bytes + preprocessor_bytes,
+                                   **measure(model, features[test_rows], test_labels, k, metric, indexing)}
+                            results[key] = row
+                            results_file.write(json.dumps(row) + "\n")
+                            results_file.flush()
+
+    # Only the configurations of this sweep, also when the results file holds others
+    requested = {(c, s or None, k, m, i) for c in args.components for s in args.samples_per_class
+                 for k in args.k for m in args.metrics for i in args.indexings}
+    rows = [row for row in results.values()
+            if (row["components"], row["per_class"], row["k"], row["metric"], row["indexing"]) in requested]
+    front = pareto_front(rows, "single_ms_p50")
+
+    print(f"\nPareto frontier of accuracy against single-query latency ({len(front)} of {len(rows)} configurations):")
+    print(f"{'comp':>5} {'per class':>9} {'k':>3} {'metric':<10} {'indexing':<18} {'accuracy':>9} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'batch us':>9} {'model MB':>9} {'peak MB':>8}")
+    for row in front:
+        batch = f"{row['batch_us_per_query']:>9.1f}" if row["batch_us_per_query"] is not None else f"{'-':>9}"
+        print(f"{row['components']:>5} {str(row['per_class'] or 'all'):>9} {row['k']:>3} {row['metric']:<10} "
+              f"{row['indexing']:<18} {row['accuracy']:>9.4f} {row['single_ms_p50']:>8.3f} {row['single_ms_p99']:>8.3f} "
+              f"{batch} {row['model_bytes'] / 1024 ** 2:>9.1f} {row['query_peak_bytes'] / 1024 ** 2:>8.1f}")
+
+    report_path = os.path.join(CACHE_DIR, "pareto_report.json")
+    with open(report_path, "w") as f:
+        json.dump({
+            "configurations": rows,
+            "front_single": [row["key"] for row in front],
+            "front_batch": [row["key"] for row in pareto_front(rows, "batch_us_per_query")],
+            "front_memory": [row["key"] for row in pareto_front(rows, "model_bytes")],
+        }, f, indent=2)
+    print(f"Report saved to: {report_path}")
+
+    # Accuracy against latency and against memory, every configuration colored by structure
+    fig, axes = plt.subplots(1, 2, figsize=(14, 6))
+    for ax, cost, label, scale in ((axes[0], "single_ms_p50", "Single-query latency, median (ms)", 1),
+                                   (axes[1], "model_bytes", "Model and preprocessor memory (MB)", 1024 ** 2)):
+        for indexing in indexings:
+            points = [row for row in rows if row["indexing"] == indexing.value]
+            ax.scatter([row[cost] / scale for row in points], [row["accuracy"] for row in points],
+                       label=indexing.value, alpha=0.6, s=18)
+        frontier = pareto_front(rows, cost)
+        ax.plot([row[cost] / scale for row in frontier], [row["accuracy"] for row in frontier],
+                drawstyle="steps-post", color="black", linewidth=1.5, marker="o", markersize=8,
+                markerfacecolor="none", label="Pareto frontier")
+        ax.set_xscale("log")
+        ax.set_xlabel(label)
+        ax.set_ylabel("Accuracy")
+        ax.grid(True)
+    axes[0].legend(fontsize=8)
+    fig.suptitle("Accuracy vs. Serving Cost")
+    fig.tight_layout()
+
+    chart_path = os.path.join(CACHE_DIR, "pareto_frontier.png")
+    fig.savefig(chart_path)
+    print(f"Chart saved to: {chart_path}")
+
+
+if __name__ == "__main__":
+    main()
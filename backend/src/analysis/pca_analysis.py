@@ -14,10 +14,9 @@ from knn import KNN
 from common.distance_metrics import DistanceMetric
 from config import CACHE_DIR
 
-# Load raw (non-reduced) dataset
-xy_cache_path = os.path.join(CACHE_DIR, "Xy_dataset.npz")
-data = np.load(xy_cache_path, allow_pickle=True)
-X, y = data["X"], data["y"]
+# Load the raw (non-reduced) uint8 rasters; memory-mapped, the Preprocessor reads them in chunks
+X = np.load(os.path.join(CACHE_DIR, "X_raster.npy"), mmap_mode="r")
+y = np.load(os.path.join(CACHE_DIR, "y_raster.npy"))
 
 # PCA component sizes to evaluate
 component_counts = [16, 32, 56, 64, 86, 128]
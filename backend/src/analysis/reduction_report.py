@@ -0,0 +1,91 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import io
+import json
+import time
+
+import joblib
+import numpy as np
+import matplotlib.pyplot as plt
+from sklearn.metrics import accuracy_score
+
+from condensation import reduce_training_set
+from knn import KNN
+from common.distance_metrics import DistanceMetric
+from common.reduction_methods import ReductionMethod
+from config import CACHE_DIR
+
+# Reductions to compare against the full training set
+configurations = [
+    ("full", None, {}),
+    ("enn", ReductionMethod.ENN, {}),
+    ("cnn", ReductionMethod.CNN, {}),
+    ("enn_cnn", ReductionMethod.ENN_CNN, {}),
+    ("kmeans_50", ReductionMethod.KMEANS, {"per_class": 50}),
+    ("kmeans_200", ReductionMethod.KMEANS, {"per_class": 200}),
+    ("kmeans_500", ReductionMethod.KMEANS, {"per_class": 500}),
+]
+
+X_train = np.load(os.path.join(CACHE_DIR, "X_train.npy"))
+X_test = np.load(os.path.join(CACHE_DIR, "X_test.npy"))
+y_train = np.load(os.path.join(CACHE_DIR, "y_train.npy"))
+y_test = np.load(os.path.join(CACHE_DIR, "y_test.npy"))
+
+report = []
+
+for name, method, options in configurations:
+    print(f"Evaluating {name}...")
+
+    start = time.perf_counter()
+    if method is None:
+        X_reduced, y_reduced = X_train, y_train
+    else:
+        X_reduced, y_reduced = reduce_training_set(X_train, y_train, method, **options)
+    reduce_seconds = time.perf_counter() - start
+
+    model = KNN.from_data(X_reduced, y_reduced, k=5, metric=DistanceMetric.EUCLIDEAN)
+
+    start = time.perf_counter()
+    y_pred = model.predict_with_kd_tree_weighted_batch(X_test)
+    query_seconds = time.perf_counter() - start
+
+    artifact = io.BytesIO()
+    joblib.dump(model, artifact)
+
+    report.append({
+        "method": name,
+        "size": len(X_reduced),
+        "fraction": len(X_reduced) / len(X_train),
+        "accuracy": accuracy_score(y_test, y_pred),
+        "queries_per_second": len(X_test) / query_seconds,
+        "model_bytes": artifact.getbuffer().nbytes,
+        "reduce_seconds": reduce_seconds,
+    })
+
+print(f"{'method':<12} {'size':>8} {'fraction':>9} {'accuracy':>9} {'q/s':>8} {'model MB':>9}")
+for row in report:
+    print(f"{row['method']:<12} {row['size']:>8} {row['fraction']:>9.3f} {row['accuracy']:>9.4f} "
+          f"{row['queries_per_second']:>8.0f} {row['model_bytes'] / 1024 ** 2:>9.1f}")
+
+report_path = os.path.join(CACHE_DIR, "reduction_report.json")
+with open(report_path, "w") as f:
+    json.dump(report, f, indent=2)
+print(f"Report saved to: {report_path}")
+
+# Plot accuracy against index size
+plt.figure(figsize=(8, 5))
+for row in report:
+    plt.scatter(row["size"], row["accuracy"], color='cornflowerblue')
+    plt.annotate(row["method"], (row["size"], row["accuracy"]), textcoords="offset points", xytext=(5, 5))
+plt.xscale("log")
+plt.xlabel("Training points in the index")
+plt.ylabel("Accuracy")
+plt.title("Accuracy vs. Index Size after Training-Set Reduction")
+plt.grid(True)
+plt.tight_layout()
+
+chart_path = os.path.join(CACHE_DIR, "reduction_accuracy_vs_size.png")
+plt.savefig(chart_path)
+print(f"Chart saved to: {chart_path}")
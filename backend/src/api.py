@@ -1,20 +1,34 @@
-from typing import List, Tuple
-from fastapi import FastAPI
-from pydantic import BaseModel
-import joblib
+from typing import Annotated, List, Optional
+from contextlib import asynccontextmanager
+import time
+import anyio
 import numpy as np
+from fastapi import Body, FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field
 import os
 from fastapi.middleware.cors import CORSMiddleware
-import base64
-from PIL import Image
-import io
-import matplotlib.pyplot as plt
 from common.indexing_structures import IndexingStructure
 from common.distance_metrics import DistanceMetric
 from utils import draw_image
+from simplify import SIMPLIFY_TOLERANCE
+from stroke_codec import STROKES_CONTENT_TYPE, decode_strokes
 from config import CACHE_DIR
+from serving import SHARED_MODEL_ENV
+from model_pool import DEFAULT_MODEL_ID, ModelPool, UnknownModel
+from admission import AdmissionController, DeadlineRouter, QueueFull
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app):
+    # Admitted predictions run in the threadpool. It keeps its default threads for the
+    # sync routes and gets one more per prediction slot, so no admitted request waits there.
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    limiter.total_tokens += admission.max_concurrency
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.add_middleware(
@@ -25,54 +39,223 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-model_path = os.path.join(CACHE_DIR, "knn_model.pkl")
-preprocessor_path = os.path.join(CACHE_DIR, "preprocessor.pkl")
-
 categories_cache_path = os.path.join(CACHE_DIR, "categories.npy")
-categories = []
 
-if os.path.exists(categories_cache_path):
-    categories = np.load(categories_cache_path)
-    print(categories)
-    print("Loaded cached categories.")
-else:
+if not os.path.exists(categories_cache_path):
     raise ValueError("No cached categories were found.")
 
-model = joblib.load(model_path)
-preprocessor = joblib.load(preprocessor_path)
+# The pool owns the served models, one registry per model ID. Each registry holds a model,
+# its preprocessor and categories and swaps in retrained versions without a restart. The
+# default model is loaded now and never evicted; the others (cache/models/<model id>/) are
+# loaded on first use and evicted least recently used first once the pool exceeds its
+# memory budget. SHARED_MODEL_ENV is set by `serving.py` when the workers should attach to
+# shared, memory-mapped artifacts.
+pool_budget_mb = os.environ.get("QUICKDRAW_MODEL_POOL_BUDGET_MB")
+pool_size = os.environ.get("QUICKDRAW_MODEL_POOL_SIZE")
+pool = ModelPool(
+    cache_dir=CACHE_DIR,
+    memory_budget=int(float(pool_budget_mb) * 1024 ** 2) if pool_budget_mb else None,
+    max_models=int(pool_size) if pool_size else None,
+    shared_model_dir=os.environ.get(SHARED_MODEL_ENV),
+    poll_interval=float(os.environ.get("QUICKDRAW_MODEL_POLL_SECONDS", 5.0)),
+    watch=os.environ.get("QUICKDRAW_WATCH_MODEL", "1") == "1",
+)
+print(pool.registry(DEFAULT_MODEL_ID).current.categories)
+print("Loaded cached categories.")
+
+# Default latency budget of /predict in milliseconds; requests can set their own. Without
+# a budget every request is served with the index structure and k it asked for.
+DEFAULT_LATENCY_BUDGET_MS = os.environ.get("QUICKDRAW_LATENCY_BUDGET_MS")
+
+# Predictions running at once and requests waiting for a slot; requests beyond that get a
+# 503. Waiting requests do not take a thread, so the queue is not bounded by the threadpool.
+admission = AdmissionController(
+    max_concurrency=int(os.environ.get("QUICKDRAW_MAX_CONCURRENCY", os.cpu_count() or 4)),
+    max_queue=int(os.environ.get("QUICKDRAW_MAX_QUEUE", 32)),
+)
+
+# Live per-index-structure latency estimates, updated by every request served by the
+# default model. They are seeded by timing a few training points in the background the
+# first time a request with a latency budget arrives for a metric.
+router = DeadlineRouter()
+CALIBRATE_LATENCY = os.environ.get("QUICKDRAW_CALIBRATE_LATENCY", "1") == "1"
 
 
 # Set this to True during development to see the input image
 SHOW_PREPROCESSED_IMAGE = False
 
-class StrokeRequest(BaseModel):
-    strokes: List[List[List[float]]];
-    k: int = 5;
+class PredictOptions(BaseModel):
+    # Model to predict with; see GET /models
+    model_id: str = DEFAULT_MODEL_ID;
+    # Validated here for /predict and the query parameters of /predict/binary alike
+    k: int = Field(5, gt=0);
     metric: DistanceMetric = DistanceMetric.EUCLIDEAN;
-    indexing: str = IndexingStructure.KD_TREE;
+    # Defaults to the structure chosen by the tuning profile (KD tree without one)
+    indexing: Optional[str] = None;
+    # Restricts the prediction to these categories; None or an empty list allows all
+    categories: Optional[List[str]] = None;
+    # Number of classes the class_shortlist indexing searches; defaults to the model's setting
+    shortlist_classes: Optional[int] = Field(None, gt=0);
+    # Time the prediction may take; slower index structures are swapped for faster ones
+    latency_budget_ms: Optional[float] = None;
+    # Set when the client already ran `simplify_strokes` (the frontend's simplifyStrokes) on
+    # the strokes. They are rendered as sent, since a second pass could move them as far again.
+    simplified: bool = False;
+
+
+class StrokeRequest(PredictOptions):
+    strokes: List[List[List[float]]];
 
 
 @app.post("/predict")
-def predict(req: StrokeRequest):
+async def predict(req: StrokeRequest):
+    return await _admit_and_predict(req.strokes, req, time.perf_counter())
+
+
+@app.post("/predict/binary")
+async def predict_binary(options: Annotated[PredictOptions, Query()],
+                         payload: bytes = Body(..., media_type=STROKES_CONTENT_TYPE)):
+    """
+    Same as /predict, for strokes sent in the compact binary format of `stroke_codec.py`
+    (raw or base64 encoded) with the options as query parameters. The coordinates are
+    decoded straight into NumPy arrays instead of being validated float by float.
+    """
+    start = time.perf_counter()
+    try:
+        strokes = decode_strokes(payload)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await _admit_and_predict(strokes, options, start)
+
+
+def _registry(model_id):
+    try:
+        return pool.registry(model_id)
+    except UnknownModel as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
 
-    # 1. Convert strokes to processed 56x56 image using draw_image
-    image = draw_image(req.strokes, size=56)
-    arr = image.flatten().reshape(1, -1)
+async def _admit_and_predict(strokes, req, start):
+    # Requests wait for a slot on the event loop; only admitted ones take a worker thread
+    try:
+        async with admission.admit() as queue_seconds:
+            result = await run_in_threadpool(_predict, strokes, req, start)
+    except QueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e))
 
-    # 2. Optionally display the image
-    if SHOW_PREPROCESSED_IMAGE:
-        plt.imshow(image, cmap='gray')
-        plt.title("Preprocessed Input")
-        plt.axis('off')
-        plt.show()
+    result["strategy"]["queue_ms"] = round(queue_seconds * 1000, 3)
+    return result
 
-    # 3. Normalize and predict
-    arr = arr / 1.0  # already normalized by draw_image to [0,1]
-    processed = preprocessor.transform(arr)
-    prediction = model.adaptive_prediction(test_point=processed, k=req.k, metric=req.metric, indexing=req.indexing,)
 
-    return {"prediction": str(prediction)}
+def _predict(strokes, req, start):
+    registry = _registry(req.model_id)
+    budget_ms = req.latency_budget_ms if req.latency_budget_ms is not None else DEFAULT_LATENCY_BUDGET_MS
+
+    # The image is rendered for the version that predicts, so a hot reload to another
+    # raster size in between cannot hand its preprocessor an image of the old size
+    with registry.use() as version:
+        try:
+            indexing = IndexingStructure(req.indexing or version.model.default_indexing)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        # 1. Convert strokes to the model's processed image using draw_image, without the points it cannot show
+        image = draw_image(strokes, size=version.raster_size,
+                           tolerance=None if req.simplified else SIMPLIFY_TOLERANCE)
+        arr = image.flatten().reshape(1, -1)
+
+        # 2. Optionally display the image
+        if SHOW_PREPROCESSED_IMAGE:
+            import matplotlib.pyplot as plt
+            plt.imshow(image, cmap='gray')
+            plt.title("Preprocessed Input")
+            plt.axis('off')
+            plt.show()
+
+        # 3. Normalize and predict
+        arr = arr / 1.0  # already normalized by draw_image to [0,1]
+        processed = version.preprocessor.transform(arr)
+
+        # Whatever the queue and preprocessing used up is no longer available to the search
+        budget_seconds = None
+        if budget_ms is not None:
+            budget_seconds = float(budget_ms) / 1000 - (time.perf_counter() - start)
+            if CALIBRATE_LATENCY and req.model_id == DEFAULT_MODEL_ID:
+                router.calibrate_in_background(version.model, req.metric)
+        strategy = router.choose(indexing, req.k, req.metric, budget_seconds,
+                                 has_kd_tree=version.model.kd_tree is not None)
+
+        search_start = time.perf_counter()
+        try:
+            prediction = version.model.adaptive_prediction(test_point=processed, k=strategy["k"], metric=req.metric,
+                                                           indexing=strategy["indexing"],
+                                                           categories=req.categories or None,
+                                                           shortlist_classes=req.shortlist_classes)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        search_seconds = time.perf_counter() - search_start
+
+        # Category-restricted searches take a different path and other models have
+        # other sizes; either would skew the estimates
+        if not req.categories and req.model_id == DEFAULT_MODEL_ID:
+            router.tracker.record(strategy["indexing"], req.metric, search_seconds)
+
+    strategy["search_ms"] = round(search_seconds * 1000, 3)
+    return {"prediction": str(prediction), "strategy": strategy}
+
+class LabeledStrokeRequest(BaseModel):
+    strokes: List[List[List[float]]];
+    label: str;
+    model_id: str = DEFAULT_MODEL_ID;
+
+
+@app.post("/drawings")
+def add_drawing(req: LabeledStrokeRequest):
+    """
+    Adds a user-verified drawing to the live model. It is searchable immediately and
+    is folded into the search trees by a background compaction once enough drawings
+    have accumulated. It is recorded in the model's drawing log, so the other workers
+    add it within a poll interval and reloaded versions keep it.
+    """
+    if not req.strokes:
+        raise HTTPException(status_code=400, detail="Drawing has no strokes.")
+
+    try:
+        pending = _registry(req.model_id).add_drawing(req.strokes, req.label, tolerance=SIMPLIFY_TOLERANCE)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"added": 1, "pending": pending}
 
 @app.get("/categories")
-def get_categories():
-    return {"categories": list(categories)}
\ No newline at end of file
+def get_categories(model_id: str = DEFAULT_MODEL_ID):
+    return {"categories": list(_registry(model_id).current.categories)}
+
+@app.get("/models")
+def get_models():
+    """
+    Lists the models that can be requested by ID and the ones currently loaded.
+    """
+    return {"models": pool.available(), "loaded": pool.loaded()}
+
+@app.post("/admin/reload")
+def reload_model(model_id: str = DEFAULT_MODEL_ID):
+    """
+    Loads the artifacts currently in the model's directory in the background and swaps
+    them in once warmed up. Requests keep being served by the current version meanwhile.
+    """
+    started = _registry(model_id).reload()
+    return {"reloading": True, "started": started}
+
+@app.get("/metrics")
+def get_metrics():
+    registry = pool.registry(DEFAULT_MODEL_ID)
+    model = registry.current.model
+    return {
+        "model": registry.metrics(),
+        "model_pool": pool.metrics(),
+        "category_indexes": model.category_index_metrics(),
+        "class_shortlist": model.class_shortlist_metrics(),
+        "admission": admission.metrics(),
+        "routing": router.metrics(),
+    }
\ No newline at end of file
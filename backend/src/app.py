@@ -1,10 +1,70 @@
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk
 import numpy as np
 from PIL import Image, ImageDraw, ImageTk, ImageOps
 import random
+from simplify import SIMPLIFY_TOLERANCE
 from utils import draw_image
 
+# Milliseconds between checks for finished predictions on the Tk thread
+RESULT_POLL_INTERVAL = 30
+
+
+class PredictionWorker:
+    """
+    Runs predictions on a background thread so rendering and the KNN search never block
+    the Tk event loop.
+
+    At most one job waits at a time: a job submitted while another is waiting replaces
+    it, so a user who keeps drawing only gets the latest drawing predicted. Results are
+    put on `results` as (revision, result, error) and picked up by the Tk thread.
+    """
+
+    def __init__(self, predict):
+        """
+        Parameters:
+        - predict (callable): Called with a job's strokes on the worker thread; returns its result.
+        """
+        self._predict = predict
+        self._condition = threading.Condition()
+        self._pending = None
+        self._closed = False
+        self.results = queue.Queue()
+        self.superseded = 0
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, revision, strokes):
+        with self._condition:
+            if self._pending is not None:
+                self.superseded += 1
+            self._pending = (revision, strokes)
+            self._condition.notify()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._pending = None
+            self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending is None and not self._closed:
+                    self._condition.wait()
+                if self._closed:
+                    return
+                revision, strokes = self._pending
+                self._pending = None
+
+            try:
+                self.results.put((revision, self._predict(strokes), None))
+            except Exception as e:
+                self.results.put((revision, None, e))
+
+
 class DrawingApp(tk.Tk):
     def __init__(self, model, preprocessor, categories):
         super().__init__()
@@ -28,6 +88,12 @@ class DrawingApp(tk.Tk):
         self.strokes = []
         self.last_x, self.last_y = None, None
 
+        # Bumped on every change to the drawing. Predictions run for the revision they were
+        # submitted with and are only shown if the drawing has not changed since.
+        self._revision = 0
+        self._submitted_revision = 0
+        self._worker = PredictionWorker(self._predict_strokes)
+
         self.prediction_interval = 3  # seconds
         self.countdown = self.prediction_interval
 
@@ -40,6 +106,11 @@ class DrawingApp(tk.Tk):
         self.new_target()
 
         self.after(1000, self._countdown_tick)
+        self.after(RESULT_POLL_INTERVAL, self._poll_results)
+
+    def destroy(self):
+        self._worker.close()
+        super().destroy()
 
     def _build_ui(self):
         # Main container frame with horizontal layout
@@ -102,20 +173,27 @@ class DrawingApp(tk.Tk):
     def start_draw(self, event):
         self.last_x, self.last_y = event.x, event.y
         self.strokes.append([(self.last_x, self.last_y)])
+        self._revision += 1
 
     def draw(self, event):
         x, y = event.x, event.y
         if self.last_x is not None and self.last_y is not None:
             self.canvas.create_line(self.last_x, self.last_y, x, y, fill='black', width=6, capstyle=tk.ROUND, smooth=True)
             self.strokes[-1].append((x, y))
+            self._revision += 1
         self.last_x, self.last_y = x, y
 
     def end_draw(self, event):
         self.last_x, self.last_y = None, None
+        # Predict as soon as a stroke is finished rather than waiting for the timer
+        self._request_prediction()
 
     def clear_canvas(self):
         self.canvas.delete("all")
         self.strokes = []
+        # Results still in flight belong to the old drawing and are dropped
+        self._revision += 1
+        self._submitted_revision = self._revision
         self.prediction_label.config(text="Prediction: ---")
         self.congrats_label.config(text="")
         self.try_again_btn.config(state="disabled")
@@ -159,7 +237,7 @@ class DrawingApp(tk.Tk):
 
     #     return img  # Return PIL Image for preview and processing
 
-    def strokes_to_image(self, size=56):
+    def strokes_to_image(self, size=56, strokes=None):
         """
         Converts the user's drawing strokes into a grayscale PIL image, formatted to match
         the preprocessing used during model training.
@@ -172,18 +250,19 @@ class DrawingApp(tk.Tk):
         Parameters:
             size (int): The width and height (in pixels) of the output square image. 
                         Defaults to 56.
+            strokes (list): Strokes as lists of (x, y) points. Defaults to the current drawing.
 
         Returns:
             PIL.Image.Image: A grayscale image ("L" mode) of the rendered drawing, 
                             scaled to the specified size and normalized to 8-bit pixels (0–255).
         """
         formatted_strokes = []
-        for stroke in self.strokes:
+        for stroke in (self.strokes if strokes is None else strokes):
             if len(stroke) > 1:
                 xs, ys = zip(*stroke)
                 formatted_strokes.append((xs, ys))
 
-        image_array = draw_image(strokes=formatted_strokes, size=size)
+        image_array = draw_image(strokes=formatted_strokes, size=size, tolerance=SIMPLIFY_TOLERANCE)
         image_array = (image_array * 255).astype(np.uint8)
         return Image.fromarray(image_array, mode="L")
 
@@ -203,36 +282,60 @@ class DrawingApp(tk.Tk):
             self.timer_label.config(text=f"Next prediction in: {self.countdown} s")
             self.after(1000, self._countdown_tick)
         else:
-            self._make_prediction()
+            self._request_prediction()
             self.countdown = self.prediction_interval
             self.timer_label.config(text=f"Next prediction in: {self.countdown} s")
             self.after(1000, self._countdown_tick)
 
-    def _make_prediction(self):
-        if not self.strokes:
-            self.prediction_label.config(text="Prediction: ---")
-            self._update_processed_image(None)
+    def _request_prediction(self):
+        """
+        Hands the current drawing to the prediction worker unless it was already submitted
+        unchanged. Runs on the Tk thread; only a copy of the strokes leaves it.
+        """
+        if self._revision == self._submitted_revision or not self.strokes:
             return
+        self._submitted_revision = self._revision
+        self._worker.submit(self._revision, [list(stroke) for stroke in self.strokes])
+
+    def _predict_strokes(self, strokes):
+        """
+        Renders, preprocesses and classifies a drawing. Runs on the worker thread.
 
+        Returns:
+        - tuple: (predicted label, PIL image of the rendered drawing).
+        """
+        pil_img = self.strokes_to_image(strokes=strokes)
+        vec = np.array(pil_img).flatten().reshape(1, -1) / 255.0
+        vec_reduced = self.preprocessor.transform(vec)
+        return self.model.predict_with_kd_tree_weighted(vec_reduced[0]), pil_img
+
+    def _poll_results(self):
         try:
-            pil_img = self.strokes_to_image()
-            vec = np.array(pil_img).flatten().reshape(1, -1) / 255.0
-            vec_reduced = self.preprocessor.transform(vec)
-            pred = self.model.predict_with_kd_tree_weighted(vec_reduced[0])
-
-            self.prediction_label.config(text=f"Prediction: {pred}")
-            self._update_processed_image(pil_img)
-
-            if pred == self.target_category:
-                self.congrats_label.config(text="🎉 Congratulations! You drew it correctly! 🎉")
-                self.try_again_btn.config(state="normal")
-                self.clear_btn.config(state="disabled")
-            else:
-                self.congrats_label.config(text="")
-                self.try_again_btn.config(state="disabled")
-                self.clear_btn.config(state="normal")
-
-        except Exception as e:
+            while True:
+                revision, result, error = self._worker.results.get_nowait()
+                # Drawings that changed since the job was submitted get a newer prediction
+                if revision == self._revision:
+                    self._show_prediction(result, error)
+        except queue.Empty:
+            pass
+        self.after(RESULT_POLL_INTERVAL, self._poll_results)
+
+    def _show_prediction(self, result, error):
+        if error is not None:
             self.prediction_label.config(text="Prediction error")
-            print(f"Prediction error: {e}")
+            print(f"Prediction error: {error}")
             self._update_processed_image(None)
+            return
+
+        pred, pil_img = result
+        self.prediction_label.config(text=f"Prediction: {pred}")
+        self._update_processed_image(pil_img)
+
+        if pred == self.target_category:
+            self.congrats_label.config(text="🎉 Congratulations! You drew it correctly! 🎉")
+            self.try_again_btn.config(state="normal")
+            self.clear_btn.config(state="disabled")
+        else:
+            self.congrats_label.config(text="")
+            self.try_again_btn.config(state="disabled")
+            self.clear_btn.config(state="normal")
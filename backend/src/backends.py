@@ -0,0 +1,146 @@
+import importlib
+import numpy as np
+from common.compute_backend import ComputeBackend
+from common.distance_metrics import DistanceMetric
+
+
+class NumpyBackend:
+    """
+    Default CPU backend for the brute-force distance and top-k computations.
+
+    Every backend exposes the same three methods, so `KNN` can run its brute-force
+    paths on any of them and always receives NumPy arrays back for the vote.
+    """
+
+    name = ComputeBackend.NUMPY
+
+    def __init__(self):
+        self.xp = np
+
+    def prepare(self, features):
+        """
+        Returns the training features in the backend's array type.
+        """
+        return features
+
+    def pairwise_distances(self, points, features, metric):
+        """
+        Computes the (len(points), len(features)) distance matrix.
+
+        Parameters:
+        - points (array-like): Queries of shape (n_queries, n_features).
+        - features: Training features as returned by `prepare`.
+        - metric (DistanceMetric): EUCLIDEAN or MANHATTAN.
+        """
+        xp = self.xp
+        points = xp.asarray(points)
+        diffs = points[:, None, :] - features[None, :, :]
+
+        # Transform the difference array in place so a tile never holds two copies of it
+        if metric == DistanceMetric.EUCLIDEAN:
+            return xp.sqrt(xp.sum(xp.square(diffs, out=diffs), axis=2))
+        elif metric == DistanceMetric.MANHATTAN:
+            return xp.sum(xp.abs(diffs, out=diffs), axis=2)
+        else:
+            raise ValueError(f"Unsupported distance metric: {metric}")
+
+    def smallest_k(self, dists, k):
+        """
+        Selects the k smallest distances of every row.
+
+        Returns:
+        - tuple: (dists, indices) as NumPy arrays of shape (n_queries, k), sorted by ascending distance.
+        """
+        xp = self.xp
+        k = min(k, dists.shape[1])
+        if k < dists.shape[1]:
+            indices = xp.argpartition(dists, kth=k - 1, axis=1)[:, :k]
+        else:
+            indices = xp.broadcast_to(xp.arange(dists.shape[1]), dists.shape)
+        neighbor_dists = xp.take_along_axis(dists, indices, axis=1)
+        order = xp.argsort(neighbor_dists, axis=1)
+
+        return (self.to_numpy(xp.take_along_axis(neighbor_dists, order, axis=1)),
+                self.to_numpy(xp.take_along_axis(indices, order, axis=1)))
+
+    def to_numpy(self, array):
+        return np.asarray(array)
+
+
+class CupyBackend(NumpyBackend):
+    """
+    GPU backend using CuPy. Training features are copied to the device once and
+    reused; only the k nearest distances and indices come back to the host.
+    """
+
+    name = ComputeBackend.CUPY
+
+    def __init__(self):
+        self.xp = importlib.import_module("cupy")
+        self._host_features = None
+        self._device_features = None
+
+    def prepare(self, features):
+        if features is not self._host_features:
+            self._device_features = self.xp.asarray(features)
+            self._host_features = features
+        return self._device_features
+
+    def to_numpy(self, array):
+        return self.xp.asnumpy(array)
+
+
+# Backend factories by name. Factories are only called when a backend is first used,
+# so optional dependencies such as CuPy are never imported unless requested.
+_BACKEND_FACTORIES = {
+    ComputeBackend.NUMPY: NumpyBackend,
+    ComputeBackend.CUPY: CupyBackend,
+}
+_BACKENDS = {}
+
+
+def register_backend(name, factory):
+    """
+    Registers an additional compute backend.
+
+    Parameters:
+    - name (ComputeBackend or str): Name the backend is selected by.
+    - factory (callable): Creates the backend; may raise ImportError if its dependencies are missing.
+    """
+    _BACKEND_FACTORIES[name] = factory
+    _BACKENDS.pop(name, None)
+
+
+def get_backend(name=ComputeBackend.NUMPY):
+    """
+    Returns the (cached) backend instance for a name.
+
+    Raises:
+    - ValueError: If no backend is registered under the name.
+    - ImportError: If the backend's optional dependency is not installed.
+    """
+    try:
+        name = ComputeBackend(name)
+    except ValueError:
+        pass
+
+    if name not in _BACKENDS:
+        if name not in _BACKEND_FACTORIES:
+            raise ValueError(f"Unknown compute backend: {name}")
+        _BACKENDS[name] = _BACKEND_FACTORIES[name]()
+    return _BACKENDS[name]
+
+
+def available_backends():
+    """
+    Returns:
+    - list: Names of the registered backends whose dependencies can be imported.
+    """
+    available = []
+    for name in _BACKEND_FACTORIES:
+        try:
+            get_backend(name)
+        except ImportError:
+            continue
+        available.append(name)
+    return available
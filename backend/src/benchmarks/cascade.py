@@ -0,0 +1,77 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import time
+
+import numpy as np
+
+from common.distance_metrics import DistanceMetric
+from common.indexing_structures import IndexingStructure
+from config import CACHE_DIR
+from knn import KNN
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy and speed of the PCA-prefix cascade search.")
+    parser.add_argument("--dims", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--shortlists", type=int, nargs="+", default=[16, 64, 256])
+    parser.add_argument("--coarse", default=IndexingStructure.KD_TREE.value,
+                        choices=[IndexingStructure.KD_TREE.value, IndexingStructure.BRUTE_FORCE.value])
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--replicate", type=int, default=1,
+                        help="tile the training set this many times (with jitter) to simulate a larger index")
+    args = parser.parse_args()
+
+    X_train = np.load(os.path.join(CACHE_DIR, "X_train.npy"))
+    y_train = np.load(os.path.join(CACHE_DIR, "y_train.npy"))
+    X_test = np.load(os.path.join(CACHE_DIR, "X_test.npy"))[:args.queries]
+    y_test = np.load(os.path.join(CACHE_DIR, "y_test.npy"))[:args.queries]
+
+    if args.replicate > 1:
+        rng = np.random.default_rng(0)
+        X_train = np.concatenate([X_train + rng.normal(0, 0.01, X_train.shape) for _ in range(args.replicate)])
+        y_train = np.tile(y_train, args.replicate)
+
+    model = KNN.from_data(X_train, y_train, k=args.k)
+    print(f"Training points: {len(X_train)} x {X_train.shape[1]}, queries: {len(X_test)}, coarse: {args.coarse}")
+
+    start = time.perf_counter()
+    expected = model.predict_with_kd_tree_weighted_batch(X_test, k=args.k)
+    kd_qps = len(X_test) / (time.perf_counter() - start)
+    _, expected_indices = model.kd_tree.query(X_test, k=args.k)
+    print(f"kd_tree reference: {kd_qps:.0f} q/s, accuracy {np.mean(expected == y_test):.4f}")
+
+    print(f"{'dims':>5} {'shortlist':>9} {'q/s':>8} {'recall':>7} {'certified':>9} {'accuracy':>9} {'agreement':>10}")
+    for dims in args.dims:
+        for shortlist in args.shortlists:
+            model.predict_cascade_batch(X_test[:1], prefix_dims=dims, shortlist=shortlist, coarse=args.coarse)
+
+            start = time.perf_counter()
+            y_pred = model.predict_cascade_batch(X_test, k=args.k, prefix_dims=dims, shortlist=shortlist,
+                                                 coarse=args.coarse)
+            qps = len(X_test) / (time.perf_counter() - start)
+
+            _, indices = model.cascade_neighbors(X_test, k=args.k, prefix_dims=dims, shortlist=shortlist,
+                                                 coarse=args.coarse)
+            recall = np.mean([len(np.intersect1d(a, b)) / args.k for a, b in zip(indices, expected_indices)])
+            certified = np.mean(model._cascade_tile(X_test, model.training_features, args.k, DistanceMetric.EUCLIDEAN,
+                                                    min(dims, X_train.shape[1]), min(shortlist, len(X_train)),
+                                                    IndexingStructure(args.coarse))[2])
+
+            print(f"{dims:>5} {shortlist:>9} {qps:>8.0f} {recall:>7.4f} {certified:>9.4f} "
+                  f"{np.mean(y_pred == y_test):>9.4f} {np.mean(y_pred == expected):>10.4f}")
+
+    # Exactness check: widening every uncertified shortlist must reproduce the KD tree exactly
+    y_exact = model.predict_cascade_batch(X_test, k=args.k, prefix_dims=min(args.dims),
+                                          shortlist=min(args.shortlists), coarse=args.coarse, exact=True)
+    agreement = np.mean(y_exact == expected)
+    print(f"exact=True agreement with predict_with_kd_tree_weighted_batch: {agreement:.4f}")
+    if agreement != 1.0:
+        sys.exit("Cascade search with exact=True does not match the KD tree.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import contextlib
+import glob
+import http.client
+import itertools
+import json
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import joblib
+import numpy as np
+import psutil
+
+from common.distance_metrics import DistanceMetric
+from common.indexing_structures import IndexingStructure
+from config import CACHE_DIR
+from utils import get_data
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+RAW_DATA_DIR = os.path.join(os.path.dirname(SRC_DIR), "data", "raw")
+
+
+def load_drawings(max_per_category=200, source="raw"):
+    """
+    Loads real QuickDraw drawings to replay against the API.
+
+    Parameters:
+    - max_per_category (int): Maximum number of drawings to take from each category.
+    - source (str): "raw" to read `data/raw/*.ndjson`, "cache" to read the cached `datasets_dict.pkl`.
+
+    Returns:
+    - list: List of (label, strokes) tuples, shuffled.
+    """
+    drawings = []
+
+    if source == "cache":
+        datasets = joblib.load(os.path.join(CACHE_DIR, "datasets_dict.pkl"))
+        for label, items in datasets.items():
+            drawings.extend((label, item["drawing"]) for item in items[:max_per_category])
+    elif source == "raw":
+        for path in sorted(glob.glob(os.path.join(RAW_DATA_DIR, "*.ndjson"))):
+            filename = os.path.basename(path)
+            label = os.path.splitext(filename)[0]
+            drawings.extend((label, item["drawing"]) for item in get_data(filename, max_per_category))
+    else:
+        raise ValueError(f"Unsupported drawing source: {source}")
+
+    if not drawings:
+        raise ValueError(f"No drawings found for source '{source}'.")
+
+    random.Random(42).shuffle(drawings)
+    return drawings
+
+
+def start_server(port=8000, workers=1, env=None, app="api:app"):
+    """
+    Starts a local uvicorn server for the API in a subprocess.
+
+    Parameters:
+    - port (int): Port to bind on 127.0.0.1.
+    - workers (int): Number of uvicorn worker processes.
+    - env (dict, optional): Extra environment variables for the server process.
+    - app (str): ASGI application import path.
+
+    Returns:
+    - subprocess.Popen: The running server process.
+    """
+    server_env = dict(os.environ)
+    if env:
+        server_env.update(env)
+
+    command = [sys.executable, "-m", "uvicorn", app, "--host", "127.0.0.1",
+               "--port", str(port), "--workers", str(workers), "--log-level", "warning"]
+    return subprocess.Popen(command, cwd=SRC_DIR, env=server_env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_until_ready(host, port, timeout=120.0, process=None):
+    """
+    Polls `/categories` until the server answers or the timeout expires.
+
+    Raises:
+    - RuntimeError: If the server process exits or does not become ready in time.
+    """
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited early with code {process.returncode}.")
+        try:
+            conn = http.client.HTTPConnection(host, port, timeout=2)
+            conn.request("GET", "/categories")
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.25)
+    raise RuntimeError(f"Server at {host}:{port} was not ready after {timeout:.0f} seconds.")
+
+
+def stop_server(process):
+    """
+    Terminates a server started with `start_server`, including its worker processes.
+    """
+    try:
+        children = psutil.Process(process.pid).children(recursive=True)
+    except psutil.NoSuchProcess:
+        children = []
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+    for child in children:
+        if child.is_running():
+            child.kill()
+
+
+def process_tree_memory(pid):
+    """
+    Measures the memory of a process and all of its children.
+
+    Returns:
+    - dict: Summed `rss` and, where the platform exposes it, `pss`/`uss` in bytes.
+    """
+    root = psutil.Process(pid)
+    totals = {"rss": 0, "pss": 0, "uss": 0, "processes": 0}
+    for proc in [root] + root.children(recursive=True):
+        try:
+            info = proc.memory_full_info()
+        except (psutil.NoSuchProcess, psutil.AccessDenied):
+            continue
+        totals["rss"] += info.rss
+        totals["pss"] += getattr(info, "pss", 0)
+        totals["uss"] += getattr(info, "uss", 0)
+        totals["processes"] += 1
+    return totals
+
+
+class RssSampler:
+    """
+    Background thread that samples the RSS of a server process tree and keeps the peak.
+    """
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak_rss = 0
+        self.last_rss = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.last_rss = process_tree_memory(self.pid)["rss"]
+                self.peak_rss = max(self.peak_rss, self.last_rss)
+            except psutil.NoSuchProcess:
+                return
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class PredictClient:
+    """
+    Minimal keep-alive HTTP client with one connection per thread.
+    """
+
+    def __init__(self, host, port, timeout=30.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def post(self, path, body):
+        """
+        Sends a JSON POST request.
+
+        Returns:
+        - bool: True if the server answered with HTTP 200.
+        """
+        conn = self._connection()
+        try:
+            conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            response.read()
+            return response.status == 200
+        except (OSError, http.client.HTTPException):
+            conn.close()
+            self._local.conn = None
+            return False
+
+
+def build_payloads(drawings, k, metric, indexing):
+    """
+    Pre-serializes `/predict` request bodies so JSON encoding stays out of the timed loop.
+    """
+    return [
+        json.dumps({"strokes": strokes, "k": k, "metric": metric.value, "indexing": indexing.value}).encode()
+        for _, strokes in drawings
+    ]
+
+
+def run_closed_loop(client, payloads, concurrency, duration):
+    """
+    Closed-loop load: `concurrency` clients each send their next request as soon as
+    the previous one completes, so offered load adapts to server speed.
+
+    Returns:
+    - tuple: (latencies in seconds, error count, elapsed seconds)
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            body = payloads[next(counter) % len(payloads)]
+            start = time.perf_counter()
+            ok = client.post("/predict", body)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def run_open_loop(client, payloads, rate, duration, max_outstanding=256, drain_timeout=30.0):
+    """
+    Open-loop load: requests arrive as a Poisson process at `rate` requests/second
+    regardless of how fast the server answers. Latency is measured from the scheduled
+    arrival time, so client-side queueing behind a slow server is counted and
+    queueing collapse shows up as exploding tail latencies instead of lower throughput.
+
+    Returns:
+    - tuple: (latencies in seconds, error count, elapsed seconds)
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    rng = np.random.default_rng(42)
+
+    def send(body, scheduled):
+        ok = client.post("/predict", body)
+        elapsed = time.perf_counter() - scheduled
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors[0] += 1
+
+    executor = ThreadPoolExecutor(max_workers=max_outstanding)
+    futures = []
+    start = time.perf_counter()
+    scheduled = start
+    i = 0
+    while scheduled < start + duration:
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        futures.append(executor.submit(send, payloads[i % len(payloads)], scheduled))
+        scheduled += rng.exponential(1.0 / rate)
+        i += 1
+
+    _, not_done = wait(futures, timeout=drain_timeout)
+    for future in not_done:
+        future.cancel()
+    executor.shutdown(wait=False, cancel_futures=True)
+    with lock:
+        errors[0] += len(not_done)
+    return latencies, errors[0], time.perf_counter() - start
+
+
+def summarize(latencies, errors, elapsed):
+    """
+    Computes latency percentiles, throughput and error rate for one run.
+    """
+    total = len(latencies) + errors
+    summary = {
+        "requests": total,
+        "throughput_rps": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "error_rate": errors / total if total else 0.0,
+    }
+    if latencies:
+        lat_ms = np.asarray(latencies) * 1000
+        summary.update({
+            "mean_ms": float(lat_ms.mean()),
+            "p50_ms": float(np.percentile(lat_ms, 50)),
+            "p90_ms": float(np.percentile(lat_ms, 90)),
+            "p99_ms": float(np.percentile(lat_ms, 99)),
+            "max_ms": float(lat_ms.max()),
+        })
+    return summary
+
+
+def supported_combinations(k_values, metrics, indexings):
+    """
+    Yields the (k, metric, indexing) combinations the model can serve.
+    KD_TREE only supports the EUCLIDEAN metric.
+    """
+    for k, metric, indexing in itertools.product(k_values, metrics, indexings):
+        if indexing == IndexingStructure.KD_TREE and metric != DistanceMetric.EUCLIDEAN:
+            continue
+        yield k, metric, indexing
+
+
+def sweep(client, drawings, k_values, metrics, indexings, mode="closed", concurrency=8,
+          rate=50.0, duration=10.0, server_pid=None, warmup=20):
+    """
+    Runs one load test per supported (k, metric, indexing) combination.
+
+    Returns:
+    - list: One result dict per combination.
+    """
+    results = []
+    for k, metric, indexing in supported_combinations(k_values, metrics, indexings):
+        payloads = build_payloads(drawings, k, metric, indexing)
+        for body in payloads[:warmup]:
+            client.post("/predict", body)
+
+        with RssSampler(server_pid) if server_pid else contextlib.nullcontext() as sampler:
+            if mode == "closed":
+                latencies, errors, elapsed = run_closed_loop(client, payloads, concurrency, duration)
+            elif mode == "open":
+                latencies, errors, elapsed = run_open_loop(client, payloads, rate, duration)
+            else:
+                raise ValueError(f"Unsupported load mode: {mode}")
+
+        result = {"k": k, "metric": metric.value, "indexing": indexing.value, "mode": mode,
+                  "concurrency": concurrency if mode == "closed" else None,
+                  "rate": rate if mode == "open" else None}
+        result.update(summarize(latencies, errors, elapsed))
+        if sampler:
+            result["server_peak_rss_mb"] = sampler.peak_rss / 2**20
+            result["server_rss_mb"] = sampler.last_rss / 2**20
+        results.append(result)
+        print_result(result)
+    return results
+
+
+def print_result(result):
+    load = f"c={result['concurrency']}" if result["mode"] == "closed" else f"rate={result['rate']:g}/s"
+    line = (f"k={result['k']:<3} {result['metric']:<10} {result['indexing']:<12} {load:<12} "
+            f"rps={result['throughput_rps']:8.1f} err={result['error_rate']:6.2%}")
+    if "p50_ms" in result:
+        line += f" p50={result['p50_ms']:7.1f}ms p90={result['p90_ms']:7.1f}ms p99={result['p99_ms']:7.1f}ms"
+    if "server_peak_rss_mb" in result:
+        line += f" rss={result['server_peak_rss_mb']:.0f}MB"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay QuickDraw drawings against the /predict API.")
+    parser.add_argument("--url", help="host:port of an already running server (default: start api:app locally)")
+    parser.add_argument("--server-pid", type=int, help="PID of an external server, for RSS sampling")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--source", choices=["raw", "cache"], default="raw")
+    parser.add_argument("--samples", type=int, default=200, help="drawings per category")
+    parser.add_argument("--mode", choices=["closed", "open", "both"], default="both")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--rate", type=float, nargs="+", default=[20.0, 100.0, 400.0])
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--k", type=int, nargs="+", default=[5])
+    parser.add_argument("--metric", nargs="+", default=[m.value for m in DistanceMetric])
+    parser.add_argument("--indexing", nargs="+", default=[i.value for i in IndexingStructure])
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    drawings = load_drawings(args.samples, args.source)
+    print(f"Loaded {len(drawings)} drawings.")
+
+    metrics = [DistanceMetric(m) for m in args.metric]
+    indexings = [IndexingStructure(i) for i in args.indexing]
+
+    process = None
+    if args.url:
+        host, port = args.url.rsplit(":", 1)
+        port = int(port)
+        server_pid = args.server_pid
+    else:
+        host, port = "127.0.0.1", args.port
+        process = start_server(port=port, workers=args.workers)
+        server_pid = process.pid
+
+    results = []
+    try:
+        wait_until_ready(host, port, process=process)
+        client = PredictClient(host, port)
+        if server_pid:
+            print(f"Server idle RSS: {process_tree_memory(server_pid)['rss'] / 2**20:.0f} MB")
+
+        if args.mode in ("closed", "both"):
+            for concurrency in args.concurrency:
+                results += sweep(client, drawings, args.k, metrics, indexings, mode="closed",
+                                 concurrency=concurrency, duration=args.duration, server_pid=server_pid)
+        if args.mode in ("open", "both"):
+            for rate in args.rate:
+                results += sweep(client, drawings, args.k, metrics, indexings, mode="open",
+                                 rate=rate, duration=args.duration, server_pid=server_pid)
+    finally:
+        if process is not None:
+            stop_server(process)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
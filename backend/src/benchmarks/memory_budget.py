@@ -0,0 +1,128 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import multiprocessing
+import resource
+import time
+
+import numpy as np
+import psutil
+
+from config import CACHE_DIR
+from knn import KNN
+
+PREDICTORS = {
+    "brute_force": lambda model, X: model.predict_weighted_batch(X),
+    "brute_force_manhattan": lambda model, X: model.predict_weighted_batch_manhattan(X),
+    "ball_tree": lambda model, X: model.predict_with_ball_tree_weighted_batch(X),
+    "kd_tree": lambda model, X: model.predict_with_kd_tree_weighted_batch(X),
+}
+
+
+def load_data(n_queries, replicate):
+    X_train = np.load(os.path.join(CACHE_DIR, "X_train.npy"))
+    y_train = np.load(os.path.join(CACHE_DIR, "y_train.npy"))
+    X_test = np.load(os.path.join(CACHE_DIR, "X_test.npy"))[:n_queries]
+
+    if replicate > 1:
+        rng = np.random.default_rng(0)
+        X_train = np.concatenate([X_train + rng.normal(0, 0.01, X_train.shape) for _ in range(replicate)])
+        y_train = np.tile(y_train, replicate)
+    return X_train, y_train, X_test
+
+
+def reset_peak_rss():
+    """
+    Resets the kernel's peak-RSS counter of this process (Linux only).
+
+    Returns:
+    - bool: True if the counter was reset, so VmHWM only covers what runs afterwards.
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """
+    Peak RSS of this process in bytes.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def measure(predictor, memory_budget, n_queries, replicate):
+    """
+    Runs one batch prediction in a fresh process and reports how much memory it used
+    on top of the fitted model.
+    """
+    X_train, y_train, X_test = load_data(n_queries, replicate)
+    model = KNN.from_data(X_train, y_train, k=5, memory_budget=memory_budget)
+    brute_force = predictor.startswith("brute_force")
+    tile = model.tile_size(X_test, brute_force=brute_force)
+
+    baseline_rss = psutil.Process().memory_info().rss
+    exact = reset_peak_rss()
+    start = time.perf_counter()
+    y_pred = PREDICTORS[predictor](model, X_test)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "tile": tile,
+        "working_bytes": max(0, peak_rss() - baseline_rss),
+        "exact": exact,
+        "qps": len(X_test) / elapsed,
+        "predictions": y_pred,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Peak memory of the batch predictors under different memory budgets.")
+    parser.add_argument("--predictor", choices=list(PREDICTORS), default="brute_force")
+    parser.add_argument("--budgets-mb", type=float, nargs="+", default=[16, 64, 256, 1024],
+                        help="memory budgets to test; 0 means no budget (fixed batches of 100)")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--replicate", type=int, default=1,
+                        help="tile the training set this many times (with jitter) to simulate a larger index")
+    args = parser.parse_args()
+
+    # Every measurement runs in its own process so peaks from earlier runs do not carry over
+    context = multiprocessing.get_context("spawn")
+    results = []
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for budget_mb in args.budgets_mb:
+            budget = int(budget_mb * 1024 ** 2) if budget_mb > 0 else None
+            result = pool.apply(measure, (args.predictor, budget, args.queries, args.replicate))
+            results.append((budget_mb, result))
+
+    reference = results[0][1]["predictions"]
+    print(f"Predictor: {args.predictor}, queries: {args.queries}")
+    print(f"{'budget MB':>10} {'tile':>6} {'peak MB':>9} {'within':>7} {'q/s':>8} {'agreement':>10}")
+    for budget_mb, result in results:
+        peak_mb = result["working_bytes"] / 1024 ** 2
+        within = "-" if budget_mb <= 0 else ("yes" if peak_mb <= budget_mb else "no")
+        if not result["exact"]:
+            within += "*"
+        agreement = np.mean(result["predictions"] == reference)
+        budget = f"{budget_mb:g}" if budget_mb > 0 else "none"
+        print(f"{budget:>10} {result['tile']:>6} {peak_mb:>9.1f} {within:>7} {result['qps']:>8.0f} {agreement:>10.4f}")
+
+    if not all(result["exact"] for _, result in results):
+        print("* peak RSS could not be reset; peaks include loading and fitting the model")
+
+
+if __name__ == "__main__":
+    main()
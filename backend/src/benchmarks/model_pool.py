@@ -0,0 +1,100 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import shutil
+import tempfile
+import time
+
+import joblib
+import numpy as np
+import psutil
+
+from common.distance_metrics import DistanceMetric
+from common.indexing_structures import IndexingStructure
+from config import CACHE_DIR
+from knn import KNN
+from model_pool import DEFAULT_MODEL_ID, ModelPool, estimate_nbytes
+
+
+def build_models(models_dir, n_models, categories_per_model, seed):
+    """
+    Writes `n_models` category-pack models trained on subsets of the cached training set.
+    They all reuse the cached preprocessor, as packs cut from one dataset would.
+    """
+    X_train = np.load(os.path.join(CACHE_DIR, "X_train.npy"))
+    y_train = np.load(os.path.join(CACHE_DIR, "y_train.npy"))
+    categories = np.unique(y_train)
+    rng = np.random.default_rng(seed)
+
+    model_ids = []
+    for i in range(n_models):
+        pack = np.sort(rng.choice(categories, size=min(categories_per_model, len(categories)), replace=False))
+        mask = np.isin(y_train, pack)
+        model_dir = os.path.join(models_dir, f"pack-{i}")
+        os.makedirs(model_dir)
+        joblib.dump(KNN.from_data(X_train[mask], y_train[mask], k=5), os.path.join(model_dir, "knn_model.pkl"))
+        shutil.copyfile(os.path.join(CACHE_DIR, "preprocessor.pkl"), os.path.join(model_dir, "preprocessor.pkl"))
+        np.save(os.path.join(model_dir, "categories.npy"), pack)
+        model_ids.append(f"pack-{i}")
+    return model_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hit rate, latency, evictions and memory of the API's model pool.")
+    parser.add_argument("--models", type=int, default=6, help="category-pack models besides the default one")
+    parser.add_argument("--categories", type=int, default=10, help="categories per pack")
+    parser.add_argument("--budget-models", type=float, default=3.0,
+                        help="memory budget as a multiple of the default model's estimated size")
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--skew", type=float, default=1.2, help="Zipf exponent of the model popularity")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as models_dir:
+        model_ids = build_models(models_dir, args.models, args.categories, args.seed)
+
+        pool = ModelPool(models_dir=models_dir, watch=False)
+        default = pool.registry(DEFAULT_MODEL_ID).current
+        # After the default model's warm-up, which compiles kernels and imports lazily
+        process = psutil.Process()
+        baseline_rss = process.memory_info().rss
+        default_bytes = estimate_nbytes(default.model) + estimate_nbytes(default.preprocessor)
+        pool.memory_budget = int(args.budget_models * default_bytes)
+
+        rng = np.random.default_rng(args.seed)
+        popularity = 1 / np.arange(1, len(model_ids) + 2) ** args.skew
+        requests = rng.choice([DEFAULT_MODEL_ID] + model_ids, size=args.requests, p=popularity / popularity.sum())
+        queries = np.ones((1, default.preprocessor.scaler.n_features_in_))
+
+        latencies = {"hit": [], "load": []}
+        peak_pool_bytes = 0
+        for model_id in requests:
+            loads = pool.metrics()["loads"]
+            start = time.perf_counter()
+            with pool.use(model_id) as version:
+                processed = version.preprocessor.transform(queries)
+                version.model.adaptive_prediction(processed, k=5, metric=DistanceMetric.EUCLIDEAN,
+                                                  indexing=IndexingStructure.KD_TREE)
+            elapsed = time.perf_counter() - start
+            metrics = pool.metrics()
+            latencies["load" if metrics["loads"] > loads else "hit"].append(elapsed * 1000)
+            peak_pool_bytes = max(peak_pool_bytes, metrics["memory_bytes"])
+
+        metrics = pool.metrics()
+        pool.close()
+        print(f"{len(model_ids) + 1} models, default model ~{default_bytes / 2**20:.1f} MB, "
+              f"budget {pool.memory_budget / 2**20:.1f} MB, {args.requests} requests")
+        print(f"{'request':<8} {'count':>6} {'mean ms':>9} {'p99 ms':>9}")
+        for kind, values in latencies.items():
+            if values:
+                print(f"{kind:<8} {len(values):>6} {np.mean(values):>9.2f} {np.percentile(values, 99):>9.2f}")
+        print(f"evictions {metrics['evictions']}, loaded at the end {metrics['size']}, "
+              f"peak pool memory {peak_pool_bytes / 2**20:.1f} MB")
+        print(f"preprocessor loads {metrics['preprocessor_loads']}, shared {metrics['preprocessors_shared']}")
+        print(f"process RSS growth after the default model {(process.memory_info().rss - baseline_rss) / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import tempfile
+
+import main as training
+from common.profile_mode import ProfileMode
+from pipeline import PROFILE_LOG
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage peak memory and time of the training pipeline as samples per class grow.")
+    parser.add_argument("--samples", type=int, nargs="+", default=[500, 1000, 2000, 4000], help="samples per class")
+    parser.add_argument("--categories", type=int, help="use the first N of main.CATEGORIES")
+    parser.add_argument("--profile", choices=[mode.value for mode in ProfileMode if mode != ProfileMode.NONE],
+                        default=ProfileMode.RSS.value)
+    parser.add_argument("--output", default=PROFILE_LOG, help="JSON lines file the reports are appended to")
+    args = parser.parse_args()
+
+    if args.categories:
+        training.CATEGORIES = training.CATEGORIES[:args.categories]
+
+    print(f"{'samples':>8} {'total s':>8} {'peak RSS MB':>12}  largest stage")
+    for samples in args.samples:
+        training.SAMPLES_PER_CLASS = samples
+        # A fresh pipeline cache, so that every stage is computed and measured. The rendered
+        # image store is shared between runs, so render stages only draw new drawings.
+        with tempfile.TemporaryDirectory() as cache_dir:
+            pipeline = training.build_pipeline(profile=args.profile, cache_dir=cache_dir)
+            pipeline.run()
+            report = pipeline.profile_report(training.profile_metadata())
+            pipeline.write_profile(args.output, training.profile_metadata())
+
+        name, stage = max(report["stages"].items(), key=lambda item: item[1]["rss_peak"])
+        print(f"{samples:>8} {report['seconds']:>8.1f} {report['rss_peak'] / 2**20:>12.0f}  "
+              f"{name} (+{stage['rss_growth'] / 2**20:.0f} MB)")
+    print(f"Reports appended to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
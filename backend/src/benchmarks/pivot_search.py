@@ -0,0 +1,74 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import time
+
+import numpy as np
+from sklearn.neighbors import BallTree
+
+from common.distance_metrics import DistanceMetric
+from config import CACHE_DIR
+from pivot_index import PivotIndex
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distance evaluations of the pivot index versus BallTree and brute force.")
+    parser.add_argument("--pivots", type=int, nargs="+", default=[8, 16, 32, 64])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--replicate", type=int, default=1,
+                        help="tile the training set this many times (with jitter) to simulate a larger index")
+    args = parser.parse_args()
+
+    X_train = np.load(os.path.join(CACHE_DIR, "X_train.npy"))
+    X_test = np.load(os.path.join(CACHE_DIR, "X_test.npy"))[:args.queries]
+
+    if args.replicate > 1:
+        rng = np.random.default_rng(0)
+        X_train = np.concatenate([X_train + rng.normal(0, 0.01, X_train.shape) for _ in range(args.replicate)])
+
+    n_train = len(X_train)
+    print(f"Training points: {n_train} x {X_train.shape[1]}, queries: {len(X_test)}, k: {args.k}")
+    print(f"{'metric':<10} {'index':<12} {'build s':>8} {'ms/query':>9} {'dists/query':>12} {'avoided':>8} {'exact':>6}")
+
+    for metric in (DistanceMetric.EUCLIDEAN, DistanceMetric.MANHATTAN):
+        # Brute force compares every query with every training point
+        start = time.perf_counter()
+        diffs = X_test[:, np.newaxis, :] - X_train[np.newaxis, :, :]
+        if metric == DistanceMetric.EUCLIDEAN:
+            brute = np.sqrt(np.sum(diffs ** 2, axis=2))
+        else:
+            brute = np.sum(np.abs(diffs), axis=2)
+        expected = np.sort(brute, axis=1)[:, :args.k]
+        brute_ms = (time.perf_counter() - start) / len(X_test) * 1000
+        print(f"{metric.value:<10} {'brute_force':<12} {0:>8.2f} {brute_ms:>9.2f} {n_train:>12.0f} {0:>8.1%} {'yes':>6}")
+
+        start = time.perf_counter()
+        tree = BallTree(X_train, metric=metric.value)
+        build = time.perf_counter() - start
+        tree.reset_n_calls()
+        start = time.perf_counter()
+        dists, _ = tree.query(X_test, k=args.k)
+        elapsed = (time.perf_counter() - start) / len(X_test) * 1000
+        evaluations = tree.get_n_calls() / len(X_test)
+        exact = "yes" if np.allclose(dists, expected) else "no"
+        print(f"{metric.value:<10} {'ball_tree':<12} {build:>8.2f} {elapsed:>9.2f} {evaluations:>12.0f} "
+              f"{1 - evaluations / n_train:>8.1%} {exact:>6}")
+
+        for n_pivots in args.pivots:
+            start = time.perf_counter()
+            index = PivotIndex(X_train, metric, n_pivots=n_pivots)
+            build = time.perf_counter() - start
+            start = time.perf_counter()
+            dists, _ = index.query(X_test, k=args.k)
+            elapsed = (time.perf_counter() - start) / len(X_test) * 1000
+            evaluations = index.distance_evaluations / len(X_test)
+            exact = "yes" if np.allclose(dists, expected) else "no"
+            print(f"{metric.value:<10} {f'pivot_{n_pivots}':<12} {build:>8.2f} {elapsed:>9.2f} {evaluations:>12.0f} "
+                  f"{1 - evaluations / n_train:>8.1%} {exact:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import pickle
+import time
+
+import numpy as np
+from sklearn.model_selection import train_test_split
+
+from common.precision import Precision
+from config import CACHE_DIR
+from knn import KNN
+from preprocessor import Preprocessor
+
+PREDICTORS = {
+    "brute_force": lambda model, X, k: model.predict_weighted_batch(X, k=k),
+    "brute_force_fused": lambda model, X, k: model.predict_weighted_fused_batch(X, k=k),
+    "kd_tree": lambda model, X, k: model.predict_with_kd_tree_weighted_batch(X, k=k),
+    "ball_tree": lambda model, X, k: model.predict_with_ball_tree_weighted_batch(X, k=k),
+    "cascade": lambda model, X, k: model.predict_cascade_batch(X, k=k),
+}
+
+
+def load_features(samples, n_components, test_size, random_state):
+    """
+    Runs the preprocessing of `main.py` on the published rasters once, and transforms them
+    in both precisions so the float32 path is compared end to end.
+
+    Returns:
+    - dict: Maps each Precision to (X_train, X_test, y_train, y_test).
+    """
+    X = np.load(os.path.join(CACHE_DIR, "X_raster.npy"), mmap_mode="r")
+    y = np.load(os.path.join(CACHE_DIR, "y_raster.npy"))
+    if samples and samples < len(X):
+        rows = np.sort(np.random.default_rng(random_state).choice(len(X), samples, replace=False))
+        X, y = X[rows], y[rows]
+
+    # Fitting accumulates in float64 whatever the precision, so one fit serves both
+    preprocessor = Preprocessor(n_components=n_components)
+    preprocessor.fit(X)
+
+    splits = {}
+    for precision in Precision:
+        preprocessor.precision = precision
+        splits[precision] = train_test_split(preprocessor.transform(X), y, test_size=test_size,
+                                             random_state=random_state)
+    return splits
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prediction agreement and throughput of float32 vs float64 models.")
+    parser.add_argument("--samples", type=int, default=None, help="use a random subset of the rasters")
+    parser.add_argument("--components", type=int, default=64)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--repeats", type=int, default=3, help="best of this many timed runs")
+    parser.add_argument("--replicate", type=int, default=1,
+                        help="tile the training set this many times (with jitter) to simulate a larger index")
+    parser.add_argument("--structures", nargs="+", default=list(PREDICTORS), choices=list(PREDICTORS))
+    args = parser.parse_args()
+
+    splits = load_features(args.samples, args.components, test_size=0.2, random_state=42)
+    models, queries = {}, {}
+    for precision, (X_train, X_test, y_train, y_test) in splits.items():
+        if args.replicate > 1:
+            # The same jitter for both precisions
+            rng = np.random.default_rng(0)
+            X_train = np.concatenate([X_train + rng.normal(0, 0.01, X_train.shape).astype(X_train.dtype)
+                                      for _ in range(args.replicate)])
+            y_train = np.tile(y_train, args.replicate)
+        models[precision] = KNN.from_data(X_train, y_train, k=args.k, precision=precision)
+        queries[precision] = X_test[:args.queries]
+    y_test = splits[Precision.FLOAT64][3][:args.queries]
+
+    X_train = models[Precision.FLOAT64].training_features
+    print(f"Training points: {len(X_train)} x {X_train.shape[1]}, queries: {len(y_test)}")
+    print(f"{'precision':<10} {'features MB':>12} {'model MB':>9}")
+    for precision, model in models.items():
+        print(f"{precision.value:<10} {model.training_features.nbytes / 1024 ** 2:>12.1f} "
+              f"{len(pickle.dumps(model)) / 1024 ** 2:>9.1f}")
+
+    print(f"\n{'structure':<18} {'f64 q/s':>9} {'f32 q/s':>9} {'speedup':>8} {'f64 acc':>8} {'f32 acc':>8} {'agreement':>10}")
+    for name in args.structures:
+        predict = PREDICTORS[name]
+        results = {}
+        for precision, model in models.items():
+            # Warm-up, e.g. Numba compilation and lazily built cascade indexes
+            predict(model, queries[precision][:10], args.k)
+            best = np.inf
+            for _ in range(args.repeats):
+                start = time.perf_counter()
+                y_pred = predict(model, queries[precision], args.k)
+                best = min(best, time.perf_counter() - start)
+            results[precision] = (y_pred, len(y_test) / best)
+
+        (y_64, qps_64), (y_32, qps_32) = results[Precision.FLOAT64], results[Precision.FLOAT32]
+        print(f"{name:<18} {qps_64:>9.0f} {qps_32:>9.0f} {qps_32 / qps_64:>7.2f}x "
+              f"{np.mean(y_64 == y_test):>8.4f} {np.mean(y_32 == y_test):>8.4f} {np.mean(y_32 == y_64):>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import glob
+import multiprocessing
+import tempfile
+import time
+
+import numpy as np
+import psutil
+from sklearn.decomposition import PCA
+from sklearn.preprocessing import StandardScaler
+
+from benchmarks.memory_budget import peak_rss, reset_peak_rss
+from config import CACHE_DIR
+from preprocessor import Preprocessor
+from raster import RASTER_SCALE, ink_matrix, pack_binary, to_uint8
+from utils import draw_image, get_data
+
+RAW_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "data", "raw")
+
+
+def load_rasters(per_category, replicate):
+    """
+    The published uint8 rasters if `main.py` has run, otherwise renders of the raw drawings.
+    """
+    path = os.path.join(CACHE_DIR, "X_raster.npy")
+    if os.path.exists(path):
+        rasters = np.load(path)
+    else:
+        drawings = [item["drawing"] for file in sorted(glob.glob(os.path.join(RAW_DATA_DIR, "*.ndjson")))
+                    for item in get_data(os.path.basename(file), per_category)]
+        rasters = np.stack([to_uint8(draw_image(strokes, size=56)).ravel() for strokes in drawings])
+    return np.tile(rasters, (replicate, 1))
+
+
+def measure_fit(layout, path, n_components):
+    """
+    Loads the dataset and fits the preprocessing in a fresh process, reporting the peak
+    memory on top of the interpreter and the time both took.
+    """
+    baseline_rss = psutil.Process().memory_info().rss
+    exact = reset_peak_rss()
+    start = time.perf_counter()
+
+    if layout == "float64 npz":
+        # What main.py and pca_analysis.py did before: a float64 matrix, scaled and fitted in memory
+        X = np.load(path)["X"]
+        reduced = PCA(n_components=n_components).fit_transform(StandardScaler().fit_transform(X))
+    else:
+        X = np.load(path, mmap_mode="r")
+        reduced = Preprocessor(n_components=n_components).fit_transform(X)
+
+    return {
+        "seconds": time.perf_counter() - start,
+        "working_bytes": max(0, peak_rss() - baseline_rss),
+        "exact": exact,
+        "shape": reduced.shape,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Disk size, load time and fit memory of the raster storage layouts.")
+    parser.add_argument("--per-category", type=int, default=4000)
+    parser.add_argument("--replicate", type=int, default=1, help="tile the rasters this many times")
+    parser.add_argument("--components", type=int, default=64)
+    args = parser.parse_args()
+
+    rasters = load_rasters(args.per_category, args.replicate)
+    print(f"{len(rasters)} drawings of {rasters.shape[1]} pixels, "
+          f"{np.mean(rasters < RASTER_SCALE):.1%} of the pixels carry ink")
+
+    with tempfile.TemporaryDirectory() as directory:
+        layouts = {
+            "float64 npz": (os.path.join(directory, "X.npz"),
+                            lambda path: np.savez_compressed(path, X=rasters / RASTER_SCALE),
+                            lambda path: np.load(path)["X"]),
+            "uint8 npy": (os.path.join(directory, "X.npy"),
+                          lambda path: np.save(path, rasters),
+                          lambda path: np.load(path)),
+            "bit-packed npy": (os.path.join(directory, "X_bits.npy"),
+                               lambda path: np.save(path, pack_binary(rasters)),
+                               lambda path: np.load(path)),
+        }
+
+        print(f"{'layout':<16} {'MB on disk':>11} {'save s':>8} {'load s':>8}")
+        for name, (path, save, load) in layouts.items():
+            start = time.perf_counter()
+            save(path)
+            save_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            load(path)
+            load_seconds = time.perf_counter() - start
+            print(f"{name:<16} {os.path.getsize(path) / 1024 ** 2:>11.1f} {save_seconds:>8.2f} {load_seconds:>8.2f}")
+
+        ink = ink_matrix(rasters)
+        ink_bytes = ink.data.nbytes + ink.indices.nbytes + ink.indptr.nbytes
+        print(f"{'sparse ink':<16} {ink_bytes / 1024 ** 2:>11.1f} {'-':>8} {'-':>8}  (in memory, uint8 CSR)")
+
+        # Every fit runs in its own process so peaks from earlier runs do not carry over
+        context = multiprocessing.get_context("spawn")
+        print(f"\n{'fit from':<16} {'peak MB':>9} {'seconds':>8}")
+        with context.Pool(1, maxtasksperchild=1) as pool:
+            for name in ("float64 npz", "uint8 npy"):
+                result = pool.apply(measure_fit, (name, layouts[name][0], args.components))
+                marker = "" if result["exact"] else "*"
+                print(f"{name:<16} {result['working_bytes'] / 1024 ** 2:>8.1f}{marker:1} {result['seconds']:>8.2f}")
+
+    # The sparse path reproduces the dense projection
+    sample = rasters[:1000]
+    fitted = Preprocessor(n_components=args.components)
+    fitted.fit(rasters)
+    difference = np.abs(fitted.transform_ink(ink_matrix(sample)) - fitted.transform(sample)).max()
+    print(f"\nMax difference between the sparse ink and dense transforms: {difference:.2e}")
+
+
+if __name__ == "__main__":
+    main()
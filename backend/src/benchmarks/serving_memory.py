@@ -0,0 +1,83 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import json
+import threading
+
+from benchmarks.loadtest import (PredictClient, build_payloads, load_drawings, process_tree_memory,
+                                 start_server, stop_server, wait_until_ready)
+from common.distance_metrics import DistanceMetric
+from common.indexing_structures import IndexingStructure
+from serving import SHARED_MODEL_DIR, SHARED_MODEL_ENV, publish_model
+
+
+def warm_workers(client, payloads, workers, requests_per_worker=20):
+    """
+    Sends brute-force requests from several connections so that every worker
+    touches the full training matrix before memory is measured.
+    """
+    def run(offset):
+        for i in range(requests_per_worker):
+            client.post("/predict", payloads[(offset + i) % len(payloads)])
+
+    threads = [threading.Thread(target=run, args=(i * requests_per_worker,)) for i in range(workers * 2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def measure(mode, workers, payloads, port):
+    """
+    Starts the API with `workers` processes in `mode` ("private" or "shared"),
+    warms it up and returns the summed memory of the whole process tree.
+    """
+    env = {SHARED_MODEL_ENV: SHARED_MODEL_DIR} if mode == "shared" else None
+    process = start_server(port=port, workers=workers, env=env)
+    try:
+        wait_until_ready("127.0.0.1", port, timeout=300, process=process)
+        warm_workers(PredictClient("127.0.0.1", port), payloads, workers)
+        memory = process_tree_memory(process.pid)
+    finally:
+        stop_server(process)
+
+    return {"mode": mode, "workers": workers,
+            "rss_mb": memory["rss"] / 2**20,
+            "pss_mb": memory["pss"] / 2**20,
+            "uss_mb": memory["uss"] / 2**20}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API memory as uvicorn workers scale.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--modes", nargs="+", default=["private", "shared"])
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    if "shared" in args.modes:
+        publish_model()
+
+    drawings = load_drawings(max_per_category=5)
+    payloads = build_payloads(drawings, 5, DistanceMetric.EUCLIDEAN, IndexingStructure.BRUTE_FORCE)
+
+    # PSS splits shared pages between the processes mapping them, so its sum is
+    # the real footprint; summed RSS counts shared pages once per worker.
+    results = []
+    print(f"{'mode':<8} {'workers':>7} {'RSS MB':>9} {'PSS MB':>9} {'USS MB':>9}")
+    for mode in args.modes:
+        for workers in args.workers:
+            result = measure(mode, workers, payloads, args.port)
+            results.append(result)
+            print(f"{mode:<8} {workers:>7} {result['rss_mb']:>9.0f} {result['pss_mb']:>9.0f} {result['uss_mb']:>9.0f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results saved to: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import time
+
+import numpy as np
+
+from common.distance_metrics import DistanceMetric
+from common.indexing_structures import IndexingStructure
+from config import CACHE_DIR
+from knn import KNN
+from sharded_knn import ShardedKNN
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scaling test for sharded scatter-gather KNN on one machine.")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--replicate", type=int, default=1,
+                        help="tile the training set this many times (with jitter) to simulate a larger index")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--single-queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--indexing", default=IndexingStructure.KD_TREE.value)
+    args = parser.parse_args()
+
+    X_train = np.load(os.path.join(CACHE_DIR, "X_train.npy"))
+    y_train = np.load(os.path.join(CACHE_DIR, "y_train.npy"))
+    X_test = np.load(os.path.join(CACHE_DIR, "X_test.npy"))[:args.queries]
+    y_test = np.load(os.path.join(CACHE_DIR, "y_test.npy"))[:args.queries]
+
+    if args.replicate > 1:
+        rng = np.random.default_rng(0)
+        X_train = np.concatenate([X_train + rng.normal(0, 0.01, X_train.shape) for _ in range(args.replicate)])
+        y_train = np.tile(y_train, args.replicate)
+
+    indexing = IndexingStructure(args.indexing)
+    metric = DistanceMetric.EUCLIDEAN
+    print(f"Training points: {len(X_train)}, queries: {len(X_test)}, indexing: {indexing.value}")
+
+    baseline = KNN.from_data(X_train, y_train, k=args.k, metric=metric)
+    dists, labels = baseline.query_neighbors(X_test, k=args.k, metric=metric, indexing=indexing)
+    expected = np.array([KNN.weighted_vote(d, l) for d, l in zip(dists, labels)])
+
+    print(f"{'shards':>6} {'build s':>8} {'single ms':>10} {'batch q/s':>10} {'accuracy':>9} {'agreement':>10}")
+    for n_shards in args.shards:
+        # Fitting returns once the worker processes have started and built their sub-indexes
+        start = time.perf_counter()
+        with ShardedKNN.from_data(X_train, y_train, k=args.k, metric=metric, n_shards=n_shards) as model:
+            build_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            for point in X_test[:args.single_queries]:
+                model.adaptive_prediction(point, k=args.k, metric=metric, indexing=indexing)
+            single_ms = (time.perf_counter() - start) / args.single_queries * 1000
+
+            start = time.perf_counter()
+            y_pred = model.adaptive_prediction_batch(X_test, k=args.k, metric=metric, indexing=indexing)
+            batch_qps = len(X_test) / (time.perf_counter() - start)
+
+        accuracy = np.mean(y_pred == y_test)
+        agreement = np.mean(y_pred == expected)
+        print(f"{n_shards:>6} {build_time:>8.2f} {single_ms:>10.2f} {batch_qps:>10.0f} {accuracy:>9.4f} {agreement:>10.4f}")
+
+
+if __name__ == "__main__":
+    main()
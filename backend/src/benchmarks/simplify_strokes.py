@@ -0,0 +1,68 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmarks.loadtest import load_drawings
+from benchmarks.stroke_payload import densify
+from simplify import SIMPLIFY_TOLERANCE, simplify_strokes
+from stroke_codec import encode_strokes
+from utils import draw_image
+
+
+def best_time(function, repeats):
+    """
+    Best-of-`repeats` time of a call, in microseconds, and its result.
+    """
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best * 1e6, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Points, render time, payload size and raster error of stroke simplification.")
+    parser.add_argument("--source", choices=["raw", "cache"], default="raw")
+    parser.add_argument("--samples", type=int, default=200, help="drawings per category")
+    parser.add_argument("--scale", type=float, default=2.5, help="multiply the coordinates, e.g. 2.5 for canvas pixels")
+    parser.add_argument("--densify", type=int, default=8, help="points per segment, e.g. 8 for mouse-event sampling")
+    parser.add_argument("--size", type=int, default=56)
+    parser.add_argument("--tolerance", type=float, default=SIMPLIFY_TOLERANCE, help="in raster pixels")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    drawings = [strokes for _, strokes in load_drawings(args.samples, args.source)]
+    if args.scale != 1.0 or args.densify > 1:
+        drawings = [densify(strokes, args.scale, args.densify) for strokes in drawings]
+
+    rows = []
+    for strokes in drawings:
+        full_time, full = best_time(lambda: draw_image(strokes, args.size), args.repeats)
+        simple_time, simple = best_time(lambda: draw_image(strokes, args.size, tolerance=args.tolerance), args.repeats)
+        simplified = simplify_strokes(strokes, args.size, tolerance=args.tolerance)
+        diff = np.abs(full - simple) * 255
+        rows.append((sum(len(stroke[0]) for stroke in strokes), sum(len(xs) for xs, _ in simplified),
+                     full_time, simple_time, len(encode_strokes(strokes)), len(encode_strokes(simplified)),
+                     diff.max(), diff.mean()))
+    (points, kept, full_time, simple_time, full_bytes, simple_bytes,
+     max_diff, mean_diff) = (np.array(column) for column in zip(*rows))
+
+    print(f"{len(drawings)} drawings, {args.size}x{args.size} raster, tolerance {args.tolerance} px")
+    longest = points >= np.percentile(points, 90)
+    print(f"{'':<12} {'points':>8} {'kept':>8} {'render us':>10} {'simplified us':>14} {'bytes':>8} {'simplified B':>13}")
+    for name, rows in (("all", slice(None)), ("longest 10%", longest)):
+        print(f"{name:<12} {points[rows].mean():>8.0f} {kept[rows].mean():>8.0f} {full_time[rows].mean():>10.0f} "
+              f"{simple_time[rows].mean():>14.0f} {full_bytes[rows].mean():>8.0f} {simple_bytes[rows].mean():>13.0f}")
+    # In gray levels of 0-255; differences come from anti-aliasing along the moved centerlines
+    print(f"raster difference: max {max_diff.max():.0f}, mean {mean_diff.mean():.3f}, "
+          f"drawings with any change {np.mean(max_diff > 0):.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import os
+import sys
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import base64
+import json
+import time
+from typing import List
+
+import numpy as np
+from pydantic import TypeAdapter
+
+from benchmarks.loadtest import load_drawings
+from stroke_codec import decode_strokes, encode_strokes
+
+# What FastAPI does with the `strokes` field of a JSON /predict body
+STROKES_ADAPTER = TypeAdapter(List[List[List[float]]])
+
+
+def densify(strokes, scale, points_per_segment):
+    """
+    Approximates what the frontend sends: canvas coordinates and a point per mouse event
+    rather than the simplified QuickDraw strokes.
+    """
+    dense = []
+    for xs, ys in ((stroke[0], stroke[1]) for stroke in strokes):
+        positions = np.linspace(0, len(xs) - 1, (len(xs) - 1) * points_per_segment + 1)
+        dense.append([list(np.interp(positions, np.arange(len(xs)), xs) * scale),
+                      list(np.interp(positions, np.arange(len(ys)), ys) * scale)])
+    return dense
+
+
+def time_each(parse, payloads, repeats):
+    """
+    Best-of-`repeats` parse time of every payload, in microseconds.
+    """
+    times = np.full(len(payloads), np.inf)
+    for _ in range(repeats):
+        for i, payload in enumerate(payloads):
+            start = time.perf_counter()
+            parse(payload)
+            times[i] = min(times[i], time.perf_counter() - start)
+    return times * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Request parse time and payload size of the JSON and binary stroke formats.")
+    parser.add_argument("--source", choices=["raw", "cache"], default="raw")
+    parser.add_argument("--samples", type=int, default=500, help="drawings per category")
+    parser.add_argument("--scale", type=float, default=1.0, help="multiply the coordinates, e.g. 2.5 for canvas pixels")
+    parser.add_argument("--densify", type=int, default=1, help="points per segment, e.g. 8 for mouse-event sampling")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    drawings = [strokes for _, strokes in load_drawings(args.samples, args.source)]
+    if args.scale != 1.0 or args.densify > 1:
+        drawings = [densify(strokes, args.scale, args.densify) for strokes in drawings]
+    n_points = np.array([sum(len(stroke[0]) for stroke in strokes) for strokes in drawings])
+    print(f"{len(drawings)} drawings, points per drawing: median {np.median(n_points):.0f}, max {n_points.max()}")
+
+    raw = [encode_strokes(strokes) for strokes in drawings]
+    formats = {
+        "json": ([json.dumps({"strokes": strokes}, separators=(",", ":")).encode() for strokes in drawings],
+                 lambda body: STROKES_ADAPTER.validate_python(json.loads(body)["strokes"])),
+        "binary": (raw, decode_strokes),
+        "binary base64": ([base64.b64encode(payload) for payload in raw], decode_strokes),
+    }
+
+    # Decoding must reproduce the integer-rounded coordinates exactly
+    for strokes, payload in zip(drawings, raw):
+        for (xs, ys), (decoded_x, decoded_y) in zip(strokes, decode_strokes(payload)):
+            if not (np.array_equal(np.rint(xs), decoded_x) and np.array_equal(np.rint(ys), decoded_y)):
+                sys.exit("Decoded strokes differ from the encoded ones.")
+
+    # The longest drawings are the ones the format is meant for
+    longest = n_points >= np.percentile(n_points, 99)
+    print(f"{'format':<14} {'mean B':>8} {'p99 B':>8} {'mean us':>8} {'p99 us':>8} {'longest 1% us':>14}")
+    for name, (payloads, parse) in formats.items():
+        sizes = np.array([len(payload) for payload in payloads])
+        times = time_each(parse, payloads, args.repeats)
+        print(f"{name:<14} {sizes.mean():>8.0f} {np.percentile(sizes, 99):>8.0f} {times.mean():>8.1f} "
+              f"{np.percentile(times, 99):>8.1f} {times[longest].mean():>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+from enum import Enum
+
+class AccessPattern(Enum):
+    # One query per call, as /predict serves them; ranked by median latency
+    SINGLE = "single"
+    # Many queries per call; ranked by throughput
+    BATCH = "batch"
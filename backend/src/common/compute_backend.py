@@ -0,0 +1,5 @@
+from enum import Enum
+
+class ComputeBackend(Enum):
+    NUMPY = "numpy"
+    CUPY = "cupy"
@@ -3,4 +3,8 @@ from enum import Enum
 class IndexingStructure(Enum):
     KD_TREE = "kd_tree"
     BALL_TREE = "ball_tree"
-    BRUTE_FORCE = "brute_force"
\ No newline at end of file
+    BRUTE_FORCE = "brute_force"
+    BRUTE_FORCE_FUSED = "brute_force_fused"
+    CASCADE = "cascade"
+    CLASS_SHORTLIST = "class_shortlist"
+    PIVOT = "pivot"
@@ -0,0 +1,5 @@
+from enum import Enum
+
+class Precision(Enum):
+    FLOAT64 = "float64"
+    FLOAT32 = "float32"
@@ -0,0 +1,8 @@
+from enum import Enum
+
+class ProfileMode(Enum):
+    NONE = "none"
+    # Wall time, CPU time and sampled peak RSS per stage
+    RSS = "rss"
+    # Also traces Python and NumPy allocations: traced peak and the largest live blocks
+    TRACEMALLOC = "tracemalloc"
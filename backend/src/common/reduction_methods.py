@@ -0,0 +1,7 @@
+from enum import Enum
+
+class ReductionMethod(Enum):
+    CNN = "cnn"
+    ENN = "enn"
+    ENN_CNN = "enn_cnn"
+    KMEANS = "kmeans"
@@ -0,0 +1,166 @@
+import numpy as np
+from sklearn.cluster import KMeans
+from sklearn.neighbors import KDTree
+
+from common.reduction_methods import ReductionMethod
+from utils import timeit
+
+
+def _neighbors_excluding_self(tree, X, k, batch_size):
+    """
+    Indices of the k nearest points of every row of X in the tree built over X itself,
+    leaving out the point itself.
+    """
+    neighbors = np.empty((len(X), k), dtype=np.intp)
+    for start in range(0, len(X), batch_size):
+        end = min(start + batch_size, len(X))
+        _, indices = tree.query(X[start:end], k=k + 1)
+
+        # Usually the point is its own first neighbor, but duplicates can push it out of the
+        # top k + 1; then the farthest neighbor is dropped instead
+        is_self = indices == np.arange(start, end)[:, np.newaxis]
+        is_self[~is_self.any(axis=1), -1] = True
+        neighbors[start:end] = indices[~is_self].reshape(end - start, k)
+    return neighbors
+
+
+@timeit
+def edited_nearest_neighbors(X, y, k=3, batch_size=1000):
+    """
+    Wilson's edited nearest neighbor rule: removes points whose k nearest neighbors
+    mostly belong to other classes. This drops label noise and smooths class borders.
+
+    Parameters:
+    - X (np.ndarray): Training features of shape (n_samples, n_features).
+    - y (np.ndarray): Training labels of shape (n_samples,).
+    - k (int): Number of neighbors that vote on every point.
+    - batch_size (int): Number of points queried at once.
+
+    Returns:
+    - np.ndarray: Indices of the points that are kept.
+    """
+    X = np.asarray(X)
+    classes, codes = np.unique(y, return_inverse=True)
+    neighbors = _neighbors_excluding_self(KDTree(X), X, k, batch_size)
+
+    # Majority class of every point's neighbors, counted with one vectorized scatter per batch
+    keep = np.empty(len(X), dtype=bool)
+    for start in range(0, len(X), batch_size):
+        end = min(start + batch_size, len(X))
+        votes = np.zeros((end - start, len(classes)), dtype=np.intp)
+        rows = np.repeat(np.arange(end - start), k)
+        np.add.at(votes, (rows, codes[neighbors[start:end]].ravel()), 1)
+        keep[start:end] = np.argmax(votes, axis=1) == codes[start:end]
+
+    return np.flatnonzero(keep)
+
+
+@timeit
+def condensed_nearest_neighbors(X, y, batch_size=1000, max_passes=10, random_state=42):
+    """
+    Hart's condensed nearest neighbor rule: keeps a subset that still classifies every
+    training point correctly with 1-NN, which mostly removes points far from class borders.
+
+    Points are checked in batches against the current prototypes; the misclassified
+    points of a batch are added together before the next batch, and passes repeat until
+    nothing is added.
+
+    Parameters:
+    - X (np.ndarray): Training features of shape (n_samples, n_features).
+    - y (np.ndarray): Training labels of shape (n_samples,).
+    - batch_size (int): Number of points classified per prototype index rebuild.
+    - max_passes (int): Maximum number of passes over the training set.
+    - random_state (int): Seed for the order points are visited in.
+
+    Returns:
+    - np.ndarray: Indices of the prototypes.
+    """
+    X = np.asarray(X)
+    y = np.asarray(y)
+    order = np.random.default_rng(random_state).permutation(len(X))
+
+    # Start from one point per class
+    _, first = np.unique(y[order], return_index=True)
+    selected = np.zeros(len(X), dtype=bool)
+    selected[order[first]] = True
+
+    for _ in range(max_passes):
+        added = 0
+        candidates = order[~selected[order]]
+        for start in range(0, len(candidates), batch_size):
+            batch = candidates[start:start + batch_size]
+            prototypes = np.flatnonzero(selected)
+            _, nearest = KDTree(X[prototypes]).query(X[batch], k=1)
+            wrong = batch[y[prototypes[nearest[:, 0]]] != y[batch]]
+            selected[wrong] = True
+            added += len(wrong)
+        if added == 0:
+            break
+
+    return np.flatnonzero(selected)
+
+
+@timeit
+def kmeans_prototypes(X, y, per_class=100, random_state=42):
+    """
+    Replaces every class by the centroids of a k-means clustering of its points.
+
+    Parameters:
+    - X (np.ndarray): Training features of shape (n_samples, n_features).
+    - y (np.ndarray): Training labels of shape (n_samples,).
+    - per_class (int): Number of centroids per class; classes with fewer points keep them all.
+    - random_state (int): Seed for the k-means initialization.
+
+    Returns:
+    - tuple: (features, labels) of the prototypes.
+    """
+    X = np.asarray(X)
+    y = np.asarray(y)
+    features, labels = [], []
+
+    for label in np.unique(y):
+        points = X[y == label]
+        if len(points) <= per_class:
+            centroids = points
+        else:
+            centroids = KMeans(n_clusters=per_class, n_init=1, random_state=random_state).fit(points).cluster_centers_
+        features.append(centroids.astype(X.dtype, copy=False))
+        labels.append(np.full(len(centroids), label, dtype=y.dtype))
+
+    return np.concatenate(features), np.concatenate(labels)
+
+
+def reduce_training_set(X, y, method, k=3, per_class=100, batch_size=1000, random_state=42):
+    """
+    Shrinks a training set to a smaller prototype set that can be passed straight to
+    `KNN.from_data`.
+
+    Parameters:
+    - X (np.ndarray): Training features of shape (n_samples, n_features).
+    - y (np.ndarray): Training labels of shape (n_samples,).
+    - method (ReductionMethod or str): CNN, ENN, ENN_CNN (editing followed by condensation) or KMEANS.
+    - k (int): Number of neighbors used by ENN.
+    - per_class (int): Number of centroids per class for KMEANS.
+    - batch_size (int): Number of points queried at once.
+    - random_state (int): Seed for CNN and KMEANS.
+
+    Returns:
+    - tuple: (features, labels) of the reduced training set.
+    """
+    X = np.asarray(X)
+    y = np.asarray(y)
+    method = ReductionMethod(method)
+
+    if method == ReductionMethod.KMEANS:
+        return kmeans_prototypes(X, y, per_class=per_class, random_state=random_state)
+
+    if method == ReductionMethod.ENN:
+        kept = edited_nearest_neighbors(X, y, k=k, batch_size=batch_size)
+    elif method == ReductionMethod.CNN:
+        kept = condensed_nearest_neighbors(X, y, batch_size=batch_size, random_state=random_state)
+    else:
+        edited = edited_nearest_neighbors(X, y, k=k, batch_size=batch_size)
+        kept = edited[condensed_nearest_neighbors(X[edited], y[edited], batch_size=batch_size,
+                                                  random_state=random_state)]
+
+    return X[kept], y[kept]
@@ -3,4 +3,7 @@ import os
 current_file_path = os.path.abspath(__file__)
 CACHE_DIR = os.path.abspath(os.path.join(current_file_path, "..", "..", "cache"))
 os.makedirs(CACHE_DIR, exist_ok=True)
-print("Cache directory:", CACHE_DIR)
\ No newline at end of file
+print("Cache directory:", CACHE_DIR)
+
+# Models served next to the default one, one subdirectory per model ID (see model_pool.py)
+MODELS_DIR = os.path.join(CACHE_DIR, "models")
@@ -0,0 +1,253 @@
+import hashlib
+import json
+import os
+import uuid
+
+import numpy as np
+
+from config import CACHE_DIR
+from raster import RASTER_SCALE, to_uint8
+from simplify import SIMPLIFY_TOLERANCE
+from utils import draw_image
+
+DATASET_DIR = os.path.join(CACHE_DIR, "rendered")
+IMAGES_FILE = "images.npy"
+PROGRESS_FILE = "progress.json"
+
+
+def _drawing_hash(strokes):
+    return hashlib.sha1(json.dumps(strokes, separators=(",", ":")).encode()).hexdigest()[:16]
+
+
+class RenderedDataset:
+    """
+    Lazy (X, y) view over the rendered images of several categories.
+
+    Only paths and counts are held, so the view is cheap to pickle and pass between
+    processes. Images are read from the memory-mapped uint8 arrays on access and scaled
+    to [0, 1]. The store never rewrites rows a view may read, so views of earlier builds
+    stay valid after the drawings of a category change.
+    """
+
+    def __init__(self, parts):
+        """
+        Parameters:
+        - parts (list): (category, images path, number of rows) per category, in order.
+        """
+        self.parts = [(category, path, int(count)) for category, path, count in parts]
+
+    @classmethod
+    def concatenate(cls, datasets):
+        return cls([part for dataset in datasets for part in dataset.parts])
+
+    def __len__(self):
+        return sum(count for _, _, count in self.parts)
+
+    @property
+    def n_features(self):
+        return np.load(self.parts[0][1], mmap_mode="r").shape[1]
+
+    @property
+    def labels(self):
+        return np.concatenate([np.full(count, category) for category, _, count in self.parts])
+
+    def images(self):
+        """
+        Returns:
+        - list: Read-only uint8 memory maps of shape (count, size * size), one per category.
+        """
+        arrays = []
+        for category, path, count in self.parts:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Rendered images of {category} are missing: {path}")
+            arrays.append(np.load(path, mmap_mode="r")[:count])
+        return arrays
+
+    def iter_batches(self, batch_size=1000, dtype=np.float64):
+        """
+        Yields (X_batch, y_batch) with pixel values in [0, 1], never holding more than
+        one batch in memory. Batches do not span categories. `Preprocessor` streams
+        datasets through this.
+
+        Parameters:
+        - batch_size (int): Maximum rows per batch.
+        - dtype (type, optional): Floating point type of the batches. None yields the uint8 rasters.
+        """
+        for (category, _, _), images in zip(self.parts, self.images()):
+            for start in range(0, len(images), batch_size):
+                batch = images[start:start + batch_size]
+                if dtype is not None:
+                    batch = np.divide(batch, RASTER_SCALE, dtype=dtype)
+                yield batch, np.full(len(batch), category)
+
+    def to_arrays(self, dtype=np.float64):
+        """
+        Materializes the dataset into one preallocated array.
+
+        Returns:
+        - tuple: (X, y) with X of shape (n_samples, size * size) in [0, 1].
+        """
+        X = np.empty((len(self), self.n_features), dtype=dtype)
+        row = 0
+        for images in self.images():
+            np.divide(images, RASTER_SCALE, out=X[row:row + len(images)], casting="unsafe")
+            row += len(images)
+        return X, self.labels
+
+
+class RenderedDatasetStore:
+    """
+    On-disk store of rendered drawings: one preallocated uint8 array per category and
+    rendering variant (image size and simplification tolerance).
+
+    Rendering writes straight into the memory-mapped array in chunks and records its
+    progress after every chunk, so an interrupted build resumes from the last completed
+    chunk. Every rendered row is identified by a hash of its strokes; rebuilding with
+    more samples, or after new categories were added, only renders what is missing.
+
+    Rendered rows are never rewritten, since `RenderedDataset` views of earlier builds may
+    read them. When the drawings of a category change, the rows that still match are copied
+    into a new file and the rest are rendered there. Superseded files are kept for those
+    views; delete the variant directory to reclaim them.
+    """
+
+    def __init__(self, root=DATASET_DIR, size=56, chunk_size=250, tolerance=SIMPLIFY_TOLERANCE):
+        """
+        Parameters:
+        - root (str): Directory holding one subdirectory per variant and category.
+        - size (int): Width and height of the rendered images.
+        - chunk_size (int): Drawings rendered between two progress checkpoints.
+        - tolerance (float, optional): Stroke simplification tolerance in pixels (see
+          `simplify.py`); None renders every point.
+        """
+        self.root = root
+        self.size = size
+        self.chunk_size = chunk_size
+        self.tolerance = tolerance
+
+    @property
+    def variant(self):
+        """
+        Subdirectory of the images rendered with this store's size and tolerance. Each
+        variant has its own files, so a `RenderedDataset` view never reads rows that were
+        rendered again with other settings.
+        """
+        tolerance = "full" if self.tolerance is None else f"tol{self.tolerance:g}"
+        return f"{self.size}px-{tolerance}"
+
+    def _directory(self, category):
+        return os.path.join(self.root, self.variant, category.replace(" ", "_"))
+
+    def progress(self, category):
+        """
+        Returns:
+        - dict or None: {"size", "tolerance", "rendered", "hashes", "file"} of a category, or None if
+          nothing was rendered.
+        """
+        path = os.path.join(self._directory(category), PROGRESS_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def _save_progress(self, category, rendered, hashes, images_file):
+        path = os.path.join(self._directory(category), PROGRESS_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"size": self.size, "tolerance": self.tolerance, "rendered": rendered,
+                       "hashes": hashes[:rendered], "file": images_file}, f)
+        os.replace(tmp_path, path)
+
+    def _allocate(self, category, images_file, capacity, keep, new_file=False):
+        """
+        Opens the category's array with room for at least `capacity` rows. If it is too
+        small, or `new_file` is set, the first `keep` rows are copied into a new
+        preallocated file: under the same name when growing, under a new one otherwise.
+
+        Returns:
+        - tuple: (memory-mapped images, file name).
+        """
+        directory = self._directory(category)
+        path = os.path.join(directory, images_file)
+        n_features = self.size * self.size
+        if not new_file and os.path.exists(path):
+            images = np.load(path, mmap_mode="r+")
+            if images.shape[0] >= capacity and images.shape[1] == n_features:
+                return images, images_file
+
+        target_file = f"images-{uuid.uuid4().hex[:12]}.npy" if new_file else images_file
+        tmp_path = os.path.join(directory, "images.tmp.npy")
+        grown = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=(capacity, n_features))
+        if keep:
+            grown[:keep] = np.load(path, mmap_mode="r")[:keep]
+        grown.flush()
+        del grown
+        os.replace(tmp_path, os.path.join(directory, target_file))
+        return np.load(os.path.join(directory, target_file), mmap_mode="r+"), target_file
+
+    def build(self, category, drawings, samples_per_class):
+        """
+        Renders the first `samples_per_class` drawings of a category that are not rendered yet.
+
+        Parameters:
+        - category (str): Category name.
+        - drawings (list): Drawing items with a "drawing" list of strokes, e.g. from `get_data`.
+        - samples_per_class (int): Number of drawings to have rendered.
+
+        Returns:
+        - int: Number of rendered drawings available for the category.
+        """
+        os.makedirs(self._directory(category), exist_ok=True)
+        target = min(samples_per_class, len(drawings))
+        hashes = [_drawing_hash(item["drawing"]) for item in drawings[:target]]
+
+        # Rows are only reused while they match the drawings they were rendered from
+        progress = self.progress(category)
+        matched = 0
+        images_file = IMAGES_FILE if progress is None else progress.get("file", IMAGES_FILE)
+        if (progress is not None and progress["size"] == self.size
+                and progress.get("tolerance") == self.tolerance):
+            for rendered_hash, drawing_hash in zip(progress["hashes"], hashes):
+                if rendered_hash != drawing_hash:
+                    break
+                matched += 1
+            if matched == target and progress["rendered"] >= target:
+                return progress["rendered"]
+
+        # Views may read every rendered row, so rows that no longer match go to a new file
+        rewrite = progress is not None and matched < progress["rendered"]
+        images, images_file = self._allocate(category, images_file, target, matched, new_file=rewrite)
+        self._save_progress(category, matched, hashes, images_file)
+        for start in range(matched, target, self.chunk_size):
+            end = min(start + self.chunk_size, target)
+            for row in range(start, end):
+                images[row] = to_uint8(draw_image(drawings[row]["drawing"], size=self.size,
+                                                  tolerance=self.tolerance)).ravel()
+            images.flush()
+            self._save_progress(category, end, hashes, images_file)
+            print(f"Rendered {end}/{target} drawings of {category}.")
+
+        return target
+
+    def dataset(self, categories, samples_per_class=None):
+        """
+        Lazy view of the rendered drawings of some categories.
+
+        Parameters:
+        - categories (list): Categories, in the order their rows should appear.
+        - samples_per_class (int, optional): Maximum rows per category.
+
+        Returns:
+        - RenderedDataset: The (X, y) view.
+        """
+        parts = []
+        for category in categories:
+            progress = self.progress(category)
+            if progress is None:
+                raise ValueError(f"No rendered drawings for category: {category}")
+            count = progress["rendered"]
+            if samples_per_class is not None:
+                count = min(count, samples_per_class)
+            parts.append((category, os.path.join(self._directory(category), progress.get("file", IMAGES_FILE)),
+                          count))
+        return RenderedDataset(parts)
@@ -0,0 +1,57 @@
+import json
+import os
+
+DRAWING_LOG_FILE = "drawings.jsonl"
+
+
+class DrawingLog:
+    """
+    Append-only record of the drawings added to a model through `/drawings`, one JSON line
+    per drawing, kept next to the model's artifacts.
+
+    Every worker serving the model appends to the same file and replays the lines it has
+    not seen yet (see `ModelRegistry.sync_drawings`), so a drawing added on one worker is
+    searchable on all of them, and survives hot reloads and restarts. The raw strokes are
+    stored rather than features, since a retrained model may use another raster size or
+    preprocessor.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def append(self, strokes, label, tolerance=None):
+        """
+        Records a drawing. The line is written with a single append, so lines written by
+        concurrent workers do not interleave.
+
+        Parameters:
+        - strokes (list): Strokes as (xs, ys) pairs, as received by the API.
+        - label (str): The drawing's category.
+        - tolerance (float, optional): Simplification tolerance to render it with, see `draw_image`.
+        """
+        line = json.dumps({"strokes": strokes, "label": label, "tolerance": tolerance}, separators=(",", ":")) + "\n"
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+    def read(self, offset=0):
+        """
+        Reads the drawings recorded after a byte offset. A line still being written is left
+        for the next read.
+
+        Returns:
+        - tuple: (drawings, offset) where drawings is a list of dicts with strokes, label
+          and tolerance, and offset is where the next read starts.
+        """
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+
+        complete = data[:data.rfind(b"\n") + 1]
+        drawings = [json.loads(line) for line in complete.splitlines() if line.strip()]
+        return drawings, offset + len(complete)
@@ -12,8 +12,14 @@ class Evaluator:
     Evaluator class for performing cross-validation and evaluation of custom weighted KNN.
     """
 
-    def __init__(self, batch_size=100):
+    def __init__(self, batch_size=None, memory_budget=None):
+        """
+        Parameters:
+        - batch_size (int, optional): Queries per prediction batch. Derived from memory_budget if not given.
+        - memory_budget (int, optional): Bytes the batch predictions may use for their working arrays.
+        """
         self.batch_size = batch_size
+        self.memory_budget = memory_budget
 
     @timeit
     def cross_validate(self, X, y, k_range):
@@ -30,7 +36,7 @@ class Evaluator:
         """
         kf = KFold(n_splits=5, shuffle=True, random_state=42)
         cv_scores = []
-        model = KNN()
+        model = KNN(memory_budget=self.memory_budget)
         model.fit(X, y)
 
         X_np = X.values if hasattr(X, 'values') else X
@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+
+
+class MergedIndexCache:
+    """
+    LRU cache of search indexes built over popular subsets of the training data.
+
+    A subset only gets a merged index once it has been requested `merge_after` times;
+    the index is then built in a background thread, and until it is ready callers fall
+    back to whatever they do on a miss. At most `max_size` merged indexes are kept,
+    evicting the least recently used one. Request counts are kept for at most `max_size`
+    subsets without an index as well, forgetting the least recently requested one, so
+    clients sending ever new subsets cannot grow the cache.
+    """
+
+    def __init__(self, build, max_size=8, merge_after=2):
+        """
+        Parameters:
+        - build (callable): Builds the index for a key; called from a background thread.
+        - max_size (int): Maximum number of merged indexes kept.
+        - merge_after (int): Number of requests for a key before its index is built.
+        """
+        self.build = build
+        self.max_size = max_size
+        self.merge_after = merge_after
+        self._indexes = OrderedDict()
+        # key -> number of requests, for keys without a merged index, least recent first
+        self._requests = OrderedDict()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.stats = {"hits": 0, "misses": 0, "builds": 0, "evictions": 0}
+
+    def get(self, key):
+        """
+        Returns the merged index for a key, or None if it is not built (yet).
+        """
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                self.stats["hits"] += 1
+                return index
+
+            self.stats["misses"] += 1
+            requests = self._requests.pop(key, 0) + 1
+            self._requests[key] = requests
+            while len(self._requests) > self.max_size:
+                self._requests.popitem(last=False)
+            if requests < self.merge_after or key in self._pending:
+                return None
+            self._pending.add(key)
+            generation = self._generation
+
+        threading.Thread(target=self._build, args=(key, generation), daemon=True).start()
+        return None
+
+    def _build(self, key, generation):
+        try:
+            index = self.build(key)
+        except Exception:
+            with self._lock:
+                self._pending.discard(key)
+            raise
+
+        with self._lock:
+            self._pending.discard(key)
+            # Indexes built against data that has since been replaced are dropped
+            if generation != self._generation:
+                return
+            self._indexes[key] = index
+            # Counted again from zero if the index is evicted
+            self._requests.pop(key, None)
+            self.stats["builds"] += 1
+            while len(self._indexes) > self.max_size:
+                self._indexes.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        """
+        Drops all merged indexes, e.g. after the underlying data changed.
+        """
+        with self._lock:
+            self._indexes.clear()
+            self._requests.clear()
+            self._generation += 1
+
+    def metrics(self):
+        """
+        Returns:
+        - dict: Hit/miss/build/eviction counts, the number of cached indexes and of subsets whose requests are counted.
+        """
+        with self._lock:
+            return {**self.stats, "cached": len(self._indexes), "building": len(self._pending),
+                    "tracked": len(self._requests)}
@@ -0,0 +1,220 @@
+import sys
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+from common.distance_metrics import DistanceMetric
+
+# Number of queries that share one pass over the training set. Each training row is
+# loaded once per block and compared against every query in it while still in cache.
+QUERY_BLOCK_SIZE = 16
+
+_numba_kernel = None
+
+# BLAS/OpenMP limits are process-wide: the first limited call applies them, the last one restores them
+_blas_lock = threading.Lock()
+_blas_controller = None
+_blas_limiter = None
+_blas_users = 0
+
+
+def _fused_knn_vote_numpy(queries, train, label_codes, n_classes, k, manhattan, epsilon):
+    """
+    NumPy fallback for the fused kernel: blocked distances, top-k selection and a
+    vectorized inverse-distance vote. Used when Numba is not installed.
+    """
+    predictions = np.empty(len(queries), dtype=np.int64)
+    k = min(k, len(train))
+
+    for start in range(0, len(queries), QUERY_BLOCK_SIZE):
+        block = queries[start:start + QUERY_BLOCK_SIZE]
+        diffs = block[:, np.newaxis, :] - train[np.newaxis, :, :]
+        if manhattan:
+            dists = np.sum(np.abs(diffs), axis=2)
+        else:
+            dists = np.sqrt(np.sum(diffs ** 2, axis=2))
+
+        if k < dists.shape[1]:
+            indices = np.argpartition(dists, kth=k - 1, axis=1)[:, :k]
+        else:
+            indices = np.broadcast_to(np.arange(dists.shape[1]), dists.shape)
+        weights = 1 / (np.take_along_axis(dists, indices, axis=1) + epsilon)
+
+        votes = np.zeros((len(block), n_classes))
+        rows = np.repeat(np.arange(len(block)), k)
+        np.add.at(votes, (rows, label_codes[indices].ravel()), weights.ravel())
+        predictions[start:start + len(block)] = np.argmax(votes, axis=1)
+
+    return predictions
+
+
+def _build_numba_kernel():
+    import numba
+
+    @numba.njit(cache=True, nogil=True, inline="always")
+    def sift_down(heap_d, heap_i, k):
+        # Restores the max-heap property after the root was replaced
+        pos = 0
+        while True:
+            left = 2 * pos + 1
+            if left >= k:
+                break
+            largest = left
+            right = left + 1
+            if right < k and heap_d[right] > heap_d[left]:
+                largest = right
+            if heap_d[largest] <= heap_d[pos]:
+                break
+            heap_d[pos], heap_d[largest] = heap_d[largest], heap_d[pos]
+            heap_i[pos], heap_i[largest] = heap_i[largest], heap_i[pos]
+            pos = largest
+
+    @numba.njit(cache=True, nogil=True, parallel=True, fastmath=False)
+    def fused_knn_vote(queries, train, label_codes, n_classes, k, manhattan, epsilon):
+        n_queries, n_features = queries.shape
+        n_train = train.shape[0]
+        k = min(k, n_train)
+        n_blocks = (n_queries + QUERY_BLOCK_SIZE - 1) // QUERY_BLOCK_SIZE
+        predictions = np.empty(n_queries, dtype=np.int64)
+
+        for block in numba.prange(n_blocks):
+            start = block * QUERY_BLOCK_SIZE
+            end = min(start + QUERY_BLOCK_SIZE, n_queries)
+            size = end - start
+
+            # One bounded max-heap per query; the root is the current k-th best distance
+            # (squared for Euclidean, so the square root is only taken for the k winners)
+            heap_d = np.full((size, k), np.inf)
+            heap_i = np.full((size, k), -1, dtype=np.int64)
+
+            for j in range(n_train):
+                row = train[j]
+                for qi in range(size):
+                    query = queries[start + qi]
+                    bound = heap_d[qi, 0]
+                    acc = 0.0
+                    for f in range(n_features):
+                        diff = query[f] - row[f]
+                        if manhattan:
+                            acc += abs(diff)
+                        else:
+                            acc += diff * diff
+                        # Partial sums only grow, so stop once this row cannot make the top k
+                        if acc >= bound:
+                            break
+                    if acc < bound:
+                        heap_d[qi, 0] = acc
+                        heap_i[qi, 0] = j
+                        sift_down(heap_d[qi], heap_i[qi], k)
+
+            for qi in range(size):
+                votes = np.zeros(n_classes)
+                for h in range(k):
+                    idx = heap_i[qi, h]
+                    if idx >= 0:
+                        dist = heap_d[qi, h] if manhattan else np.sqrt(heap_d[qi, h])
+                        votes[label_codes[idx]] += 1.0 / (dist + epsilon)
+                predictions[start + qi] = np.argmax(votes)
+
+        return predictions
+
+    return fused_knn_vote
+
+
+def numba_available():
+    """
+    Returns:
+    - bool: True if Numba can be imported.
+    """
+    try:
+        import numba  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def fused_knn_vote(queries, train, label_codes, n_classes, k, metric=DistanceMetric.EUCLIDEAN, epsilon=1e-5):
+    """
+    Brute-force weighted KNN with distance, top-k and vote fused into one pass.
+
+    With Numba installed, a compiled kernel streams every training row once per block
+    of queries, keeps a bounded heap of the k best per query, abandons a distance as
+    soon as its partial sum exceeds the current k-th best, and votes in the same pass.
+    Query blocks run in parallel. Without Numba an equivalent NumPy implementation is used.
+    Numba is imported and the kernel compiled on first use.
+
+    Parameters:
+    - queries (np.ndarray): Queries of shape (n_queries, n_features).
+    - train (np.ndarray): Training features of shape (n_train, n_features).
+    - label_codes (np.ndarray): Integer class code of every training point.
+    - n_classes (int): Number of distinct class codes.
+    - k (int): Number of neighbors.
+    - metric (DistanceMetric): EUCLIDEAN or MANHATTAN.
+    - epsilon (float): A small constant to avoid division by zero in weight calculation.
+
+    Returns:
+    - np.ndarray: Predicted class code for every query.
+    """
+    global _numba_kernel
+
+    metric = DistanceMetric(metric)
+    if metric not in (DistanceMetric.EUCLIDEAN, DistanceMetric.MANHATTAN):
+        raise ValueError(f"Unsupported distance metric: {metric}")
+    manhattan = metric == DistanceMetric.MANHATTAN
+
+    queries = np.ascontiguousarray(np.atleast_2d(queries), dtype=train.dtype)
+    label_codes = np.asarray(label_codes, dtype=np.int64)
+
+    if _numba_kernel is None and numba_available():
+        _numba_kernel = _build_numba_kernel()
+
+    if _numba_kernel is not None:
+        return _numba_kernel(queries, np.ascontiguousarray(train), label_codes, n_classes, k, manhattan, epsilon)
+    return _fused_knn_vote_numpy(queries, np.asarray(train), label_codes, n_classes, k, manhattan, epsilon)
+
+
+@contextmanager
+def thread_limit(n_threads):
+    """
+    Limits the threads used by the Numba kernel and by the BLAS/OpenMP libraries that
+    NumPy and scikit-learn call into, for the duration of the block.
+
+    The Numba limit only applies to the calling thread. The BLAS limits are process-wide
+    while any limited block runs: they are set when the first one starts, with its thread
+    count, and the previous limits are restored when the last one ends.
+
+    Parameters:
+    - n_threads (int, optional): Number of threads; capped at what Numba was started with.
+      None leaves every limit as it is.
+    """
+    global _blas_controller, _blas_limiter, _blas_users
+
+    if n_threads is None:
+        yield
+        return
+
+    with _blas_lock:
+        if _blas_users == 0:
+            if _blas_controller is None:
+                # Finding the loaded libraries is slow, so it is done once
+                from threadpoolctl import ThreadpoolController
+                _blas_controller = ThreadpoolController()
+            _blas_limiter = _blas_controller.limit(limits=n_threads)
+        _blas_users += 1
+
+    # Numba is only limited if something imported it; this must not import it
+    numba = sys.modules.get("numba")
+    previous = None
+    if numba is not None:
+        previous = numba.get_num_threads()
+        numba.set_num_threads(max(1, min(n_threads, numba.config.NUMBA_NUM_THREADS)))
+    try:
+        yield
+    finally:
+        if previous is not None:
+            numba.set_num_threads(previous)
+        with _blas_lock:
+            _blas_users -= 1
+            if _blas_users == 0:
+                _blas_limiter.restore_original_limits()
+                _blas_limiter = None
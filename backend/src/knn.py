@@ -1,14 +1,88 @@
+import random
+import threading
 import numpy as np
-import pandas as pd
 from collections import defaultdict
-from sklearn.model_selection import KFold
-import matplotlib.pyplot as plt
+from functools import wraps
 from sklearn.neighbors import BallTree
+from backends import get_backend
+from condensation import kmeans_prototypes
+from index_cache import MergedIndexCache
+from pivot_index import PivotIndex, build_pivot_table
+from kernels import fused_knn_vote, thread_limit
+from common.compute_backend import ComputeBackend
 from common.distance_metrics import DistanceMetric
 from common.indexing_structures import IndexingStructure
+from common.precision import Precision
 from utils import timeit
 from sklearn.neighbors import KDTree
-import cupy as cp
+
+try:
+    # The 32-bit trees keep float32 data as it is; KDTree and BallTree copy it to float64
+    from sklearn.neighbors._ball_tree import BallTree32
+    from sklearn.neighbors._kd_tree import KDTree32
+except ImportError:
+    BallTree32, KDTree32 = BallTree, KDTree
+
+# Queries per batch when neither batch_size nor a memory budget is given
+DEFAULT_BATCH_SIZE = 100
+
+
+def _kd_tree(features, **kwargs):
+    return (KDTree32 if features.dtype == np.float32 else KDTree)(features, **kwargs)
+
+
+def _ball_tree(features, **kwargs):
+    return (BallTree32 if features.dtype == np.float32 else BallTree)(features, **kwargs)
+
+
+def _thread_limited(method):
+    """
+    Runs a search method under the model's `threads` limit (see `kernels.thread_limit`).
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.threads is None:
+            return method(self, *args, **kwargs)
+        with thread_limit(self.threads):
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+class _Snapshot:
+    """
+    The state of a fitted model that queries read: the training arrays, the search
+    structures built over them and the delta buffer of points added since.
+
+    Snapshots are never modified. `fit`, `add` and `compact` swap in a new one with a
+    single assignment, and a query reads `KNN._snapshot` once, so it never combines a
+    tree with the arrays or delta buffer of another build.
+    """
+
+    __slots__ = ("features", "labels", "ball_trees", "kd_tree", "category_indexes", "class_centroids",
+                 "pivot_tables", "prefix_trees", "delta_features", "delta_labels")
+
+    def __init__(self, features=None, labels=None, ball_trees=None, kd_tree=None, category_indexes=None,
+                 class_centroids=None, pivot_tables=None, prefix_trees=None, delta_features=None, delta_labels=None):
+        self.features = features
+        self.labels = labels
+        self.ball_trees = {} if ball_trees is None else ball_trees
+        self.kd_tree = kd_tree
+        # label -> (row indices, KD tree over those rows, tree metric) for category-restricted queries
+        self.category_indexes = category_indexes
+        # (centroid features, centroid labels) used to shortlist classes
+        self.class_centroids = class_centroids
+        # metric -> (pivots, pivot table) of the PIVOT index
+        self.pivot_tables = {} if pivot_tables is None else pivot_tables
+        # (dims, metric) -> KD tree over the first dims columns, for the cascade search
+        self.prefix_trees = {} if prefix_trees is None else prefix_trees
+        # Points added with `add` that are not part of the trees yet, searched by brute force
+        self.delta_features = delta_features
+        self.delta_labels = delta_labels
+
+    def replace(self, **changes):
+        values = {name: getattr(self, name) for name in self.__slots__}
+        values.update(changes)
+        return _Snapshot(**values)
 
 
 class KNN:
@@ -16,29 +90,372 @@ class KNN:
     A simple implementation of the weighted K-Nearest Neighbors (KNN) classifier.
     """
 
-    def __init__(self, best_k=3):
+    def __init__(self, best_k=3, compaction_threshold=1000, backend=ComputeBackend.NUMPY, memory_budget=None,
+                 cascade_dims=16, cascade_shortlist=64, merged_index_cache_size=8,
+                 shortlist_classes=5, centroids_per_class=1, shortlist_audit_rate=0.05, n_pivots=32,
+                 leaf_size=40, batch_size=None, default_indexing=IndexingStructure.KD_TREE, precision=None,
+                 prebuilt_indexings=(), threads=None):
         """
         Initializes the KNN classifier.
 
         Parameters:
         - best_k (int): Default number of neighbors to consider during prediction.
+        - compaction_threshold (int): Number of points added with `add` after which the
+          search trees are rebuilt in the background to include them.
+        - backend (ComputeBackend or str): Compute backend for the brute-force distance and
+          top-k computations (see `backends.py`). Optional backends are imported on first use.
+        - memory_budget (int, optional): Bytes the batch predictors may use for their working
+          arrays. When set, queries are processed in tiles sized to stay within it instead of
+          fixed batches of DEFAULT_BATCH_SIZE.
+        - cascade_dims (int): Number of leading (highest-variance PCA) dimensions the cascade
+          search uses to shortlist candidates.
+        - cascade_shortlist (int): Number of candidates the cascade search re-ranks in full dimension.
+        - merged_index_cache_size (int): Number of merged indexes kept for frequently requested
+          category subsets (see `category_neighbors`).
+        - shortlist_classes (int): Number of classes, ranked by centroid distance, that the
+          class shortlist search runs the exact KNN over.
+        - centroids_per_class (int): Centroids stored per class; more than one uses k-means sub-centroids.
+        - shortlist_audit_rate (float): Fraction of class shortlist predictions that are also
+          answered by the full search to measure how often the shortlist misses the exact answer.
+        - n_pivots (int): Number of pivots of the PIVOT index (see `pivot_index.py`).
+        - leaf_size (int): Leaf size of the KD and Ball trees.
+        - batch_size (int, optional): Queries per batch when no memory_budget is set.
+          Defaults to DEFAULT_BATCH_SIZE.
+        - default_indexing (IndexingStructure): Search structure `adaptive_prediction` uses
+          when none is given.
+        - precision (Precision, optional): Floating point type the training features, search
+          structures and distance computations use. Queries are converted to it. Defaults to
+          the dtype of the features passed to `fit` (float64 for non-float features).
+        - prebuilt_indexings (iterable): Structures besides the KD and Ball trees whose indexes
+          `fit` builds up front, so that they are pickled and shared by workers serving a
+          memory-mapped model: PIVOT, CASCADE or CLASS_SHORTLIST. `default_indexing` is always
+          included. Other indexes are built on first use.
+        - threads (int, optional): Threads the Numba kernel and the BLAS libraries may use
+          during this model's searches. None leaves the process settings as they are.
+
+        `apply_tuning_profile` sets leaf_size, batch_size, default_indexing and threads from a
+        profile written by `tuning.py`.
         """
-        self.training_features = None
-        self.training_labels = None
+        self._snapshot = _Snapshot()
         self.best_k = best_k
-        self.ball_trees = {}
-        self.kd_tree = None
+        self.backend = backend
+        self.memory_budget = memory_budget
+        self.cascade_dims = cascade_dims
+        self.cascade_shortlist = cascade_shortlist
+        self.merged_index_cache_size = merged_index_cache_size
+        self.shortlist_classes = shortlist_classes
+        self.centroids_per_class = centroids_per_class
+        self.shortlist_audit_rate = shortlist_audit_rate
+        self.n_pivots = n_pivots
+        self.leaf_size = leaf_size
+        self.batch_size = batch_size
+        self.default_indexing = default_indexing
+        self.precision = precision
+        self.prebuilt_indexings = tuple(IndexingStructure(indexing) for indexing in prebuilt_indexings)
+        self.threads = threads
+        self.metric = DistanceMetric.EUCLIDEAN
+        self.compaction_threshold = compaction_threshold
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None
+        self._label_codes = None
+        self._prefix_indexes = None
+        self._pivot_indexes = None
+        self._merged_indexes = MergedIndexCache(self._build_merged_index, max_size=merged_index_cache_size)
+        self._shortlist_stats = {"predictions": 0, "audited": 0, "missed": 0, "disagreed": 0}
+
+    # Pickled attribute names of the snapshot fields, kept flat so that the pickle format
+    # is the same as before snapshots existed
+    _SNAPSHOT_STATE = {"training_features": "features", "training_labels": "labels", "ball_trees": "ball_trees",
+                       "kd_tree": "kd_tree", "category_indexes": "category_indexes",
+                       "class_centroids": "class_centroids", "pivot_tables": "pivot_tables",
+                       "prefix_trees": "prefix_trees"}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ("_lock", "_compaction_lock", "_compaction_thread", "_label_codes", "_prefix_indexes",
+                     "_merged_indexes", "_shortlist_stats", "_pivot_indexes", "_snapshot"):
+            state.pop(name, None)
+        snapshot = self._snapshot
+        for name, field in self._SNAPSHOT_STATE.items():
+            state[name] = getattr(snapshot, field)
+        state["_delta"] = (snapshot.delta_features, snapshot.delta_labels)
+        return state
+
+    def __setstate__(self, state):
+        snapshot = {field: state.pop(name, None) for name, field in self._SNAPSHOT_STATE.items()}
+        # Models pickled before online insertion existed have no delta buffer; later ones
+        # until snapshots existed also stored its offset
+        delta = state.pop("_delta", None) or (None, None)
+        self._snapshot = _Snapshot(delta_features=delta[0], delta_labels=delta[1], **snapshot)
+        state.setdefault("metric", DistanceMetric.EUCLIDEAN)
+        state.setdefault("compaction_threshold", 1000)
+        state.setdefault("backend", ComputeBackend.NUMPY)
+        state.setdefault("memory_budget", None)
+        state.setdefault("cascade_dims", 16)
+        state.setdefault("cascade_shortlist", 64)
+        state.setdefault("merged_index_cache_size", 8)
+        state.setdefault("shortlist_classes", 5)
+        state.setdefault("centroids_per_class", 1)
+        state.setdefault("shortlist_audit_rate", 0.05)
+        state.setdefault("n_pivots", 32)
+        state.setdefault("leaf_size", 40)
+        state.setdefault("batch_size", None)
+        state.setdefault("default_indexing", IndexingStructure.KD_TREE)
+        state.setdefault("precision", None)
+        state.setdefault("prebuilt_indexings", ())
+        state.setdefault("threads", None)
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._compaction_lock = threading.Lock()
+        self._compaction_thread = None
+        self._label_codes = None
+        self._prefix_indexes = None
+        self._pivot_indexes = None
+        self._merged_indexes = MergedIndexCache(self._build_merged_index, max_size=self.merged_index_cache_size)
+        self._shortlist_stats = {"predictions": 0, "audited": 0, "missed": 0, "disagreed": 0}
+
+    # Read-only views of the current snapshot. A method that reads more than one of them
+    # takes `self._snapshot` once instead, so all its reads come from the same build.
+    @property
+    def training_features(self):
+        return self._snapshot.features
+
+    @property
+    def training_labels(self):
+        return self._snapshot.labels
+
+    @property
+    def ball_trees(self):
+        return self._snapshot.ball_trees
+
+    @property
+    def kd_tree(self):
+        return self._snapshot.kd_tree
+
+    @property
+    def category_indexes(self):
+        return self._snapshot.category_indexes
+
+    @property
+    def class_centroids(self):
+        return self._snapshot.class_centroids
+
+    @_thread_limited
+    def adaptive_prediction(self, test_point, k = 5, metric=DistanceMetric.EUCLIDEAN, indexing=None,
+                            categories=None, shortlist_classes=None):
+        if indexing is None:
+            indexing = self.default_indexing
+        if IndexingStructure(indexing) == IndexingStructure.CLASS_SHORTLIST:
+            return self.predict_with_class_shortlist(test_point=test_point, k=k, metric=metric,
+                                                     n_classes=shortlist_classes, categories=categories)
+
+        # Restricting the answer to some categories searches their sub-indexes instead
+        if categories is not None and not self._covers_all_categories(categories):
+            return self.predict_in_categories(test_point=test_point, categories=categories, k=k, metric=metric)
 
-    def adaptive_prediction(self, test_point, k = 5, metric=DistanceMetric.EUCLIDEAN, indexing=IndexingStructure.KD_TREE):
         matches = {
             IndexingStructure.KD_TREE: lambda: self.predict_with_kd_tree_weighted(test_point=test_point, k=k, metric=metric),
             IndexingStructure.BALL_TREE: lambda: self.predict_with_ball_tree_weighted(test_point=test_point, k=k, metric=metric),
             IndexingStructure.BRUTE_FORCE: lambda: self.predict_weighted(test_point=test_point, k=k, metric=metric),
+            IndexingStructure.BRUTE_FORCE_FUSED: lambda: self.predict_weighted_fused(test_point=test_point, k=k, metric=metric),
+            IndexingStructure.CASCADE: lambda: self.predict_cascade(test_point=test_point, k=k, metric=metric),
+            IndexingStructure.PIVOT: lambda: self.predict_with_pivot_index(test_point=test_point, k=k, metric=metric),
         }
 
         indexing_enum = IndexingStructure(indexing)
         return matches[indexing_enum]()
 
+    def _as_queries(self, testing_points, features=None):
+        """
+        Queries as a 2D array in the dtype of the searched features, so that float32 models
+        compute their distances in float32 instead of upcasting to float64.
+        """
+        if features is None:
+            features = self.training_features
+        return np.asarray(testing_points, dtype=features.dtype).reshape(-1, features.shape[1])
+
+    @_thread_limited
+    def query_neighbors(self, testing_points, k=None, metric=DistanceMetric.EUCLIDEAN,
+                        indexing=IndexingStructure.KD_TREE, batch_size=None):
+        """
+        Finds the k nearest training points for each query without voting.
+
+        This is the building block for combining neighbors from several indexes
+        (e.g. shards) before a single weighted vote.
+
+        Parameters:
+        - testing_points (np.ndarray): A 1D feature vector or a 2D array of shape (n_samples, n_features).
+        - k (int, optional): Number of neighbors to return. Defaults to self.best_k.
+          Clamped to the number of training points (including points added with `add`).
+        - metric (DistanceMetric): Distance metric to use.
+        - indexing (IndexingStructure): Search structure to use.
+        - batch_size (int, optional): Number of queries per brute-force distance batch.
+          Derived from the memory budget if not given.
+
+        Returns:
+        - tuple: (dists, labels), both of shape (n_samples, k), sorted by ascending distance.
+        """
+        if k is None:
+            k = self.best_k
+        snapshot = self._snapshot
+        k_main = min(k, len(snapshot.features))
+
+        testing_points = self._as_queries(testing_points, snapshot.features)
+        metric = DistanceMetric(metric)
+        indexing = IndexingStructure(indexing)
+
+        if indexing == IndexingStructure.KD_TREE:
+            if metric != DistanceMetric.EUCLIDEAN:
+                raise ValueError(f"KD_Tree only supports the EUCLIDEAN distance metric, got {metric.value}")
+            dists, indices = snapshot.kd_tree.query(testing_points, k=k_main)
+        elif indexing == IndexingStructure.BALL_TREE:
+            dists, indices = snapshot.ball_trees[metric].query(testing_points, k=k_main)
+        elif indexing == IndexingStructure.CASCADE:
+            dists, indices = self.cascade_neighbors(testing_points, k_main, metric, batch_size=batch_size,
+                                                    snapshot=snapshot)
+        elif indexing == IndexingStructure.PIVOT:
+            dists, indices = self.pivot_index(metric, snapshot).query(testing_points, k=k_main)
+        else:
+            dists, indices = self._brute_force_neighbors(testing_points, k_main, metric, batch_size,
+                                                         features=snapshot.features)
+
+        return self._merge_delta(snapshot, testing_points, dists, snapshot.labels[indices], k, metric)
+
+    def tile_size(self, testing_points, k=None, brute_force=True, features=None, batch_size=None):
+        """
+        Number of queries to process at once in a batch prediction.
+
+        Brute-force tiles hold a (tile, n_train, n_features) difference array, a
+        (tile, n_train) distance matrix and the argpartition indices, so the tile is
+        budget / (n_train * ((n_features + 1) * itemsize + 8)). Tree queries only keep
+        the query and its k neighbors per row.
+
+        Parameters:
+        - testing_points (np.ndarray): The queries; their dtype and count are used.
+        - k (int, optional): Number of neighbors. Defaults to self.best_k.
+        - brute_force (bool): Size for the broadcast distance paths rather than tree queries.
+        - features (np.ndarray, optional): Points searched. Defaults to self.training_features.
+        - batch_size (int, optional): Explicit tile size, returned unchanged.
+          Without it and a memory budget, `self.batch_size` or DEFAULT_BATCH_SIZE is used.
+
+        Returns:
+        - int: Tile size, at least 1 and at most the number of queries.
+        """
+        if batch_size is not None:
+            return batch_size
+        if self.memory_budget is None:
+            return self.batch_size or DEFAULT_BATCH_SIZE
+
+        if k is None:
+            k = self.best_k
+        if features is None:
+            features = self.training_features
+        testing_points = np.asarray(testing_points)
+        n_train, n_features = features.shape
+        itemsize = np.result_type(testing_points.dtype, features.dtype).itemsize
+
+        if brute_force:
+            bytes_per_query = n_train * ((n_features + 1) * itemsize + np.dtype(np.intp).itemsize)
+        else:
+            # Distances, indices and labels of the neighbors, plus their merge with the delta buffer
+            bytes_per_query = n_features * itemsize + 4 * k * 8
+
+        n_queries = max(1, len(testing_points) if testing_points.ndim > 1 else 1)
+        return int(max(1, min(n_queries, self.memory_budget // bytes_per_query)))
+
+    def _brute_force_neighbors(self, testing_points, k, metric, batch_size=None, features=None):
+        """
+        Exhaustive k-nearest-neighbor search on the model's compute backend,
+        processed in batches of queries.
+
+        Parameters:
+        - testing_points (np.ndarray): Queries of shape (n_samples, n_features).
+        - k (int): Number of neighbors; clamped to the number of training points.
+        - metric (DistanceMetric): Distance metric to use.
+        - batch_size (int, optional): Number of queries per distance batch. Derived from the
+          memory budget if not given.
+        - features (np.ndarray, optional): Points to search. Defaults to self.training_features.
+
+        Returns:
+        - tuple: (dists, indices) as NumPy arrays of shape (n_samples, k), sorted by ascending distance.
+        """
+        backend = get_backend(self.backend)
+        features = backend.prepare(self.training_features if features is None else features)
+        testing_points = self._as_queries(testing_points, features)
+        k = min(k, features.shape[0])
+        batch_size = self.tile_size(testing_points, k, features=features, batch_size=batch_size)
+
+        all_dists = np.empty((len(testing_points), k))
+        all_indices = np.empty((len(testing_points), k), dtype=np.intp)
+
+        for start in range(0, len(testing_points), batch_size):
+            end = min(start + batch_size, len(testing_points))
+            dists = backend.pairwise_distances(testing_points[start:end], features, metric)
+            all_dists[start:end], all_indices[start:end] = backend.smallest_k(dists, k)
+
+        return all_dists, all_indices
+
+    def _merge_delta(self, snapshot, testing_points, dists, labels, k, metric, categories=None):
+        """
+        Merges neighbors found in the main index with the delta buffer of points
+        added since the search trees were last built.
+
+        Parameters:
+        - snapshot (_Snapshot): The snapshot the main-index neighbors were found in.
+        - testing_points (np.ndarray): Queries of shape (n_samples, n_features).
+        - dists (np.ndarray): Main-index neighbor distances of shape (n_samples, k_main).
+        - labels (np.ndarray): Main-index neighbor labels of shape (n_samples, k_main).
+        - k (int): Number of neighbors to keep.
+        - metric (DistanceMetric): Distance metric to use for the delta points.
+        - categories (list, optional): Only merge delta points with one of these labels.
+
+        Returns:
+        - tuple: (dists, labels) of the k nearest neighbors overall, sorted by ascending distance.
+        """
+        delta_features, delta_labels = snapshot.delta_features, snapshot.delta_labels
+        if delta_features is None:
+            return dists, labels
+
+        if categories is not None:
+            allowed = np.isin(delta_labels, categories)
+            delta_features, delta_labels = delta_features[allowed], delta_labels[allowed]
+        if len(delta_features) == 0:
+            return dists, labels
+
+        testing_points = self._as_queries(testing_points, delta_features)
+        # The delta buffer is small and changes constantly, so it is always searched on the CPU
+        delta_dists = get_backend(ComputeBackend.NUMPY).pairwise_distances(
+            testing_points, delta_features, DistanceMetric(metric))
+
+        dists = np.concatenate([np.asarray(dists).reshape(len(testing_points), -1), delta_dists], axis=1)
+        labels = np.concatenate([
+            np.asarray(labels).reshape(len(testing_points), -1),
+            np.broadcast_to(delta_labels, delta_dists.shape),
+        ], axis=1)
+
+        order = np.argsort(dists, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(dists, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    @staticmethod
+    def weighted_vote(dists, labels, epsilon=1e-5):
+        """
+        Inverse-distance weighted majority vote over one query's neighbors.
+
+        Parameters:
+        - dists (array-like): Distances to the neighbors.
+        - labels (array-like): Labels of the neighbors.
+        - epsilon (float): A small constant to avoid division by zero in weight calculation.
+
+        Returns:
+        - The label with the largest summed weight.
+        """
+        weights = defaultdict(float)
+        for dist, label in zip(dists, labels):
+            weights[label] += 1 / (dist + epsilon)
+
+        return max(weights.items(), key=lambda x: x[1])[0]
+
     @timeit
     def eucledean_distances_fast(self, test_point):
         """
@@ -67,26 +484,17 @@ class KNN:
         """
         if k is None:
             k = self.best_k
+        snapshot = self._snapshot
 
-        if metric == DistanceMetric.EUCLIDEAN:
-            dists = np.linalg.norm(self.training_features - test_point, axis=1)
-        elif metric == DistanceMetric.MANHATTAN:
-            dists = np.sum(np.abs(self.training_features - test_point), axis=1)
-        else:
-            raise ValueError(f"Unsupported distance metric: {metric}")
-        
-        knn_indices = np.argsort(dists)[:k]
+        dists, knn_indices = self._brute_force_neighbors(test_point, k, DistanceMetric(metric), features=snapshot.features)
 
-        weights = defaultdict(float)
-        for idx in knn_indices:
-            label = self.training_labels[idx]
-            weight = 1 / (dists[idx] + epsilon)
-            weights[label] += weight
-
-        return max(weights.items(), key=lambda x: x[1])[0]
+        neighbor_dists, neighbor_labels = self._merge_delta(
+            snapshot, test_point, dists, snapshot.labels[knn_indices], k, metric)
+        return self.weighted_vote(neighbor_dists[0], neighbor_labels[0], epsilon)
     
     @timeit
-    def predict_weighted_batch(self, testing_points, X_train=None, y_train=None, k=None, batch_size=100):
+    @_thread_limited
+    def predict_weighted_batch(self, testing_points, X_train=None, y_train=None, k=None, batch_size=None):
         """
         Predicts labels for a batch of test points using weighted K-Nearest Neighbors.
 
@@ -97,17 +505,23 @@ class KNN:
         Parameters:
         - testing_points (np.ndarray): A 2D array of shape (n_samples, n_features) containing test data.
         - k (int, optional): Number of neighbors to use. Defaults to `self.best_k` if not specified.
-        - batch_size (int): Number of test points to process in a single batch to reduce memory usage.
+        - batch_size (int, optional): Number of test points to process in a single batch to reduce memory usage.
+          Derived from the memory budget if not given.
 
         Returns:
         - np.ndarray: Predicted labels for each test point in the input array.
         """
+        # Points added with `add` are only searched when predicting against the model's own data
+        use_delta = X_train is None and y_train is None
+        snapshot = self._snapshot
         if X_train is None:
-            X_train = self.training_features
+            X_train = snapshot.features
         if y_train is None:
-            y_train = self.training_labels
+            y_train = snapshot.labels
         if k is None:
             k = self.best_k
+        testing_points = self._as_queries(testing_points, X_train)
+        batch_size = self.tile_size(testing_points, k, features=X_train, batch_size=batch_size)
 
         predictions = []
 
@@ -115,143 +529,638 @@ class KNN:
             end = min(start + batch_size, len(testing_points))
             X_batch = testing_points[start:end]
 
-            # Compute all pairwise distances between test batch and training points
-            dists = np.sqrt(
-                np.sum((X_batch[:, np.newaxis, :] - X_train[np.newaxis, :, :]) ** 2, axis=2)
-            )
+            # Distances to all training points and the k nearest neighbors of each test point
+            neighbor_dists, knn_indices = self._brute_force_neighbors(
+                X_batch, k, DistanceMetric.EUCLIDEAN, batch_size, features=X_train)
+            neighbor_labels = y_train[knn_indices]
 
-            # Get indices of the k nearest neighbors for each test point
-            knn_indices = np.argpartition(dists, kth=k, axis=1)[:, :k]
+            if use_delta:
+                neighbor_dists, neighbor_labels = self._merge_delta(
+                    snapshot, X_batch, neighbor_dists, neighbor_labels, k, DistanceMetric.EUCLIDEAN)
 
             # Predict label for each point in the batch
-            for i in range(len(X_batch)):
-                neighbor_idxs = knn_indices[i]
-                neighbor_labels = y_train[neighbor_idxs]
-                neighbor_dists = dists[i][neighbor_idxs]
-                weights = 1 / (neighbor_dists + 1e-8)
+            predictions.extend(self.weighted_vote(d, l, 1e-8) for d, l in zip(neighbor_dists, neighbor_labels))
 
-                votes = defaultdict(float)
-                for lbl, w in zip(neighbor_labels, weights):
-                    votes[lbl] += w
+        return np.array(predictions)
 
-                pred = max(votes.items(), key=lambda x: x[1])[0]
-                predictions.append(pred)
+    def _encoded_labels(self, labels):
+        """
+        Integer codes of the training labels for the fused kernel, cached per label array.
 
-        return np.array(predictions)
+        Returns:
+        - tuple: (classes, codes) where classes[codes] == labels.
+        """
+        cached = self._label_codes
+        if cached is None or cached[0] is not labels:
+            classes, codes = np.unique(labels, return_inverse=True)
+            cached = (labels, classes, codes)
+            self._label_codes = cached
+        return cached[1], cached[2]
 
     @timeit
-    def predict_weighted_gpu(self, test_point, k=None, epsilon=1e-5):
+    def predict_weighted_fused(self, test_point, k=None, epsilon=1e-5, metric=DistanceMetric.EUCLIDEAN):
+        """
+        Predicts the label for a single test point with the fused brute-force kernel
+        (see `kernels.py`). Gives the same prediction as `predict_weighted`.
+
+        Parameters:
+        - test_point (np.ndarray): The input feature vector to classify.
+        - k (int, optional): The number of neighbors to consider. Defaults to self.best_k.
+        - epsilon (float): A small constant to avoid division by zero in weight calculation.
+        - metric (DistanceMetric): EUCLIDEAN or MANHATTAN.
+
+        Returns:
+        - Predicted label based on weighted majority voting.
+        """
+        return self.predict_weighted_fused_batch(test_point, k=k, epsilon=epsilon, metric=metric)[0]
+
+    @_thread_limited
+    def predict_weighted_fused_batch(self, testing_points, k=None, epsilon=1e-5, metric=DistanceMetric.EUCLIDEAN):
+        """
+        Predicts labels for a batch of test points with the fused brute-force kernel.
+
+        Distances, top-k selection and the weighted vote run in a single pass over the
+        training data without materializing the distance matrix. Uses Numba when it is
+        installed and a NumPy implementation otherwise.
+
+        Parameters:
+        - testing_points (np.ndarray): A 1D feature vector or a 2D array of shape (n_samples, n_features).
+        - k (int, optional): Number of neighbors to use. Defaults to `self.best_k`.
+        - epsilon (float): A small constant to avoid division by zero in weight calculation.
+        - metric (DistanceMetric): EUCLIDEAN or MANHATTAN.
+
+        Returns:
+        - np.ndarray: Predicted labels for each test point.
+        """
         if k is None:
             k = self.best_k
 
-        # Convert to CuPy arrays
-        test_point = cp.asarray(test_point)
-        train_data = cp.asarray(self.training_features)  # np -> cp
-        labels = self.training_labels  # stay on CPU
+        snapshot = self._snapshot
+        testing_points = self._as_queries(testing_points, snapshot.features)
 
-        # Compute distances
-        dists = cp.sqrt(cp.sum((train_data - test_point) ** 2, axis=1))
+        # The kernel only sees the compacted training set, so merge pending points the usual way
+        if snapshot.delta_features is not None:
+            return np.array([self.predict_weighted(point, k=k, epsilon=epsilon, metric=metric)
+                             for point in testing_points])
 
-        # k nearest neighbors
-        knn_indices = cp.asnumpy(cp.argsort(dists)[:k])
+        classes, codes = self._encoded_labels(snapshot.labels)
+        predicted = fused_knn_vote(testing_points, snapshot.features, codes, len(classes), k,
+                                   metric=metric, epsilon=epsilon)
+        return classes[predicted]
 
-        weights = defaultdict(float)
-        for idx in knn_indices:
-            label = labels[idx]
-            weight = 1 / (float(dists[idx].get()) + epsilon)
-            weights[label] += weight
+    @timeit
+    def predict_with_ball_tree_weighted(self, test_point: np.ndarray, k=None, epsilon=1e-5, metric=DistanceMetric.EUCLIDEAN):
+        """
+        Predicts the label using a Ball Tree-based weighted KNN.
 
-        return max(weights.items(), key=lambda x: x[1])[0]
-    
+        Parameters:
+        - test_point (np.ndarray): The input feature vector to classify.
+        - k (int, optional): Number of neighbors to consider. Defaults to self.best_k.
+        - epsilon (float): Small constant to avoid division by zero in weight calculation.
+
+        Returns:
+        - Predicted label.
+        """
+        if k is None:
+            k = self.best_k
+
+        if metric not in [DistanceMetric.EUCLIDEAN, DistanceMetric.MANHATTAN]:
+            raise ValueError(f"BallTree only supports EUCLIDEAN and MANHATTAN distances, got {metric}.")
+
+        # Query BallTree for k nearest neighbors
+        snapshot = self._snapshot
+        test_point = self._as_queries(test_point, snapshot.features)
+        dists, indices = snapshot.ball_trees[metric].query(test_point, k=k)
+        dists, labels = self._merge_delta(snapshot, test_point, dists, snapshot.labels[indices], k, metric)
+
+        return self.weighted_vote(dists[0], labels[0], epsilon)
     
     @timeit
-    def predict_weighted_batch_gpu(self, testing_points, X_train=None, y_train=None, k=None, batch_size=100):
-        if X_train is None:
-            X_train = cp.asarray(self.training_features)  # np -> cp
-        else:
-            X_train = cp.asarray(X_train)
+    @_thread_limited
+    def predict_with_ball_tree_weighted_batch(self, testing_points, k=None, batch_size=None, epsilon=1e-5,
+                                              metric=DistanceMetric.EUCLIDEAN):
+        """
+        Predicts labels for a batch of test points using Ball Tree-based weighted KNN.
 
-        if y_train is None:
-            y_train = self.training_labels  # CPU
+        Parameters:
+        - testing_points (np.ndarray): A 2D array of shape (n_samples, n_features) containing test data.
+        - k (int, optional): Number of neighbors to consider. Defaults to self.best_k.
+        - batch_size (int, optional): Number of test points to process per batch. Derived from the
+          memory budget if not given.
+        - epsilon (float): Small constant to avoid division by zero in weight calculation.
+        - metric (DistanceMetric): EUCLIDEAN or MANHATTAN.
+
+        Returns:
+        - np.ndarray: Predicted labels for each test point in the input array.
+        """
         if k is None:
             k = self.best_k
+        snapshot = self._snapshot
+        testing_points = self._as_queries(testing_points, snapshot.features)
+        batch_size = self.tile_size(testing_points, k, brute_force=False, batch_size=batch_size)
 
-        testing_points = cp.asarray(testing_points)  # np -> cp
         predictions = []
 
         for start in range(0, len(testing_points), batch_size):
             end = min(start + batch_size, len(testing_points))
-            X_batch = testing_points[start:end]
+            batch = testing_points[start:end]
 
-            # EUCLIDEAN distance on GPU
-            dists = cp.sqrt(cp.sum((X_batch[:, cp.newaxis, :] - X_train[cp.newaxis, :, :]) ** 2, axis=2))
+            # Query the ball tree for k neighbors for the whole batch
+            dists, indices = snapshot.ball_trees[metric].query(batch, k=k)
+            dists, labels = self._merge_delta(snapshot, batch, dists, snapshot.labels[indices], k, metric)
 
-            # Get top k indices
-            knn_indices = cp.asnumpy(cp.argpartition(dists, kth=k, axis=1)[:, :k])
+            predictions.extend(self.weighted_vote(d, l, epsilon) for d, l in zip(dists, labels))
 
-            for i in range(len(X_batch)):
-                neighbor_idxs = knn_indices[i]
-                neighbor_labels = y_train[neighbor_idxs]
-                neighbor_dists = cp.asnumpy(dists[i][neighbor_idxs])
-                weights = 1 / (neighbor_dists + 1e-8)
+        return np.array(predictions)
+    
+    def _prefix_index(self, snapshot, dims, metric, coarse):
+        """
+        Returns the coarse search structure over the first `dims` columns of the snapshot's
+        features. KD trees are part of the snapshot, built at `fit` for a prebuilt CASCADE
+        and otherwise on first use; brute-force prefixes are cached until the training
+        features are replaced.
+        """
+        if coarse == IndexingStructure.KD_TREE:
+            return self._lazy_index(snapshot, "prefix_trees", (dims, metric),
+                                    lambda features: self._build_prefix_tree(features, dims, metric))
+
+        features = snapshot.features
+        cached = self._prefix_indexes
+        if cached is None or cached[0] is not features:
+            cached = (features, {})
+            self._prefix_indexes = cached
+        if dims not in cached[1]:
+            cached[1][dims] = np.ascontiguousarray(features[:, :dims])
+        return cached[1][dims]
+
+    def _cascade_tile(self, points, snapshot, k, metric, dims, shortlist, coarse):
+        """
+        Shortlists `shortlist` candidates per query on the prefix and re-ranks them exactly.
 
-                votes = defaultdict(float)
-                for lbl, w in zip(neighbor_labels, weights):
-                    votes[lbl] += w
+        Returns:
+        - tuple: (dists, indices, certified) where certified marks the queries whose result
+          is provably exact: no point outside the shortlist can be closer than the k-th neighbor.
+        """
+        features = snapshot.features
+        index = self._prefix_index(snapshot, dims, metric, coarse)
+        if coarse == IndexingStructure.KD_TREE:
+            prefix_dists, candidates = index.query(points[:, :dims], k=shortlist)
+        else:
+            prefix_dists, candidates = self._brute_force_neighbors(points[:, :dims], shortlist, metric, features=index)
 
-                pred = max(votes.items(), key=lambda x: x[1])[0]
-                predictions.append(pred)
+        # The full distance only needs the remaining dimensions on top of the prefix distance
+        suffix = features[candidates, dims:] - points[:, np.newaxis, dims:]
+        if metric == DistanceMetric.EUCLIDEAN:
+            full_dists = np.sqrt(prefix_dists ** 2 + np.sum(np.square(suffix, out=suffix), axis=2))
+        else:
+            full_dists = prefix_dists + np.sum(np.abs(suffix, out=suffix), axis=2)
+
+        order = np.argsort(full_dists, axis=1, kind="stable")[:, :k]
+        dists = np.take_along_axis(full_dists, order, axis=1)
+        indices = np.take_along_axis(candidates, order, axis=1)
+
+        # Prefix distances are lower bounds of full distances, and every point outside the
+        # shortlist is at least as far on the prefix as the last candidate
+        certified = (shortlist >= len(features)) | (prefix_dists[:, -1] >= dists[:, -1])
+        return dists, indices, certified
+
+    def _cascade_refine(self, point, snapshot, k, metric, dims, radius, coarse):
+        """
+        Exact neighbors of one query, given an upper bound `radius` on its k-th distance.
+
+        Only points whose prefix distance is within the radius can be closer, so just those
+        are fetched from the prefix index and compared in full dimension.
+        """
+        features = snapshot.features
+        index = self._prefix_index(snapshot, dims, metric, coarse)
+        # Slack so the candidates already found are kept despite rounding differences,
+        # which are larger for float32 features
+        radius = radius * (1 + max(1e-9, 8 * np.finfo(features.dtype).eps)) + 1e-12
+        if coarse == IndexingStructure.KD_TREE:
+            candidates = index.query_radius(point[np.newaxis, :dims], r=radius)[0]
+        else:
+            prefix_dists = get_backend(ComputeBackend.NUMPY).pairwise_distances(point[np.newaxis, :dims], index, metric)
+            candidates = np.flatnonzero(prefix_dists[0] <= radius)
+
+        full_dists = get_backend(ComputeBackend.NUMPY).pairwise_distances(point[np.newaxis], features[candidates], metric)[0]
+        order = np.argsort(full_dists, kind="stable")[:k]
+        return full_dists[order], candidates[order]
+
+    def cascade_neighbors(self, testing_points, k=None, metric=DistanceMetric.EUCLIDEAN, prefix_dims=None,
+                          shortlist=None, coarse=IndexingStructure.KD_TREE, exact=False, batch_size=None,
+                          snapshot=None):
+        """
+        Coarse-to-fine search over the variance-ordered PCA features.
+
+        Candidates are retrieved on the first `prefix_dims` dimensions only, using a KD tree
+        or brute force, and then re-ranked with the full distance. A distance over a prefix
+        of the dimensions is a lower bound of the full distance, so a query whose last
+        shortlisted prefix distance is at least its k-th full distance has the exact result.
+        With `exact=True`, every other query is refined by re-ranking all points whose prefix
+        distance is within its current k-th distance; the rest are pruned without being compared.
+
+        Parameters:
+        - testing_points (np.ndarray): A 1D feature vector or a 2D array of shape (n_samples, n_features).
+        - k (int, optional): Number of neighbors. Defaults to self.best_k.
+        - metric (DistanceMetric): EUCLIDEAN or MANHATTAN.
+        - prefix_dims (int, optional): Dimensions used for the shortlist. Defaults to self.cascade_dims.
+        - shortlist (int, optional): Candidates per query. Defaults to self.cascade_shortlist.
+        - coarse (IndexingStructure): KD_TREE or BRUTE_FORCE search on the prefix.
+        - exact (bool): Refine queries until every result is provably exact.
+        - batch_size (int, optional): Queries per tile. Derived from the memory budget if not given.
+        - snapshot (_Snapshot, optional): Snapshot to search. Defaults to the current one.
+
+        Returns:
+        - tuple: (dists, indices) of shape (n_samples, k), sorted by ascending distance.
+        """
+        snapshot = snapshot or self._snapshot
+        features = snapshot.features
+        n_train, n_features = features.shape
+        metric = DistanceMetric(metric)
+        coarse = IndexingStructure(coarse)
+        if metric not in (DistanceMetric.EUCLIDEAN, DistanceMetric.MANHATTAN):
+            raise ValueError(f"Unsupported distance metric: {metric}")
+        if coarse not in (IndexingStructure.KD_TREE, IndexingStructure.BRUTE_FORCE):
+            raise ValueError(f"Cascade search supports KD_TREE or BRUTE_FORCE on the prefix, got {coarse.value}")
+
+        k = min(self.best_k if k is None else k, n_train)
+        dims = min(prefix_dims or self.cascade_dims, n_features)
+        shortlist = min(max(shortlist or self.cascade_shortlist, k), n_train)
+        testing_points = self._as_queries(testing_points)
+
+        if batch_size is None and self.memory_budget is not None:
+            # Each query gathers its shortlisted candidates in full dimension
+            itemsize = np.result_type(testing_points.dtype, features.dtype).itemsize
+            batch_size = max(1, self.memory_budget // (shortlist * (n_features * itemsize + 32)))
+        batch_size = self.tile_size(testing_points, batch_size=batch_size)
+
+        all_dists = np.empty((len(testing_points), k))
+        all_indices = np.empty((len(testing_points), k), dtype=np.intp)
+
+        for start in range(0, len(testing_points), batch_size):
+            end = min(start + batch_size, len(testing_points))
+            dists, indices, certified = self._cascade_tile(
+                testing_points[start:end], snapshot, k, metric, dims, shortlist, coarse)
+            all_dists[start:end], all_indices[start:end] = dists, indices
+
+            if exact:
+                for row in np.flatnonzero(~certified):
+                    all_dists[start + row], all_indices[start + row] = self._cascade_refine(
+                        testing_points[start + row], snapshot, k, metric, dims, dists[row, -1], coarse)
+
+        return all_dists, all_indices
 
-        return np.array(predictions)
-    
     @timeit
-    def predict_with_ball_tree_weighted(self, test_point: np.ndarray, k=None, epsilon=1e-5, metric=DistanceMetric.EUCLIDEAN):
+    def predict_cascade(self, test_point, k=None, epsilon=1e-5, metric=DistanceMetric.EUCLIDEAN):
         """
-        Predicts the label using a Ball Tree-based weighted KNN.
+        Predicts the label for a single test point with the PCA-prefix cascade search.
 
         Parameters:
         - test_point (np.ndarray): The input feature vector to classify.
         - k (int, optional): Number of neighbors to consider. Defaults to self.best_k.
         - epsilon (float): Small constant to avoid division by zero in weight calculation.
+        - metric (DistanceMetric): EUCLIDEAN or MANHATTAN.
 
         Returns:
         - Predicted label.
         """
+        return self.predict_cascade_batch(test_point, k=k, epsilon=epsilon, metric=metric)[0]
+
+    @_thread_limited
+    def predict_cascade_batch(self, testing_points, k=None, batch_size=None, epsilon=1e-5,
+                              metric=DistanceMetric.EUCLIDEAN, prefix_dims=None, shortlist=None,
+                              coarse=IndexingStructure.KD_TREE, exact=False):
+        """
+        Predicts labels for a batch of test points with the PCA-prefix cascade search
+        (see `cascade_neighbors`). With a large enough shortlist, or `exact=True`, the
+        predictions equal those of `predict_with_kd_tree_weighted_batch`.
+
+        Returns:
+        - np.ndarray: Predicted labels for each test point in the input array.
+        """
         if k is None:
             k = self.best_k
 
-        if metric not in [DistanceMetric.EUCLIDEAN, DistanceMetric.MANHATTAN]:
-            raise ValueError(f"BallTree only supports EUCLIDEAN and MANHATTAN distances, got {metric}.")
+        snapshot = self._snapshot
+        testing_points = self._as_queries(testing_points, snapshot.features)
+        dists, indices = self.cascade_neighbors(testing_points, k, metric, prefix_dims=prefix_dims,
+                                                shortlist=shortlist, coarse=coarse, exact=exact,
+                                                batch_size=batch_size, snapshot=snapshot)
+        dists, labels = self._merge_delta(snapshot, testing_points, dists, snapshot.labels[indices], k, metric)
 
-        # Query BallTree for k nearest neighbors
-        dists, indices = self.ball_trees[metric].query(test_point.reshape(1, -1), k=k)
-        dists = dists.flatten()
-        indices = indices.flatten()
+        return np.array([self.weighted_vote(d, l, epsilon) for d, l in zip(dists, labels)])
 
-        weights = defaultdict(float)
-        for dist, idx in zip(dists, indices):
-            label = self.training_labels[idx]
-            weight = 1 / (dist + epsilon)
-            weights[label] += weight
+    def _category_snapshot(self):
+        """
+        Returns the current snapshot, with category sub-indexes. Models pickled before
+        sub-indexes existed build them on first use.
+        """
+        snapshot = self._snapshot
+        if snapshot.category_indexes is None:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot.category_indexes is None:
+                    snapshot = snapshot.replace(category_indexes=self._build_category_indexes(
+                        snapshot.features, snapshot.labels, self.metric, self.leaf_size))
+                    self._snapshot = snapshot
+        return snapshot
+
+    def _covers_all_categories(self, categories):
+        return set(categories) >= set(self._category_snapshot().category_indexes)
+
+    def _build_merged_index(self, categories):
+        """
+        Builds a single KD tree over the rows of several categories for `MergedIndexCache`.
+        """
+        snapshot = self._category_snapshot()
+        category_indexes = snapshot.category_indexes
+        rows = np.sort(np.concatenate([category_indexes[c][0] for c in categories]))
+        tree_metric = category_indexes[categories[0]][2]
+        return rows, _kd_tree(snapshot.features[rows], leaf_size=self.leaf_size, metric=tree_metric.value), tree_metric
+
+    def category_neighbors(self, testing_points, categories, k=None, metric=DistanceMetric.EUCLIDEAN, merge=True):
+        """
+        Finds the k nearest training points among the given categories only.
+
+        Each category has its own KD tree, built on first use, so the cost grows with the
+        number of selected categories rather than the size of the training set. Each
+        selected sub-index returns its local top-k and the candidates are merged into the
+        overall top-k, then with the delta buffer, which also holds categories that were
+        only added with `add`. Subsets that are requested repeatedly get a single merged
+        index, kept in an LRU cache of `merged_index_cache_size` entries.
+
+        Parameters:
+        - testing_points (np.ndarray): A 1D feature vector or a 2D array of shape (n_samples, n_features).
+        - categories (list): Labels the neighbors may have.
+        - k (int, optional): Number of neighbors. Defaults to self.best_k.
+        - metric (DistanceMetric): Distance metric to use.
+        - merge (bool): Use, and count the request towards, a merged index for this subset.
+          Subsets that change with every query should pass False.
+
+        Returns:
+        - tuple: (dists, labels), both of shape (n_samples, k), sorted by ascending distance.
+
+        Raises:
+        - ValueError: If no categories are given or one of them is unknown.
+        """
+        if k is None:
+            k = self.best_k
+        metric = DistanceMetric(metric)
+        snapshot = self._category_snapshot()
+        category_indexes = snapshot.category_indexes
+
+        categories = tuple(sorted(set(categories)))
+        if not categories:
+            raise ValueError("At least one category must be selected.")
+        # Categories only added with `add` have no sub-index yet; the delta buffer has them
+        delta_labels = set() if snapshot.delta_labels is None else set(snapshot.delta_labels.tolist())
+        unknown = [c for c in categories if c not in category_indexes and c not in delta_labels]
+        if unknown:
+            raise ValueError(f"Unknown categories: {', '.join(unknown)}")
+
+        features = snapshot.features
+        testing_points = self._as_queries(testing_points, features)
+
+        # Sub-indexes whose tree metric matches can be queried directly
+        indexed = tuple(c for c in categories if c in category_indexes)
+        indexes = [category_indexes[c] for c in indexed]
+        if merge and len(indexed) > 1 and indexes[0][2] == metric:
+            merged = self._merged_indexes.get(indexed)
+            # A merged index built from an older snapshot has other row numbers
+            if merged is not None and len(merged[0]) == sum(len(index[0]) for index in indexes):
+                indexes = [merged]
+
+        # Starts with no neighbors, for subsets found only in the delta buffer
+        all_dists = [np.empty((len(testing_points), 0), dtype=features.dtype)]
+        all_indices = [np.empty((len(testing_points), 0), dtype=np.intp)]
+        for rows, tree, tree_metric in indexes:
+            k_local = min(k, len(rows))
+            if tree_metric == metric:
+                dists, local = tree.query(testing_points, k=k_local)
+            else:
+                dists, local = self._brute_force_neighbors(testing_points, k_local, metric, features=features[rows])
+            all_dists.append(dists)
+            all_indices.append(rows[local])
+
+        dists = np.concatenate(all_dists, axis=1)
+        indices = np.concatenate(all_indices, axis=1)
+        order = np.argsort(dists, axis=1, kind="stable")[:, :k]
+        dists = np.take_along_axis(dists, order, axis=1)
+        labels = snapshot.labels[np.take_along_axis(indices, order, axis=1)]
+
+        return self._merge_delta(snapshot, testing_points, dists, labels, k, metric, categories=list(categories))
 
-        return max(weights.items(), key=lambda x: x[1])[0]
-    
     @timeit
-    def predict_with_ball_tree_weighted_batch(self, testing_points, k=None, batch_size=100, epsilon=1e-5):
+    def predict_in_categories(self, test_point, categories, k=None, epsilon=1e-5, metric=DistanceMetric.EUCLIDEAN):
         """
-        Predicts labels for a batch of test points using Ball Tree-based weighted KNN.
+        Predicts the label for a single test point, choosing only among `categories`.
+
+        Parameters:
+        - test_point (np.ndarray): The input feature vector to classify.
+        - categories (list): Labels the prediction may have.
+        - k (int, optional): Number of neighbors to consider. Defaults to self.best_k.
+        - epsilon (float): Small constant to avoid division by zero in weight calculation.
+        - metric (DistanceMetric): Distance metric to use.
+
+        Returns:
+        - Predicted label.
+        """
+        dists, labels = self.category_neighbors(test_point, categories, k=k, metric=metric)
+        return self.weighted_vote(dists[0], labels[0], epsilon)
+
+    def category_index_metrics(self):
+        """
+        Returns:
+        - dict: Hit, miss, build and eviction counts of the merged category index cache.
+        """
+        return self._merged_indexes.metrics()
+
+    @staticmethod
+    def _build_class_centroids(features, labels, per_class=1):
+        """
+        Computes the centroids the class shortlist is ranked by.
+
+        Returns:
+        - tuple: (centroids, centroid_labels). One mean per class, or `per_class` k-means
+          sub-centroids per class if per_class > 1.
+        """
+        if per_class > 1:
+            centroids, centroid_labels = kmeans_prototypes(features, labels, per_class=per_class)
+            return centroids.astype(features.dtype, copy=False), centroid_labels
+
+        classes, codes = np.unique(labels, return_inverse=True)
+        # Summed in float64 and stored in the precision of the features
+        sums = np.zeros((len(classes), features.shape[1]))
+        np.add.at(sums, codes, features)
+        return (sums / np.bincount(codes)[:, np.newaxis]).astype(features.dtype, copy=False), classes
+
+    def shortlist_classes_for(self, test_point, n_classes=None, metric=DistanceMetric.EUCLIDEAN, categories=None):
+        """
+        Ranks the classes by the distance from the query to their nearest centroid.
+
+        Parameters:
+        - test_point (np.ndarray): The input feature vector.
+        - n_classes (int, optional): Number of classes to return. Defaults to self.shortlist_classes.
+        - metric (DistanceMetric): Distance metric to use.
+        - categories (list, optional): Only rank these classes.
+
+        Returns:
+        - list: The n_classes closest classes, closest first.
+        """
+        snapshot = self._snapshot
+        if snapshot.class_centroids is None:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot.class_centroids is None:
+                    snapshot = snapshot.replace(class_centroids=self._build_class_centroids(
+                        snapshot.features, snapshot.labels, self.centroids_per_class))
+                    self._snapshot = snapshot
+        centroids, centroid_labels = snapshot.class_centroids
+
+        if categories is not None:
+            allowed = np.isin(centroid_labels, list(categories))
+            centroids, centroid_labels = centroids[allowed], centroid_labels[allowed]
+
+        dists = get_backend(ComputeBackend.NUMPY).pairwise_distances(
+            self._as_queries(test_point, centroids), centroids, DistanceMetric(metric))[0]
+
+        # Classes in order of their closest centroid
+        shortlist = []
+        for label in centroid_labels[np.argsort(dists, kind="stable")]:
+            if label not in shortlist:
+                shortlist.append(label)
+                if len(shortlist) == (n_classes or self.shortlist_classes):
+                    break
+        return shortlist
+
+    @timeit
+    def predict_with_class_shortlist(self, test_point, k=None, epsilon=1e-5, metric=DistanceMetric.EUCLIDEAN,
+                                     n_classes=None, categories=None):
+        """
+        Two-stage prediction: the classes with the nearest centroids are shortlisted first,
+        then the exact weighted KNN runs over the per-category indexes of those classes only.
+
+        A sample of `shortlist_audit_rate` predictions is also answered by the full search,
+        to count how often the shortlist excluded the exact answer (see `class_shortlist_metrics`).
+
+        Parameters:
+        - test_point (np.ndarray): The input feature vector to classify.
+        - k (int, optional): Number of neighbors to consider. Defaults to self.best_k.
+        - epsilon (float): Small constant to avoid division by zero in weight calculation.
+        - metric (DistanceMetric): Distance metric to use.
+        - n_classes (int, optional): Size of the class shortlist. Defaults to self.shortlist_classes.
+        - categories (list, optional): Only consider these classes.
+
+        Returns:
+        - Predicted label.
+        """
+        if k is None:
+            k = self.best_k
+
+        shortlist = self.shortlist_classes_for(test_point, n_classes, metric, categories)
+        # Shortlists differ from query to query, so they would only churn the merged index cache
+        dists, labels = self.category_neighbors(test_point, shortlist, k=k, metric=metric, merge=False)
+        prediction = self.weighted_vote(dists[0], labels[0], epsilon)
+
+        audit = random.random() < self.shortlist_audit_rate
+        if audit:
+            if categories is None:
+                dists, labels = self.query_neighbors(test_point, k, metric, indexing=IndexingStructure.BALL_TREE)
+            else:
+                dists, labels = self.category_neighbors(test_point, categories, k=k, metric=metric)
+            exact = self.weighted_vote(dists[0], labels[0], epsilon)
+
+        stats = self._shortlist_stats
+        with self._lock:
+            stats["predictions"] += 1
+            if audit:
+                stats["audited"] += 1
+                stats["missed"] += exact not in shortlist
+                stats["disagreed"] += exact != prediction
+
+        return prediction
+
+    def class_shortlist_metrics(self):
+        """
+        Returns:
+        - dict: Number of class shortlist predictions, how many were audited against the full
+          search, and how often the shortlist excluded the exact answer (miss_rate) or the
+          prediction differed from it (disagreement_rate).
+        """
+        with self._lock:
+            metrics = dict(self._shortlist_stats)
+        audited = metrics["audited"]
+        metrics["miss_rate"] = metrics["missed"] / audited if audited else None
+        metrics["disagreement_rate"] = metrics["disagreed"] / audited if audited else None
+        return metrics
+
+    def pivot_index(self, metric=DistanceMetric.EUCLIDEAN, snapshot=None):
+        """
+        Returns the pivot index for a metric over the features of `snapshot` (the current
+        one by default). Its pivot table is part of the snapshot, built at `fit` for a
+        prebuilt PIVOT and otherwise on first use. Cached until the training features are
+        replaced.
+        """
+        metric = DistanceMetric(metric)
+        snapshot = snapshot or self._snapshot
+        features = snapshot.features
+        cached = self._pivot_indexes
+        if cached is None or cached[0] is not features:
+            cached = (features, {})
+            self._pivot_indexes = cached
+        if metric not in cached[1]:
+            pivot_table = self._lazy_index(snapshot, "pivot_tables", metric,
+                                           lambda features: build_pivot_table(features, metric, n_pivots=self.n_pivots))
+            cached[1][metric] = PivotIndex(features, metric, n_pivots=self.n_pivots, pivot_table=pivot_table)
+        return cached[1][metric]
+
+    @timeit
+    def predict_with_pivot_index(self, test_point, k=None, epsilon=1e-5, metric=DistanceMetric.EUCLIDEAN):
+        """
+        Predicts the label using the exact pivot (LAESA) index.
+
+        Parameters:
+        - test_point (np.ndarray): The input feature vector to classify.
+        - k (int, optional): Number of neighbors to consider. Defaults to self.best_k.
+        - epsilon (float): Small constant to avoid division by zero in weight calculation.
+        - metric (DistanceMetric): EUCLIDEAN or MANHATTAN.
+
+        Returns:
+        - Predicted label.
+        """
+        if k is None:
+            k = self.best_k
+
+        snapshot = self._snapshot
+        dists, indices = self.pivot_index(metric, snapshot).query(test_point, k=k)
+        dists, labels = self._merge_delta(snapshot, test_point, dists, snapshot.labels[indices], k, metric)
+
+        return self.weighted_vote(dists[0], labels[0], epsilon)
+
+    @timeit
+    @_thread_limited
+    def predict_with_pivot_index_batch(self, testing_points, k=None, batch_size=None, epsilon=1e-5,
+                                       metric=DistanceMetric.EUCLIDEAN):
+        """
+        Predicts labels for a batch of test points using the exact pivot (LAESA) index.
 
         Parameters:
         - testing_points (np.ndarray): A 2D array of shape (n_samples, n_features) containing test data.
         - k (int, optional): Number of neighbors to consider. Defaults to self.best_k.
-        - batch_size (int): Number of test points to process per batch.
+        - batch_size (int, optional): Number of test points to process per batch. Derived from the
+          memory budget if not given.
         - epsilon (float): Small constant to avoid division by zero in weight calculation.
+        - metric (DistanceMetric): EUCLIDEAN or MANHATTAN.
 
         Returns:
         - np.ndarray: Predicted labels for each test point in the input array.
         """
         if k is None:
             k = self.best_k
+        snapshot = self._snapshot
+        testing_points = self._as_queries(testing_points, snapshot.features)
+        batch_size = self.tile_size(testing_points, k, brute_force=False, batch_size=batch_size)
+        index = self.pivot_index(metric, snapshot)
 
         predictions = []
 
@@ -259,21 +1168,13 @@ class KNN:
             end = min(start + batch_size, len(testing_points))
             batch = testing_points[start:end]
 
-            # Query the ball tree for k neighbors for the whole batch
-            dists, indices = self.ball_tree.query(batch, k=k)
-
-            for i in range(len(batch)):
-                votes = defaultdict(float)
-                for dist, idx in zip(dists[i], indices[i]):
-                    label = self.training_labels[idx]
-                    weight = 1 / (dist + epsilon)
-                    votes[label] += weight
+            dists, indices = index.query(batch, k=k)
+            dists, labels = self._merge_delta(snapshot, batch, dists, snapshot.labels[indices], k, metric)
 
-                pred = max(votes.items(), key=lambda x: x[1])[0]
-                predictions.append(pred)
+            predictions.extend(self.weighted_vote(d, l, epsilon) for d, l in zip(dists, labels))
 
         return np.array(predictions)
-    
+
     @timeit
     def predict_with_kd_tree_weighted(self, test_point: np.ndarray, k=None, epsilon=1e-5, metric=DistanceMetric.EUCLIDEAN):
         """
@@ -293,27 +1194,24 @@ class KNN:
         if k is None:
             k = self.best_k
 
-        dists, indices = self.kd_tree.query(test_point.reshape(1, -1), k=k)
-        dists = dists.flatten()
-        indices = indices.flatten()
+        snapshot = self._snapshot
+        test_point = self._as_queries(test_point, snapshot.features)
+        dists, indices = snapshot.kd_tree.query(test_point, k=k)
+        dists, labels = self._merge_delta(snapshot, test_point, dists, snapshot.labels[indices], k, metric)
 
-        weights = defaultdict(float)
-        for dist, idx in zip(dists, indices):
-            label = self.training_labels[idx]
-            weight = 1 / (dist + epsilon)
-            weights[label] += weight
-
-        return max(weights.items(), key=lambda x: x[1])[0]
+        return self.weighted_vote(dists[0], labels[0], epsilon)
 
     @timeit
-    def predict_with_kd_tree_weighted_batch(self, testing_points, k=None, batch_size=100, epsilon=1e-5):
+    @_thread_limited
+    def predict_with_kd_tree_weighted_batch(self, testing_points, k=None, batch_size=None, epsilon=1e-5):
         """
         Predicts labels for a batch of test points using KD Tree-based weighted KNN.
 
         Parameters:
         - testing_points (np.ndarray): A 2D array of shape (n_samples, n_features) containing test data.
         - k (int, optional): Number of neighbors to consider. Defaults to self.best_k.
-        - batch_size (int): Number of test points to process per batch.
+        - batch_size (int, optional): Number of test points to process per batch. Derived from the
+          memory budget if not given.
         - epsilon (float): Small constant to avoid division by zero in weight calculation.
 
         Returns:
@@ -321,6 +1219,9 @@ class KNN:
         """
         if k is None:
             k = self.best_k
+        snapshot = self._snapshot
+        testing_points = self._as_queries(testing_points, snapshot.features)
+        batch_size = self.tile_size(testing_points, k, brute_force=False, batch_size=batch_size)
 
         predictions = []
 
@@ -328,17 +1229,11 @@ class KNN:
             end = min(start + batch_size, len(testing_points))
             batch = testing_points[start:end]
 
-            dists, indices = self.kd_tree.query(batch, k=k)
+            dists, indices = snapshot.kd_tree.query(batch, k=k)
+            dists, labels = self._merge_delta(snapshot, batch, dists, snapshot.labels[indices], k,
+                                              DistanceMetric.EUCLIDEAN)
 
-            for i in range(len(batch)):
-                votes = defaultdict(float)
-                for dist, idx in zip(dists[i], indices[i]):
-                    label = self.training_labels[idx]
-                    weight = 1 / (dist + epsilon)
-                    votes[label] += weight
-
-                pred = max(votes.items(), key=lambda x: x[1])[0]
-                predictions.append(pred)
+            predictions.extend(self.weighted_vote(d, l, epsilon) for d, l in zip(dists, labels))
 
         return np.array(predictions)
 
@@ -372,6 +1267,10 @@ class KNN:
 
         features = np.asarray(features)
         labels = np.asarray(labels)
+        if self.precision is not None:
+            features = features.astype(Precision(self.precision).value, copy=False)
+        elif not np.issubdtype(features.dtype, np.floating):
+            features = features.astype(np.float64)
 
         if features.ndim != 2:
             raise ValueError("Features must be a 2D array of shape (n_samples, n_features).")
@@ -383,19 +1282,260 @@ class KNN:
             raise ValueError(f"Number of feature vectors ({features.shape[0]}) "
                             f"does not match number of labels ({labels.shape[0]}).")
 
-        self.training_features = features
-        self.training_labels = labels
         self.best_k = k
+        self.metric = metric
+
+        ball_trees, kd_tree = self._build_indexes(features, metric, self.leaf_size)
+        self._snapshot = _Snapshot(features, labels, ball_trees, kd_tree,
+                                   **self._build_optional_indexes(features, labels))
+        self._merged_indexes.clear()
+
+    @staticmethod
+    def _build_indexes(features, metric, leaf_size=40):
+        """
+        Builds the search trees over a feature matrix.
 
+        Returns:
+        - tuple: (ball_trees, kd_tree) where ball_trees maps each DistanceMetric to a BallTree
+          and kd_tree is None unless metric is EUCLIDEAN.
+        """
         # Create BallTree with chosen metric
-        self.ball_trees[DistanceMetric.EUCLIDEAN] = BallTree(self.training_features, metric=DistanceMetric.EUCLIDEAN.value)
-        self.ball_trees[DistanceMetric.MANHATTAN] = BallTree(self.training_features, metric=DistanceMetric.MANHATTAN.value)
+        ball_trees = {
+            DistanceMetric.EUCLIDEAN: _ball_tree(features, leaf_size=leaf_size, metric=DistanceMetric.EUCLIDEAN.value),
+            DistanceMetric.MANHATTAN: _ball_tree(features, leaf_size=leaf_size, metric=DistanceMetric.MANHATTAN.value),
+        }
 
         # Only build KDTree if metric is 'EUCLIDEAN'
-        if metric == DistanceMetric.EUCLIDEAN:
-            self.kd_tree = KDTree(self.training_features)
-        else:
-            self.kd_tree = None
+        kd_tree = _kd_tree(features, leaf_size=leaf_size) if metric == DistanceMetric.EUCLIDEAN else None
+        return ball_trees, kd_tree
+
+    def _build_optional_indexes(self, features, labels, previous=None):
+        """
+        Builds the indexes only some structures search: those of `prebuilt_indexings` and
+        `default_indexing`, and those `previous` (the snapshot being replaced) had, since
+        they are in use. The others are left to be built on first use.
+
+        Returns:
+        - dict: category_indexes, class_centroids, pivot_tables and prefix_trees for `_Snapshot`.
+        """
+        prebuilt = set(self.prebuilt_indexings) | {IndexingStructure(self.default_indexing)}
+        previous = previous or _Snapshot()
+        metrics = (DistanceMetric.EUCLIDEAN, DistanceMetric.MANHATTAN)
+        shortlist = IndexingStructure.CLASS_SHORTLIST in prebuilt
+
+        pivot_metrics = set(previous.pivot_tables)
+        if IndexingStructure.PIVOT in prebuilt:
+            pivot_metrics.update(metrics)
+        prefix_keys = set(previous.prefix_trees)
+        if IndexingStructure.CASCADE in prebuilt:
+            prefix_keys.update((min(self.cascade_dims, features.shape[1]), metric) for metric in metrics)
+
+        return {
+            "category_indexes": self._build_category_indexes(features, labels, self.metric, self.leaf_size)
+            if shortlist or previous.category_indexes is not None else None,
+            "class_centroids": self._build_class_centroids(features, labels, self.centroids_per_class)
+            if shortlist or previous.class_centroids is not None else None,
+            "pivot_tables": {metric: build_pivot_table(features, metric, n_pivots=self.n_pivots)
+                             for metric in pivot_metrics},
+            "prefix_trees": {key: self._build_prefix_tree(features, *key) for key in prefix_keys},
+        }
+
+    def _build_prefix_tree(self, features, dims, metric):
+        """
+        Builds the cascade search's KD tree over the first `dims` columns.
+        """
+        return _kd_tree(np.ascontiguousarray(features[:, :dims]), leaf_size=self.leaf_size, metric=metric.value)
+
+    def _lazy_index(self, snapshot, field, key, build):
+        """
+        Returns the index stored under `key` in a dict field of the snapshot, building it
+        from the snapshot's features on first use. It is added to the current snapshot if
+        that has the same features, so later queries, pickles and compactions have it too.
+        """
+        index = getattr(snapshot, field).get(key)
+        if index is not None:
+            return index
+        with self._lock:
+            current = self._snapshot
+            if current.features is snapshot.features:
+                index = getattr(current, field).get(key)
+                if index is None:
+                    index = build(current.features)
+                    self._snapshot = current.replace(**{field: {**getattr(current, field), key: index}})
+                return index
+        # A compaction replaced the features meanwhile; the index only serves this query
+        return build(snapshot.features)
+
+    def ready_indexings(self):
+        """
+        Returns:
+        - list: The structures that can answer a query without building an index first:
+          the trees and brute-force paths, and the optional ones whose indexes were built
+          at `fit` or since first used.
+        """
+        snapshot = self._snapshot
+        ready = [IndexingStructure.BALL_TREE, IndexingStructure.BRUTE_FORCE, IndexingStructure.BRUTE_FORCE_FUSED]
+        if snapshot.kd_tree is not None:
+            ready.append(IndexingStructure.KD_TREE)
+        if snapshot.pivot_tables:
+            ready.append(IndexingStructure.PIVOT)
+        if snapshot.prefix_trees:
+            ready.append(IndexingStructure.CASCADE)
+        if snapshot.category_indexes is not None and snapshot.class_centroids is not None:
+            ready.append(IndexingStructure.CLASS_SHORTLIST)
+        return ready
+
+    @staticmethod
+    def _build_category_indexes(features, labels, metric, leaf_size=40):
+        """
+        Builds one KD tree per category, using the model's metric where the KD tree supports it.
+
+        Returns:
+        - dict: Maps each label to (row_indices, KDTree over those rows, metric of the tree).
+        """
+        tree_metric = metric if metric in (DistanceMetric.EUCLIDEAN, DistanceMetric.MANHATTAN) else DistanceMetric.EUCLIDEAN
+        indexes = {}
+        for label in np.unique(labels):
+            rows = np.flatnonzero(labels == label)
+            indexes[label] = (rows, _kd_tree(features[rows], leaf_size=leaf_size, metric=tree_metric.value), tree_metric)
+        return indexes
+
+    @property
+    def delta_size(self):
+        """
+        Number of points added with `add` that are not yet part of the search trees.
+        """
+        delta_features = self._snapshot.delta_features
+        return 0 if delta_features is None else len(delta_features)
+
+    def add(self, features, labels):
+        """
+        Adds new labeled points to a fitted model without rebuilding the search trees.
+
+        The points go into a delta buffer that every prediction searches by brute force
+        and merges with the results from the main index. Once the buffer holds
+        `compaction_threshold` points, the trees are rebuilt in a background thread.
+
+        Parameters:
+        - features (array-like): A 1D feature vector or a 2D array of shape (n_samples, n_features).
+        - labels (array-like): A label or a 1D array of shape (n_samples,).
+
+        Returns:
+        - int: Number of points waiting in the delta buffer.
+
+        Raises:
+        - RuntimeError: If the model has not been fitted.
+        - ValueError: If features and labels are mismatched.
+        """
+        if self.training_features is None:
+            raise RuntimeError("KNN must be fitted before adding points.")
+
+        features = np.asarray(features, dtype=self.training_features.dtype).reshape(-1, self.training_features.shape[1])
+        labels = np.asarray(labels).reshape(-1)
+
+        if features.shape[0] != labels.shape[0]:
+            raise ValueError(f"Number of feature vectors ({features.shape[0]}) "
+                            f"does not match number of labels ({labels.shape[0]}).")
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot.delta_features is not None:
+                features = np.concatenate([snapshot.delta_features, features])
+                labels = np.concatenate([snapshot.delta_labels, labels])
+            self._snapshot = snapshot.replace(delta_features=features, delta_labels=labels)
+            pending = len(features)
+
+        if pending >= self.compaction_threshold:
+            self.compact(background=True)
+
+        return pending
+
+    partial_fit = add
+
+    def compact(self, background=False):
+        """
+        Rebuilds the search trees over the training set plus the delta buffer.
+
+        Predictions keep being served from the old snapshot while the new trees are built;
+        the swap is a single assignment of the new snapshot. Points added during the
+        rebuild stay in its delta buffer.
+
+        Parameters:
+        - background (bool): Run the rebuild in a daemon thread and return immediately.
+          Does nothing if a compaction is already running.
+        """
+        if background:
+            if self._compaction_lock.locked():
+                return
+            self._compaction_thread = threading.Thread(target=self.compact, daemon=True)
+            self._compaction_thread.start()
+            return
+
+        with self._compaction_lock:
+            snapshot = self._snapshot
+            if snapshot.delta_features is None:
+                return
+            n_compacted = len(snapshot.delta_features)
+
+            features = np.concatenate([snapshot.features, snapshot.delta_features])
+            labels = np.concatenate([snapshot.labels, snapshot.delta_labels])
+            ball_trees, kd_tree = self._build_indexes(features, self.metric, self.leaf_size)
+            optional_indexes = self._build_optional_indexes(features, labels, previous=snapshot)
+
+            with self._lock:
+                # Points added since the rebuild started stay in the delta buffer
+                delta_features, delta_labels = self._snapshot.delta_features, self._snapshot.delta_labels
+                if len(delta_features) > n_compacted:
+                    delta_features, delta_labels = delta_features[n_compacted:], delta_labels[n_compacted:]
+                else:
+                    delta_features, delta_labels = None, None
+                self._snapshot = _Snapshot(features, labels, ball_trees, kd_tree, delta_features=delta_features,
+                                           delta_labels=delta_labels, **optional_indexes)
+                self._merged_indexes.clear()
+
+            print(f"Compacted {n_compacted} added points into the search trees.")
+
+    def apply_tuning_profile(self, profile):
+        """
+        Applies a tuning profile written by `tuning.py`: the default search structure, the
+        tree leaf size, the batch size and the thread count of this model's searches. The
+        trees are rebuilt if the leaf size changed.
+
+        Parameters:
+        - profile (dict): Profile with optional "indexing", "leaf_size", "batch_size" and "threads" keys.
+        """
+        if profile.get("indexing") is not None:
+            indexing = IndexingStructure(profile["indexing"])
+            if indexing == IndexingStructure.KD_TREE and self.metric != DistanceMetric.EUCLIDEAN:
+                raise ValueError("The KD tree is only built for models fitted with the EUCLIDEAN metric.")
+            self.default_indexing = indexing
+        if profile.get("batch_size") is not None:
+            self.batch_size = int(profile["batch_size"])
+        if profile.get("threads") is not None:
+            self.threads = int(profile["threads"])
+
+        leaf_size = profile.get("leaf_size")
+        if leaf_size is None or int(leaf_size) == self.leaf_size:
+            return
+        self.leaf_size = int(leaf_size)
+        if self.training_features is None:
+            return
+
+        with self._compaction_lock:
+            snapshot = self._snapshot
+            ball_trees, kd_tree = self._build_indexes(snapshot.features, self.metric, self.leaf_size)
+            # Only the trees in use are rebuilt; the others are built with the new leaf size on first use
+            category_indexes = None
+            if snapshot.category_indexes is not None:
+                category_indexes = self._build_category_indexes(snapshot.features, snapshot.labels, self.metric,
+                                                                self.leaf_size)
+            prefix_trees = {key: self._build_prefix_tree(snapshot.features, *key) for key in snapshot.prefix_trees}
+            with self._lock:
+                # Only compaction replaces the arrays, and it waits for the lock held here
+                self._snapshot = self._snapshot.replace(ball_trees=ball_trees, kd_tree=kd_tree,
+                                                        category_indexes=category_indexes, prefix_trees=prefix_trees)
+                self._prefix_indexes = None
+                self._merged_indexes.clear()
 
 
     @timeit
@@ -417,20 +1557,18 @@ class KNN:
         if k is None:
             k = self.best_k
 
-        # Compute Manhattan (L1) distances
-        dists = np.sum(np.abs(self.training_features - test_point), axis=1)
-        knn_indices = np.argsort(dists)[:k]
+        snapshot = self._snapshot
 
-        weights = defaultdict(float)
-        for idx in knn_indices:
-            label = self.training_labels[idx]
-            weight = 1 / (dists[idx] + epsilon)
-            weights[label] += weight
+        # Compute Manhattan (L1) distances
+        dists, knn_indices = self._brute_force_neighbors(test_point, k, DistanceMetric.MANHATTAN, features=snapshot.features)
 
-        return max(weights.items(), key=lambda x: x[1])[0]
+        neighbor_dists, neighbor_labels = self._merge_delta(
+            snapshot, test_point, dists, snapshot.labels[knn_indices], k, DistanceMetric.MANHATTAN)
+        return self.weighted_vote(neighbor_dists[0], neighbor_labels[0], epsilon)
     
     @timeit
-    def predict_weighted_batch_manhattan(self, testing_points, X_train=None, y_train=None, k=None, batch_size=100):
+    @_thread_limited
+    def predict_weighted_batch_manhattan(self, testing_points, X_train=None, y_train=None, k=None, batch_size=None):
         """
         Predicts labels for a batch of test points using weighted KNN with Manhattan distance.
 
@@ -443,17 +1581,23 @@ class KNN:
         - X_train (np.ndarray, optional): Training feature vectors. Defaults to self.training_features.
         - y_train (np.ndarray, optional): Training labels. Defaults to self.training_labels.
         - k (int, optional): Number of neighbors to use. Defaults to self.best_k.
-        - batch_size (int): Number of test points to process per batch to manage memory usage.
+        - batch_size (int, optional): Number of test points to process per batch to manage memory usage.
+          Derived from the memory budget if not given.
 
         Returns:
         - np.ndarray: Predicted labels for each test point in the input array.
         """
+        # Points added with `add` are only searched when predicting against the model's own data
+        use_delta = X_train is None and y_train is None
+        snapshot = self._snapshot
         if X_train is None:
-            X_train = self.training_features
+            X_train = snapshot.features
         if y_train is None:
-            y_train = self.training_labels
+            y_train = snapshot.labels
         if k is None:
             k = self.best_k
+        testing_points = self._as_queries(testing_points, X_train)
+        batch_size = self.tile_size(testing_points, k, features=X_train, batch_size=batch_size)
 
         predictions = []
 
@@ -461,29 +1605,22 @@ class KNN:
             end = min(start + batch_size, len(testing_points))
             X_batch = testing_points[start:end]
 
-            # Compute Manhattan distances between test batch and training points
-            dists = np.sum(np.abs(X_batch[:, np.newaxis, :] - X_train[np.newaxis, :, :]), axis=2)
-
-            # Get indices of the k nearest neighbors for each test point
-            knn_indices = np.argpartition(dists, kth=k, axis=1)[:, :k]
-
-            for i in range(len(X_batch)):
-                neighbor_idxs = knn_indices[i]
-                neighbor_labels = y_train[neighbor_idxs]
-                neighbor_dists = dists[i][neighbor_idxs]
-                weights = 1 / (neighbor_dists + 1e-8)
+            # Manhattan distances to all training points and the k nearest neighbors of each test point
+            neighbor_dists, knn_indices = self._brute_force_neighbors(
+                X_batch, k, DistanceMetric.MANHATTAN, batch_size, features=X_train)
+            neighbor_labels = y_train[knn_indices]
 
-                votes = defaultdict(float)
-                for lbl, w in zip(neighbor_labels, weights):
-                    votes[lbl] += w
+            if use_delta:
+                neighbor_dists, neighbor_labels = self._merge_delta(
+                    snapshot, X_batch, neighbor_dists, neighbor_labels, k, DistanceMetric.MANHATTAN)
 
-                pred = max(votes.items(), key=lambda x: x[1])[0]
-                predictions.append(pred)
+            predictions.extend(self.weighted_vote(d, l, 1e-8) for d, l in zip(neighbor_dists, neighbor_labels))
 
         return np.array(predictions)
 
     @classmethod
-    def from_data(cls, features, labels, k=3, metric="EUCLIDEAN"):
+    def from_data(cls, features, labels, k=3, metric=DistanceMetric.EUCLIDEAN, backend=ComputeBackend.NUMPY, memory_budget=None,
+                  precision=None, prebuilt_indexings=()):
         """
         Factory method to create and fit a KNN instance.
 
@@ -491,11 +1628,16 @@ class KNN:
         - features (array-like): Training feature matrix.
         - labels (array-like): Training labels.
         - k (int): Number of neighbors to use.
+        - backend (ComputeBackend or str): Compute backend for the brute-force paths.
+        - memory_budget (int, optional): Bytes the batch predictors may use for their working arrays.
+        - precision (Precision, optional): Floating point type of the model. Defaults to the dtype of features.
+        - prebuilt_indexings (iterable): Structures whose indexes are built at fit, see `__init__`.
 
         Returns:
         - KNN: A fitted KNN instance.
         """
-        instance = cls(best_k=k)
+        instance = cls(best_k=k, backend=backend, memory_budget=memory_budget, precision=precision,
+                       prebuilt_indexings=prebuilt_indexings)
         instance.fit(features, labels, k=k, metric=metric)
         return instance
 
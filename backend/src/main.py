@@ -1,168 +1,221 @@
 import os
+import subprocess
 import numpy as np
-import pandas as pd
 import joblib
 from common.distance_metrics import DistanceMetric
-from utils import create_dataset, get_data, draw_image, display_vector_drawing
+from common.indexing_structures import IndexingStructure
+from common.precision import Precision
+from common.profile_mode import ProfileMode
+from common.reduction_methods import ReductionMethod
+from condensation import reduce_training_set
+from utils import get_data, draw_image, display_vector_drawing
+from dataset_store import RenderedDataset, RenderedDatasetStore
 from sklearn.model_selection import train_test_split
 from preprocessor import Preprocessor
 from knn import KNN
 from evaluation import Evaluator
-from config import CACHE_DIR
+from pipeline import PIPELINE_DIR, Pipeline, Stage
+from simplify import SIMPLIFY_TOLERANCE
+from config import CACHE_DIR, MODELS_DIR
 
-# ---------------------------
-# Load or cache the raw parsed drawings
-# ---------------------------
-raw_data_cache_path = os.path.join(CACHE_DIR, "datasets_dict.pkl")
-
-if os.path.exists(raw_data_cache_path):
-    datasets = joblib.load(raw_data_cache_path)
-    print("Loaded cached drawing data.")
-else:
-    datasets = {
-        "house": get_data("house.ndjson", 4000),
-        "tree": get_data("tree.ndjson", 4000),
-        "clock": get_data("clock.ndjson", 4000),
-        "umbrella": get_data("umbrella.ndjson", 4000),
-        "ladder": get_data("ladder.ndjson", 4000),
-        "lightning": get_data("lightning.ndjson", 4000),
-        "spoon": get_data("spoon.ndjson", 4000),
-        "airplane": get_data("airplane.ndjson", 4000),
-        "campfire": get_data("campfire.ndjson", 4000),
-        "sailboat": get_data("sailboat.ndjson", 4000),
-        "cactus": get_data("cactus.ndjson", 4000),
-        "crown": get_data("crown.ndjson", 4000),
-        "scissors": get_data("scissors.ndjson", 4000),
-        "fish": get_data("fish.ndjson", 4000),
-        "cat": get_data("cat.ndjson", 4000),
-        "bicycle": get_data("bicycle.ndjson", 4000),
-        "guitar": get_data("guitar.ndjson", 4000),
-        "apple": get_data("apple.ndjson", 4000),
-        "chair": get_data("chair.ndjson", 4000),
-        "sun": get_data("sun.ndjson", 4000),
-        "moon": get_data("moon.ndjson", 4000),
-        "ice cream": get_data("ice cream.ndjson", 4000),
-        "snail": get_data("snail.ndjson", 4000),
-        "mug": get_data("mug.ndjson", 4000),
-        "key": get_data("key.ndjson", 4000),
-        "bowtie": get_data("bowtie.ndjson", 4000),
-        "bucket": get_data("bucket.ndjson", 4000),
-        "axe": get_data("axe.ndjson", 4000),
-        "boomerang": get_data("boomerang.ndjson", 4000),
-        "hot air balloon": get_data("hot air balloon.ndjson", 4000),
-        "suitcase": get_data("suitcase.ndjson", 4000),
-        "snake": get_data("snake.ndjson", 4000),
-        "saw": get_data("saw.ndjson", 4000),
-        "stairs": get_data("stairs.ndjson", 4000),
-        "grass": get_data("grass.ndjson", 4000),
-        "envelope": get_data("envelope.ndjson", 4000),
-        "dumbbell": get_data("dumbbell.ndjson", 4000),
-        "carrot": get_data("carrot.ndjson", 4000),
-        "cloud": get_data("cloud.ndjson", 4000),
-        "basketball": get_data("basketball.ndjson", 4000),
-    }
-    joblib.dump(datasets, raw_data_cache_path)
-    print("Saved drawing data to cache.")
-
-# ---------------------------
-# Load or cache the dataset (X, y)
-# ---------------------------aa
-xy_cache_path = os.path.join(CACHE_DIR, "Xy_dataset.npz")
-
-if os.path.exists(xy_cache_path):
-    data = np.load(xy_cache_path, allow_pickle=True)
-    X, y = data["X"], data["y"]
-    print("Loaded cached dataset (X, y).")
-else:
-    X, y = create_dataset(datasets, samples_per_class=4000)
-    np.savez_compressed(xy_cache_path, X=X, y=y)
-    print("Saved dataset (X, y) to cache.")
+RAW_DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "raw")
 
 # ---------------------------
-# Load or cache the PCA-reduced features
+# Pipeline parameters. Every artifact is cached under a hash of the parameters and inputs
+# it depends on, so changing one of these only recomputes the stages it affects.
 # ---------------------------
-reduced_cache_path = os.path.join(CACHE_DIR, "X_reduced.pkl")
-preprocessor_cache_path = os.path.join(CACHE_DIR, "preprocessor.pkl")
-
-if os.path.exists(reduced_cache_path) and os.path.exists(preprocessor_cache_path):
-    X_reduced = joblib.load(reduced_cache_path)
-    preprocessor = joblib.load(preprocessor_cache_path)
-    print("Loaded cached PCA-reduced features and preprocessor.")
-else:
-    preprocessor = Preprocessor(n_components=64)
-    X_reduced = pd.DataFrame(preprocessor.fit_transform(X))
-    joblib.dump(X_reduced, reduced_cache_path)
-    joblib.dump(preprocessor, preprocessor_cache_path)
-    print("Saved reduced features and preprocessor to cache.")
+CATEGORIES = [
+    "house", "tree", "clock", "umbrella", "ladder", "lightning", "spoon", "airplane", "campfire",
+    "sailboat", "cactus", "crown", "scissors", "fish", "cat", "bicycle", "guitar", "apple",
+    "chair", "sun", "moon", "ice cream", "snail", "mug", "key", "bowtie", "bucket", "axe",
+    "boomerang", "hot air balloon", "suitcase", "snake", "saw", "stairs", "grass", "envelope",
+    "dumbbell", "carrot", "cloud", "basketball",
+]
+SAMPLES_PER_CLASS = 4000
+N_COMPONENTS = 64
+TEST_SIZE = 0.2
+RANDOM_STATE = 42
+K = 5
+# Floating point type of the PCA features, the model's training features, trees and distances.
+# Set to Precision.FLOAT32 (or QUICKDRAW_PRECISION=float32) to halve the artifacts and the
+# memory traffic of every search (see benchmarks/precision.py)
+PRECISION = Precision(os.environ.get("QUICKDRAW_PRECISION", Precision.FLOAT64.value))
+
+# IndexingStructures whose optional indexes (PIVOT, CASCADE, CLASS_SHORTLIST) are built with the
+# model and published in it, instead of by each serving process on first use
+PREBUILT_INDEXINGS = ()
+
+# Set to a ReductionMethod to train the model on prototypes instead of every training point
+TRAINING_SET_REDUCTION = None
+
+# Set to publish to cache/models/<MODEL_ID>/ instead of the default paths, as an extra model
+# the API serves by ID (see model_pool.py), e.g. a smaller category pack or PCA size
+MODEL_ID = None
+
+# Set to ProfileMode.RSS or ProfileMode.TRACEMALLOC (or QUICKDRAW_PROFILE=rss/tracemalloc) to
+# record per-stage peak memory and append a JSON report to cache/pipeline_profiles.jsonl.
+# Stages then run one at a time, so each peak is measured without the others.
+PROFILE = ProfileMode(os.environ.get("QUICKDRAW_PROFILE", ProfileMode.NONE.value))
 
-# ---------------------------
-# Load or cache train/test splits
-# ---------------------------
-X_train_cache = os.path.join(CACHE_DIR, "X_train.npy")
-X_test_cache = os.path.join(CACHE_DIR, "X_test.npy")
-y_train_cache = os.path.join(CACHE_DIR, "y_train.npy")
-y_test_cache = os.path.join(CACHE_DIR, "y_test.npy")
-
-if all(os.path.exists(path) for path in [X_train_cache, X_test_cache, y_train_cache, y_test_cache]):
-    X_train = np.load(X_train_cache)
-    X_test = np.load(X_test_cache)
-    y_train = np.load(y_train_cache)
-    y_test = np.load(y_test_cache)
-    print("Loaded cached train/test splits.")
-else:
-    X_train, X_test, y_train, y_test = train_test_split(
-        X_reduced.values if hasattr(X_reduced, 'values') else X_reduced,
-        y,
-        test_size=0.2,
-        random_state=42
-    )
-    np.save(X_train_cache, X_train)
-    np.save(X_test_cache, X_test)
-    np.save(y_train_cache, y_train)
-    np.save(y_test_cache, y_test)
-    print("Saved train/test splits to cache.")
 
 # ---------------------------
-# Load or cache the categories
+# Stages
 # ---------------------------
-categories_cache_path = os.path.join(CACHE_DIR, "categories.npy")
-
-if os.path.exists(categories_cache_path):
-    categories = np.load(categories_cache_path)
-    print("Loaded cached categories.")
-else:
+def ingest(category, max_items):
+    return get_data(f"{category}.ndjson", max_items)
+
+
+def render(drawings, category, samples_per_class, tolerance):
+    # The store renders only drawings it does not have yet and resumes interrupted runs;
+    # the artifact is a lazy view of its uint8 images
+    store = RenderedDatasetStore(tolerance=tolerance)
+    store.build(category, drawings, samples_per_class)
+    return store.dataset([category], samples_per_class)
+
+
+def combine(*datasets):
+    return RenderedDataset.concatenate(datasets)
+
+
+def preprocess(dataset, n_components, precision):
+    # The Preprocessor streams the uint8 rasters from the store and normalizes them chunk by chunk
+    preprocessor = Preprocessor(n_components=n_components, precision=Precision(precision))
+    return preprocessor.fit_transform(dataset), preprocessor
+
+
+def split(dataset, reduced, test_size, random_state):
+    y = dataset.labels
+    X_reduced, _ = reduced
+    return train_test_split(X_reduced, y, test_size=test_size, random_state=random_state)
+
+
+def reduce(splits, method):
+    X_train, X_test, y_train, y_test = splits
+    X_train, y_train = reduce_training_set(X_train, y_train, method)
+    print(f"Reduced the training set to {len(X_train)} points.")
+    return X_train, X_test, y_train, y_test
+
+
+def build_index(splits, k, precision, prebuilt_indexings):
+    X_train, _, y_train, _ = splits
+    return KNN.from_data(X_train, y_train, k, metric=DistanceMetric.EUCLIDEAN, precision=Precision(precision),
+                         prebuilt_indexings=prebuilt_indexings)
+
+
+def stage_name(prefix, category):
+    return f"{prefix}_{category.replace(' ', '_')}"
+
+
+def build_pipeline(profile=None, cache_dir=PIPELINE_DIR):
+    profile = ProfileMode(profile if profile is not None else PROFILE)
+    stages = []
+    for category in CATEGORIES:
+        stages.append(Stage(stage_name("ingest", category), ingest,
+                            params={"category": category, "max_items": SAMPLES_PER_CLASS},
+                            files=[os.path.join(RAW_DATA_DIR, f"{category}.ndjson")]))
+        stages.append(Stage(stage_name("render", category), render, inputs=[stage_name("ingest", category)],
+                            params={"category": category, "samples_per_class": SAMPLES_PER_CLASS,
+                                    "tolerance": SIMPLIFY_TOLERANCE}, version=3))
+    stages.append(Stage("dataset", combine, inputs=[stage_name("render", category) for category in CATEGORIES]))
+    stages.append(Stage("preprocess", preprocess, inputs=["dataset"],
+                        params={"n_components": N_COMPONENTS, "precision": Precision(PRECISION).value},
+                        version=2))
+    stages.append(Stage("split", split, inputs=["dataset", "preprocess"],
+                        params={"test_size": TEST_SIZE, "random_state": RANDOM_STATE}))
+
+    training_split = "split"
+    if TRAINING_SET_REDUCTION is not None:
+        stages.append(Stage("reduce", reduce, inputs=["split"],
+                            params={"method": ReductionMethod(TRAINING_SET_REDUCTION).value}))
+        training_split = "reduce"
+    stages.append(Stage("model", build_index, inputs=[training_split],
+                        params={"k": K, "precision": Precision(PRECISION).value,
+                                "prebuilt_indexings": [IndexingStructure(indexing).value
+                                                       for indexing in PREBUILT_INDEXINGS]}))
+    return Pipeline(stages, cache_dir=cache_dir, profile=profile,
+                    max_workers=1 if profile != ProfileMode.NONE else None)
+
+
+def profile_metadata():
+    """
+    The parameters memory and time scale with, stored with every profile report, and the
+    code version they were measured on.
+    """
+    try:
+        revision = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        revision = None
+    reduction = None if TRAINING_SET_REDUCTION is None else ReductionMethod(TRAINING_SET_REDUCTION).value
+    return {"revision": revision, "categories": len(CATEGORIES), "samples_per_class": SAMPLES_PER_CLASS,
+            "n_components": N_COMPONENTS, "precision": Precision(PRECISION).value,
+            "training_set_reduction": reduction}
+
+
+def write_rasters(path, dataset):
+    # Uncompressed uint8, so the analysis scripts can memory-map it; written batch by batch
+    X = np.lib.format.open_memmap(path, mode="w+", dtype=np.uint8, shape=(len(dataset), dataset.n_features))
+    row = 0
+    for batch, _ in dataset.iter_batches(dtype=None):
+        X[row:row + len(batch)] = batch
+        row += len(batch)
+    X.flush()
+
+
+def publish(pipeline):
+    """
+    Exports the artifacts to the fixed cache paths read by the API, benchmarks and analysis scripts,
+    or to the model's directory when MODEL_ID is set.
+    """
+    out_dir = CACHE_DIR if MODEL_ID is None else os.path.join(MODELS_DIR, MODEL_ID)
+    os.makedirs(out_dir, exist_ok=True)
+    training_split = "reduce" if "reduce" in pipeline.stages else "split"
+    ingested = [stage_name("ingest", category) for category in CATEGORIES]
+
+    outputs = [
+        ("datasets_dict.pkl", ingested, lambda path, *items: joblib.dump(dict(zip(CATEGORIES, items)), path)),
+        ("X_raster.npy", ["dataset"], write_rasters),
+        ("y_raster.npy", ["dataset"], lambda path, dataset: np.save(path, dataset.labels)),
+        ("X_train.npy", [training_split], lambda path, splits: np.save(path, splits[0])),
+        ("X_test.npy", [training_split], lambda path, splits: np.save(path, splits[1])),
+        ("y_train.npy", [training_split], lambda path, splits: np.save(path, splits[2])),
+        ("y_test.npy", [training_split], lambda path, splits: np.save(path, splits[3])),
+        ("categories.npy", ["split"], lambda path, splits: np.save(path, np.unique(splits[2]))),
+        ("preprocessor.pkl", ["preprocess"], lambda path, reduced: joblib.dump(reduced[1], path)),
+        # Last, since the API reloads once the model file changes
+        ("knn_model.pkl", ["model"], lambda path, model: joblib.dump(model, path)),
+    ]
+    for filename, names, write in outputs:
+        if pipeline.publish(os.path.join(out_dir, filename), names, write):
+            print(f"Published {filename}.")
+
+
+if __name__ == "__main__":
+    pipeline = build_pipeline()
+    pipeline.run()
+    publish(pipeline)
+    pipeline.print_report()
+    if pipeline.profile != ProfileMode.NONE:
+        pipeline.write_profile(metadata=profile_metadata())
+
+    model = pipeline.load("model")
+    X_train, X_test, y_train, y_test = pipeline.load("reduce" if TRAINING_SET_REDUCTION is not None else "split")
     categories = np.unique(y_train)
-    np.save(categories_cache_path, categories)
-    print("Saved categories to cache.")
-
-
-# ---------------------------
-# Load or cache the model
-# ---------------------------
-model_cache_path = os.path.join(CACHE_DIR, "knn_model.pkl")
-
-if os.path.exists(model_cache_path):
-    model = joblib.load(model_cache_path)
-    print("Loaded cached KNN model.")
-else:
-    model = KNN.from_data(X_train, y_train, 5, metric=DistanceMetric.EUCLIDEAN)
-    joblib.dump(model, model_cache_path)
-    print("Saved KNN model to cache.")
 
 
 
-# evaluator = Evaluator()
+    # evaluator = Evaluator()
 
-# #evaluator.cross_validate(X=X_train, y=y_train, k_range=range(1,10))
+    # #evaluator.cross_validate(X=X_train, y=y_train, k_range=range(1,10))
 
-# y_pred = KNN.from_data(X_train, y_train, k=5).predict_with_kd_tree_weighted_batch(X_test, batch_size=100)
+    # y_pred = KNN.from_data(X_train, y_train, k=5).predict_with_kd_tree_weighted_batch(X_test, batch_size=100)
 
-# evaluator.print_classification_report(y_pred=y_pred, y_true=y_test)
+    # evaluator.print_classification_report(y_pred=y_pred, y_true=y_test)
 
-# from app import DrawingApp
+    # from app import DrawingApp
 
-# model = KNN.from_data(X_train, y_train, 5)
-# preprocessor = Preprocessor()
-# preprocessor.fit(X)
-# app = DrawingApp(model, preprocessor, categories)
-# app.mainloop()
\ No newline at end of file
+    # model = KNN.from_data(X_train, y_train, 5)
+    # preprocessor = Preprocessor()
+    # preprocessor.fit(X)
+    # app = DrawingApp(model, preprocessor, categories)
+    # app.mainloop()
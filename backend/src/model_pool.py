@@ -0,0 +1,340 @@
+import hashlib
+import os
+import pickle
+import re
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import joblib
+
+from config import CACHE_DIR, MODELS_DIR
+from model_registry import ModelRegistry
+from serving import source_fingerprint
+
+# Served from the cache directory itself; every other model lives in MODELS_DIR/<model id>/
+DEFAULT_MODEL_ID = "default"
+MODEL_ID_PATTERN = re.compile(r"[A-Za-z0-9][A-Za-z0-9_-]*")
+
+
+class UnknownModel(LookupError):
+    """
+    Raised when a model ID is invalid or has no artifacts.
+    """
+
+
+class _ByteCounter:
+    def __init__(self):
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+
+
+def estimate_nbytes(obj):
+    """
+    Estimates the memory held by an object from its pickled state. Arrays are passed
+    out-of-band and only measured, so nothing is copied.
+
+    Lazily built state that is not pickled (e.g. merged category indexes) is not counted, nor
+    are optional search indexes a model builds on first use after it was measured.
+    """
+    counter = _ByteCounter()
+    buffers = []
+    pickle.dump(obj, counter, protocol=5, buffer_callback=lambda buffer: buffers.append(buffer.raw().nbytes))
+    return counter.count + sum(buffers)
+
+
+class PreprocessorCache:
+    """
+    Loads each distinct preprocessor once. Files are identified by a hash of their
+    contents, so models trained with the same scaler and PCA share one instance. An
+    instance is dropped once no loaded model uses it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = weakref.WeakValueDictionary()
+        self.loads = 0
+        self.shared = 0
+
+    def load(self, path, **kwargs):
+        """
+        Drop-in for `joblib.load` (keyword arguments such as mmap_mode are passed on).
+        """
+        with open(path, "rb") as f:
+            digest = hashlib.sha1(f.read()).hexdigest()
+        with self._lock:
+            preprocessor = self._loaded.get(digest)
+            if preprocessor is not None:
+                self.shared += 1
+                return preprocessor
+
+        preprocessor = joblib.load(path, **kwargs)
+        with self._lock:
+            self.loads += 1
+            return self._loaded.setdefault(digest, preprocessor)
+
+
+class ModelPool:
+    """
+    Serves several models from one process, keyed by model ID.
+
+    Each model is a `ModelRegistry` over its own artifact directory, loaded on first use
+    and then hot-reloaded like the default model. When the estimated memory of the
+    loaded models exceeds the budget, after a load or a hot reload, the least recently
+    used ones are evicted. Requests already running on an evicted model finish on it,
+    since they hold a reference to its version. Preprocessors with identical files are
+    shared between models and counted once.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, models_dir=MODELS_DIR, memory_budget=None, max_models=None,
+                 pinned=(DEFAULT_MODEL_ID,), shared_model_dir=None, poll_interval=5.0, watch=True, max_events=100):
+        """
+        Parameters:
+        - cache_dir (str): Artifact directory of the default model.
+        - models_dir (str): Directory holding one artifact directory per additional model.
+        - memory_budget (int, optional): Bytes the loaded models may use. None means no limit.
+        - max_models (int, optional): Number of models kept loaded at once. None means no limit.
+        - pinned (iterable): Model IDs that are never evicted.
+        - shared_model_dir (str, optional): Root for memory-mapped published versions (see `serving.py`).
+        - poll_interval (float): Seconds between checks for changed artifacts of a loaded model.
+        - watch (bool): Hot-reload loaded models when their artifacts change.
+        - max_events (int): Number of recent load/evict events kept for `metrics`.
+        """
+        self.cache_dir = cache_dir
+        self.models_dir = models_dir
+        self.memory_budget = memory_budget
+        self.max_models = max_models
+        self.pinned = set(pinned)
+        self.shared_model_dir = shared_model_dir
+        self.poll_interval = poll_interval
+        self.watch = watch
+        self.preprocessors = PreprocessorCache()
+
+        self._registries = OrderedDict()
+        # model ID -> lock held while the model is loaded, for existing models that are not evicted
+        self._load_locks = {}
+        self._lock = threading.Lock()
+        # id(model) and id(preprocessor) -> estimated bytes, so a version is measured once
+        self._sizes = {}
+        self._events = deque(maxlen=max_events)
+        self._metrics = {"hits": 0, "misses": 0, "loads": 0, "load_failures": 0, "evictions": 0}
+
+    def model_dir(self, model_id):
+        """
+        Returns:
+        - str: The artifact directory of a model.
+
+        Raises:
+        - UnknownModel: If the ID is not a valid directory name.
+        """
+        if model_id == DEFAULT_MODEL_ID:
+            return self.cache_dir
+        if not MODEL_ID_PATTERN.fullmatch(model_id):
+            raise UnknownModel(f"Invalid model ID: {model_id!r}")
+        return os.path.join(self.models_dir, model_id)
+
+    def available(self):
+        """
+        Returns:
+        - list: IDs of the models with artifacts on disk, loaded or not.
+        """
+        model_ids = [DEFAULT_MODEL_ID]
+        if os.path.isdir(self.models_dir):
+            model_ids += sorted(name for name in os.listdir(self.models_dir)
+                                if MODEL_ID_PATTERN.fullmatch(name) and name != DEFAULT_MODEL_ID
+                                and os.path.exists(os.path.join(self.models_dir, name, "knn_model.pkl")))
+        return model_ids
+
+    def loaded(self):
+        """
+        Returns:
+        - list: IDs of the loaded models, least recently used first.
+        """
+        with self._lock:
+            return list(self._registries)
+
+    def registry(self, model_id=DEFAULT_MODEL_ID):
+        """
+        Returns the registry of a model, loading it first if needed, and marks it as most
+        recently used.
+
+        Raises:
+        - UnknownModel: If the model has no artifacts.
+        """
+        model_dir = self.model_dir(model_id)
+        with self._lock:
+            registry = self._registries.get(model_id)
+            if registry is not None:
+                self._registries.move_to_end(model_id)
+                self._metrics["hits"] += 1
+                return registry
+
+        # Locks are only created for models that exist, so unknown IDs leave nothing behind
+        try:
+            source_fingerprint(model_dir)
+        except FileNotFoundError:
+            raise UnknownModel(f"Unknown model: {model_id}")
+        with self._lock:
+            load_lock = self._load_locks.setdefault(model_id, threading.Lock())
+
+        # Only one thread loads a given model; other models keep being served meanwhile
+        with load_lock:
+            with self._lock:
+                registry = self._registries.get(model_id)
+                if registry is not None:
+                    self._registries.move_to_end(model_id)
+                    self._metrics["hits"] += 1
+                    return registry
+                self._metrics["misses"] += 1
+
+            try:
+                registry = self._load(model_id)
+            except Exception:
+                with self._lock:
+                    if self._load_locks.get(model_id) is load_lock:
+                        del self._load_locks[model_id]
+                raise
+            with self._lock:
+                self._registries[model_id] = registry
+                evicted = self._evict(keep=model_id)
+            self._stop_watching(evicted)
+            return registry
+
+    @contextmanager
+    def use(self, model_id=DEFAULT_MODEL_ID):
+        """
+        Pins the current version of a model for the duration of a request.
+
+        Usage:
+            with pool.use("animals") as version:
+                version.model.adaptive_prediction(...)
+        """
+        with self.registry(model_id).use() as version:
+            yield version
+
+    def _load(self, model_id):
+        model_dir = self.model_dir(model_id)
+        shared_model_dir = self.shared_model_dir
+        if shared_model_dir and model_id != DEFAULT_MODEL_ID:
+            shared_model_dir = os.path.join(shared_model_dir, "models", model_id)
+        registry = ModelRegistry(cache_dir=model_dir, shared_model_dir=shared_model_dir,
+                                 poll_interval=self.poll_interval, preprocessors=self.preprocessors,
+                                 on_swap=lambda version: self._swapped(model_id))
+
+        start = time.perf_counter()
+        try:
+            registry.load()
+        except Exception:
+            with self._lock:
+                self._metrics["load_failures"] += 1
+            raise
+        if self.watch:
+            registry.start_watching()
+
+        with self._lock:
+            self._metrics["loads"] += 1
+            self._events.append({"event": "load", "model_id": model_id, "time": time.time(),
+                                 "seconds": round(time.perf_counter() - start, 3),
+                                 "bytes": self._model_bytes(registry.current)})
+        return registry
+
+    def _size(self, obj):
+        key = id(obj)
+        if key not in self._sizes:
+            self._sizes[key] = (weakref.ref(obj), estimate_nbytes(obj))
+        return self._sizes[key][1]
+
+    def _model_bytes(self, version):
+        return self._size(version.model) + self._size(version.preprocessor)
+
+    def _memory_bytes(self):
+        # Preprocessors shared by several models are counted once
+        objects = {}
+        for registry in self._registries.values():
+            version = registry.current
+            objects[id(version.model)] = version.model
+            objects[id(version.preprocessor)] = version.preprocessor
+        return sum(self._size(obj) for obj in objects.values())
+
+    def _swapped(self, model_id):
+        # A hot-reloaded version may be larger than the one it replaced
+        with self._lock:
+            if model_id not in self._registries:
+                # Still loading for the first time, or evicted meanwhile
+                return
+            evicted = self._evict(keep=model_id)
+        self._stop_watching(evicted)
+
+    def _evict(self, keep):
+        """
+        Removes least recently used models until the pool fits its limits. Called with the
+        lock held. Stopping a watcher waits for a reload it may be running, so the caller
+        stops the watchers of the evicted registries with `_stop_watching` after releasing
+        the lock.
+
+        Returns:
+        - list: The evicted registries.
+        """
+        # Forget the sizes of objects that were garbage collected; their ids may be reused
+        self._sizes = {key: entry for key, entry in self._sizes.items() if entry[0]() is not None}
+
+        evicted = []
+        while True:
+            over_budget = self.memory_budget is not None and self._memory_bytes() > self.memory_budget
+            over_count = self.max_models is not None and len(self._registries) > self.max_models
+            if not (over_budget or over_count):
+                return evicted
+
+            victim = next((model_id for model_id in self._registries
+                           if model_id != keep and model_id not in self.pinned), None)
+            if victim is None:
+                # Only the model just loaded and pinned ones are left
+                return evicted
+
+            registry = self._registries.pop(victim)
+            self._load_locks.pop(victim, None)
+            evicted.append(registry)
+            self._metrics["evictions"] += 1
+            self._events.append({"event": "evict", "model_id": victim, "time": time.time(),
+                                 "bytes": self._model_bytes(registry.current),
+                                 "reason": "memory_budget" if over_budget else "max_models"})
+            print(f"Evicted model {victim}.")
+
+    @staticmethod
+    def _stop_watching(registries):
+        for registry in registries:
+            registry.stop_watching()
+
+    def close(self):
+        with self._lock:
+            registries = list(self._registries.values())
+        for registry in registries:
+            registry.stop_watching()
+
+    def metrics(self):
+        """
+        Returns:
+        - dict: Loaded models in least to most recently used order, their estimated
+          memory, hit/miss/load/eviction counts, preprocessor sharing and recent events.
+        """
+        with self._lock:
+            models = {model_id: {"version": registry.current.version,
+                                 "bytes": self._model_bytes(registry.current),
+                                 "in_flight": registry.current.in_flight}
+                      for model_id, registry in self._registries.items()}
+            metrics = dict(self._metrics)
+            metrics.update({
+                "size": len(self._registries),
+                "max_models": self.max_models,
+                "memory_bytes": self._memory_bytes(),
+                "memory_budget": self.memory_budget,
+                "models": models,
+                "preprocessor_loads": self.preprocessors.loads,
+                "preprocessors_shared": self.preprocessors.shared,
+                "events": list(self._events),
+            })
+        return metrics
@@ -0,0 +1,368 @@
+import os
+import threading
+import time
+import warnings
+from contextlib import contextmanager
+
+import joblib
+import numpy as np
+
+from common.distance_metrics import DistanceMetric
+from common.indexing_structures import IndexingStructure
+from config import CACHE_DIR
+from drawing_log import DRAWING_LOG_FILE, DrawingLog
+from serving import fingerprint_version, load_shared_model, publish_model, source_fingerprint
+from tuning import load_tuning_profile, profile_mismatch
+from utils import draw_image
+
+
+class ModelVersion:
+    """
+    One loaded model together with its preprocessor and categories.
+
+    Tracks how many requests are currently using it, so a replaced version can be
+    kept alive until its in-flight requests have finished.
+    """
+
+    def __init__(self, version, model, preprocessor, categories, load_seconds):
+        self.version = version
+        self.model = model
+        self.preprocessor = preprocessor
+        self.categories = categories
+        self.load_seconds = load_seconds
+        self.loaded_at = time.time()
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        # Byte offset in the drawing log up to which drawings were added to this version's model
+        self.drawings_offset = 0
+        self.drawings_lock = threading.Lock()
+
+    @property
+    def raster_size(self):
+        # Models may be trained on different resolutions; the preprocessor expects size x size pixels
+        return int(round(np.sqrt(self.preprocessor.scaler.n_features_in_)))
+
+    def acquire(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self._drained.notify_all()
+
+    def wait_drained(self, timeout=None):
+        """
+        Blocks until no request is using this version.
+
+        Returns:
+        - bool: True if the version drained before the timeout.
+        """
+        with self._lock:
+            return self._drained.wait_for(lambda: self.in_flight == 0, timeout=timeout)
+
+
+class ModelRegistry:
+    """
+    Holds the model version currently served by the API and replaces it without downtime.
+
+    A new version is loaded and warmed up in the background while the current one keeps
+    serving. The swap is a single reference assignment, so every request sees either the
+    old or the new version, never a mix. Requests that started on the old version finish
+    on it; it is dropped once they have drained.
+
+    New versions are picked up either by polling the artifacts in the cache directory
+    (`start_watching`) or on demand (`reload`).
+
+    Drawings added with `add_drawing` are recorded in the cache directory's drawing log.
+    Each new version replays the log before it goes live, and the watcher adds drawings
+    other processes recorded meanwhile.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, shared_model_dir=None, poll_interval=5.0, warmup_queries=8,
+                 preprocessors=None, on_swap=None):
+        """
+        Initializes the registry. Call `load` before serving.
+
+        Parameters:
+        - cache_dir (str): Directory holding `knn_model.pkl`, `preprocessor.pkl` and `categories.npy`.
+        - shared_model_dir (str, optional): Publish versions here and attach to them as
+          shared memory maps (see `serving.py`) instead of loading private copies.
+        - poll_interval (float): Seconds between checks for changed artifacts when watching.
+        - warmup_queries (int): Number of queries run per index structure on a new version before it goes live.
+        - preprocessors (PreprocessorCache, optional): Loads preprocessors so that identical
+          ones are shared with other registries (see `model_pool.py`).
+        - on_swap (callable, optional): Called with the new version after it was swapped in,
+          from the thread that loaded it.
+        """
+        self.cache_dir = cache_dir
+        self.shared_model_dir = shared_model_dir
+        self.poll_interval = poll_interval
+        self.warmup_queries = warmup_queries
+        self.preprocessors = preprocessors
+        self.on_swap = on_swap
+        self.drawings = DrawingLog(os.path.join(cache_dir, DRAWING_LOG_FILE))
+
+        self._current = None
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "loads": 0,
+            "load_failures": 0,
+            "last_load_seconds": None,
+            "last_warmup_seconds": None,
+            "last_swap_seconds": None,
+            "last_drain_seconds": None,
+            "last_error": None,
+        }
+
+    @property
+    def current(self):
+        """
+        The version currently being served.
+        """
+        if self._current is None:
+            raise RuntimeError("No model version has been loaded.")
+        return self._current
+
+    @contextmanager
+    def use(self):
+        """
+        Pins the current version for the duration of a request.
+
+        Usage:
+            with registry.use() as version:
+                version.model.adaptive_prediction(...)
+        """
+        version = self.current
+        version.acquire()
+        try:
+            yield version
+        finally:
+            version.release()
+
+    def _load_version(self, fingerprint):
+        start = time.perf_counter()
+        load_preprocessor = self.preprocessors.load if self.preprocessors is not None else joblib.load
+        if self.shared_model_dir:
+            model, preprocessor, categories = load_shared_model(publish_model(self.cache_dir, self.shared_model_dir),
+                                                                load_preprocessor=load_preprocessor)
+        else:
+            model = joblib.load(os.path.join(self.cache_dir, "knn_model.pkl"))
+            preprocessor = load_preprocessor(os.path.join(self.cache_dir, "preprocessor.pkl"))
+            categories = np.load(os.path.join(self.cache_dir, "categories.npy"))
+
+        # The artifacts may have been rewritten while we were reading them
+        if source_fingerprint(self.cache_dir) != fingerprint:
+            raise RuntimeError("Model artifacts changed while loading.")
+
+        # Search settings chosen by `tuning.py` for this machine, if it was run for this model
+        profile = load_tuning_profile(self.cache_dir)
+        if profile is not None:
+            reason = profile_mismatch(profile, model)
+            if reason is None:
+                model.apply_tuning_profile(profile)
+            else:
+                warnings.warn(f"Ignoring the tuning profile in {self.cache_dir}: {reason}.")
+
+        return ModelVersion(fingerprint_version(fingerprint), model, preprocessor, categories,
+                            load_seconds=time.perf_counter() - start)
+
+    def _warm_up(self, version):
+        """
+        Runs a few predictions on the default index structure and those whose indexes are
+        already built, so that memory-mapped pages are faulted in before the version receives
+        traffic. Optional indexes nobody asked for are left to be built on first use.
+        """
+        model = version.model
+        blank = np.ones((1, version.preprocessor.scaler.n_features_in_))
+        version.preprocessor.transform(blank)
+
+        indexings = set(model.ready_indexings()) | {IndexingStructure(model.default_indexing)}
+        for query in model.training_features[:self.warmup_queries]:
+            for indexing in indexings:
+                model.adaptive_prediction(query, k=model.best_k, metric=DistanceMetric.EUCLIDEAN, indexing=indexing)
+
+    def load(self, force=False):
+        """
+        Loads, warms up and swaps in the artifacts currently in the cache directory.
+
+        Parameters:
+        - force (bool): Reload even if the artifacts match the version being served.
+
+        Returns:
+        - bool: True if a new version was swapped in.
+        """
+        with self._reload_lock:
+            fingerprint = source_fingerprint(self.cache_dir)
+            previous = self._current
+            if not force and previous is not None and previous.version == fingerprint_version(fingerprint):
+                return False
+
+            try:
+                version = self._load_version(fingerprint)
+                self.sync_drawings(version)
+                start = time.perf_counter()
+                self._warm_up(version)
+                warmup_seconds = time.perf_counter() - start
+            except Exception as e:
+                with self._metrics_lock:
+                    self._metrics["load_failures"] += 1
+                    self._metrics["last_error"] = repr(e)
+                raise
+
+            start = time.perf_counter()
+            self._current = version
+            swap_seconds = time.perf_counter() - start
+
+            with self._metrics_lock:
+                self._metrics["loads"] += 1
+                self._metrics["last_load_seconds"] = version.load_seconds
+                self._metrics["last_warmup_seconds"] = warmup_seconds
+                self._metrics["last_swap_seconds"] = swap_seconds
+                self._metrics["last_error"] = None
+
+            print(f"Serving model version {version.version} "
+                  f"(load {version.load_seconds:.2f}s, warm-up {warmup_seconds:.2f}s).")
+
+        if previous is not None:
+            threading.Thread(target=self._retire, args=(previous,), daemon=True).start()
+        if self.on_swap is not None:
+            self.on_swap(version)
+        return True
+
+    def add_drawing(self, strokes, label, tolerance=None):
+        """
+        Adds a labeled drawing to the served model and records it in the drawing log, so
+        that other processes serving this directory and versions loaded later add it too.
+
+        Parameters:
+        - strokes (list): Strokes as (xs, ys) pairs.
+        - label (str): The drawing's category.
+        - tolerance (float, optional): Simplification tolerance to render it with, see `draw_image`.
+
+        Returns:
+        - int: Number of points waiting in the served model's delta buffer.
+
+        Raises:
+        - ValueError: If the model has no such category.
+        """
+        with self.use() as version:
+            if label not in list(version.categories):
+                raise ValueError(f"Unknown category: {label}")
+            self.drawings.append(strokes, label, tolerance)
+            self.sync_drawings(version)
+            return version.model.delta_size
+
+    def sync_drawings(self, version):
+        """
+        Adds the drawings recorded in the log since this version last read it to its model.
+        Drawings of categories the model does not have are skipped.
+
+        Returns:
+        - int: Number of drawings added.
+        """
+        with version.drawings_lock:
+            drawings, offset = self.drawings.read(version.drawings_offset)
+            categories = set(version.categories)
+            drawings = [drawing for drawing in drawings if drawing["label"] in categories]
+            if drawings:
+                images = [draw_image(drawing["strokes"], size=version.raster_size, tolerance=drawing["tolerance"])
+                          for drawing in drawings]
+                features = version.preprocessor.transform(np.stack([image.flatten() for image in images]))
+                version.model.add(features, [drawing["label"] for drawing in drawings])
+            version.drawings_offset = offset
+            return len(drawings)
+
+    def _retire(self, version):
+        start = time.perf_counter()
+        version.wait_drained()
+        with self._metrics_lock:
+            self._metrics["last_drain_seconds"] = time.perf_counter() - start
+        print(f"Retired model version {version.version}.")
+
+    def reload(self, force=True):
+        """
+        Loads a new version in a background thread.
+
+        Returns:
+        - bool: False if a reload is already in progress.
+        """
+        if self._reload_lock.locked():
+            return False
+
+        def run():
+            try:
+                self.load(force=force)
+            except Exception as e:
+                print(f"Model reload failed: {e!r}")
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def start_watching(self):
+        """
+        Starts a daemon thread that reloads the model when the cached artifacts change,
+        and otherwise adds the drawings other processes recorded since the last poll.
+
+        A change is only acted on once the fingerprint has been stable for one poll
+        interval, so a model that is still being written is not picked up.
+        """
+        if self._watcher is not None:
+            return
+
+        def watch():
+            pending = None
+            while not self._stop.wait(self.poll_interval):
+                try:
+                    fingerprint = source_fingerprint(self.cache_dir)
+                except FileNotFoundError:
+                    pending = None
+                    continue
+
+                if fingerprint_version(fingerprint) == self.current.version:
+                    pending = None
+                    try:
+                        self.sync_drawings(self.current)
+                    except Exception as e:
+                        print(f"Adding recorded drawings failed: {e!r}")
+                elif fingerprint != pending:
+                    pending = fingerprint
+                else:
+                    try:
+                        self.load()
+                    except Exception as e:
+                        print(f"Model reload failed: {e!r}")
+                    pending = None
+
+        self._watcher = threading.Thread(target=watch, daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+            self._watcher = None
+        self._stop.clear()
+
+    def metrics(self):
+        """
+        Returns:
+        - dict: Current version, its in-flight requests, and load/warm-up/swap/drain timings.
+        """
+        with self._metrics_lock:
+            metrics = dict(self._metrics)
+
+        version = self._current
+        if version is not None:
+            metrics.update({
+                "version": version.version,
+                "loaded_at": version.loaded_at,
+                "in_flight": version.in_flight,
+            })
+        metrics["reloading"] = self._reload_lock.locked()
+        return metrics
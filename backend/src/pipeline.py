@@ -0,0 +1,363 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import joblib
+import psutil
+
+from common.profile_mode import ProfileMode
+from config import CACHE_DIR
+
+PIPELINE_DIR = os.path.join(CACHE_DIR, "pipeline")
+PUBLISHED_MANIFEST = "published.json"
+# One JSON line per profiled run, to track memory and time across versions and dataset sizes
+PROFILE_LOG = os.path.join(CACHE_DIR, "pipeline_profiles.jsonl")
+SOURCE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+    """
+    One step of a `Pipeline`: a function of the artifacts of other stages and some parameters.
+    """
+
+    def __init__(self, name, func, inputs=(), params=None, files=(), version=1):
+        """
+        Parameters:
+        - name (str): Unique stage name.
+        - func (callable): Called as func(*input_artifacts, **params); returns the stage's artifact.
+          Must be a module-level function so it can run in a worker process.
+        - inputs (tuple): Names of the stages whose artifacts are passed to func, in order.
+        - params (dict, optional): JSON-serializable keyword arguments of func.
+        - files (tuple): Paths of source files func reads; their size and modification time
+          are part of the key.
+        - version (int): Bump to invalidate the stage's artifacts after changing func.
+        """
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.params = params or {}
+        self.files = tuple(files)
+        self.version = version
+
+
+def _file_fingerprint(path):
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Missing pipeline input: {path}")
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+
+
+class _Profiler:
+    """
+    Measures a block of work in the process running it.
+
+    Wall and CPU time are always recorded. With ProfileMode.RSS a thread samples the
+    resident set size every `interval` seconds, so the peak is that of this block even in
+    a worker process that ran other stages before. With ProfileMode.TRACEMALLOC Python and
+    NumPy allocations are traced as well. The thread snapshots them whenever the traced
+    memory reaches a new high, so the largest blocks are reported as they were near the
+    peak, including temporaries that were freed before the end.
+    """
+
+    def __init__(self, mode=ProfileMode.NONE, interval=0.01, top=10, frames=16):
+        self.mode = ProfileMode(mode)
+        self.interval = interval
+        self.top = top
+        self.frames = frames
+
+    def __enter__(self):
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = None
+        self._snapshot = None
+        self._snapshot_bytes = 0
+        self.rss_start = self.rss_peak = self._process.memory_info().rss
+        if self.mode == ProfileMode.TRACEMALLOC:
+            tracemalloc.start(self.frames)
+        if self.mode != ProfileMode.NONE:
+            self._thread = threading.Thread(target=self._sample_until_stopped, daemon=True)
+            self._thread.start()
+        self._start, self._cpu_start = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self._start
+        self.cpu_seconds = time.process_time() - self._cpu_start
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._sample()
+        if self.mode == ProfileMode.TRACEMALLOC:
+            self.traced_peak = tracemalloc.get_traced_memory()[1]
+            self.largest_blocks = self._largest_blocks()
+            self._snapshot = None
+            tracemalloc.stop()
+        return False
+
+    def _sample_until_stopped(self):
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def _sample(self):
+        self.rss_peak = max(self.rss_peak, self._process.memory_info().rss)
+        if self.mode == ProfileMode.TRACEMALLOC:
+            current = tracemalloc.get_traced_memory()[0]
+            # Snapshots cost time proportional to the live blocks, so only on a clear new high
+            if current > self._snapshot_bytes * 1.1 + 2 ** 20:
+                self._snapshot = tracemalloc.take_snapshot()
+                self._snapshot_bytes = current
+
+    def _largest_blocks(self):
+        if self._snapshot is None:
+            return []
+        snapshot = self._snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        blocks = []
+        for trace in sorted(snapshot.traces, key=lambda trace: trace.size, reverse=True)[:self.top]:
+            frames = list(trace.traceback)
+            # The innermost frame is often inside NumPy or scikit-learn; also report the
+            # innermost line of this project that led to it
+            caller = next((frame for frame in reversed(frames) if frame.filename.startswith(SOURCE_DIR)), None)
+            blocks.append({
+                "bytes": trace.size,
+                "site": f"{frames[-1].filename}:{frames[-1].lineno}" if frames else None,
+                "caller": f"{os.path.relpath(caller.filename, SOURCE_DIR)}:{caller.lineno}" if caller else None,
+            })
+        return blocks
+
+    def report(self):
+        """
+        Returns:
+        - dict: seconds, cpu_seconds and, when profiling, RSS at the start and peak, the
+          peak growth, and with tracemalloc the traced peak and the largest blocks.
+        """
+        report = {"seconds": self.seconds, "cpu_seconds": self.cpu_seconds}
+        if self.mode != ProfileMode.NONE:
+            report.update({"rss_start": self.rss_start, "rss_peak": self.rss_peak,
+                           "rss_growth": self.rss_peak - self.rss_start})
+        if self.mode == ProfileMode.TRACEMALLOC:
+            report.update({"traced_peak": self.traced_peak, "largest_blocks": self.largest_blocks})
+        return report
+
+
+def _run_stage(func, input_paths, params, output_path, profile=ProfileMode.NONE):
+    """
+    Computes one stage in a worker process and stores its artifact.
+
+    Returns:
+    - dict: The `_Profiler` report of the computation, with the artifact's size when profiling.
+    """
+    with _Profiler(profile) as profiler:
+        inputs = [joblib.load(path) for path in input_paths]
+        artifact = func(*inputs, **params)
+
+        # Written under a temporary name so that an interrupted run never leaves a partial artifact
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        joblib.dump(artifact, tmp_path)
+        os.replace(tmp_path, output_path)
+
+    report = profiler.report()
+    if profiler.mode != ProfileMode.NONE:
+        report["artifact_bytes"] = os.path.getsize(output_path)
+    return report
+
+
+class Pipeline:
+    """
+    A DAG of stages whose artifacts are cached under a hash of everything they depend on.
+
+    A stage's key covers its name, version, parameters, source file fingerprints and the
+    keys of its inputs, so changing a parameter invalidates that stage and everything
+    downstream of it while unaffected artifacts are reused. Stages whose inputs are
+    ready run in parallel worker processes.
+
+    In a profiling mode every computed stage and published file also records its peak
+    RSS and, with tracemalloc, the largest allocations (see `_Profiler`). `profile_report`
+    and `write_profile` export them as JSON.
+    """
+
+    def __init__(self, stages, cache_dir=PIPELINE_DIR, max_workers=None, profile=ProfileMode.NONE):
+        """
+        Parameters:
+        - stages (list): The `Stage`s; inputs must refer to stages in the list.
+        - cache_dir (str): Directory holding the artifacts.
+        - max_workers (int, optional): Number of worker processes. Defaults to the number of CPUs.
+          Use 1 when profiling memory, since stages running in parallel share the machine's RAM.
+        - profile (ProfileMode): What to measure for every computed stage.
+        """
+        self.stages = {}
+        for stage in stages:
+            if stage.name in self.stages:
+                raise ValueError(f"Duplicate stage name: {stage.name}")
+            missing = [name for name in stage.inputs if name not in self.stages]
+            if missing:
+                raise ValueError(f"Stage {stage.name} depends on unknown or later stages: {missing}")
+            self.stages[stage.name] = stage
+
+        self.cache_dir = cache_dir
+        self.max_workers = max_workers
+        self.profile = ProfileMode(profile)
+        os.makedirs(cache_dir, exist_ok=True)
+        self.keys = {}
+        for stage in self.stages.values():
+            self.keys[stage.name] = self._key(stage)
+        self.timings = {}
+        self.publish_timings = {}
+
+    def _key(self, stage):
+        description = {
+            "stage": stage.name,
+            "version": stage.version,
+            "params": stage.params,
+            "files": [_file_fingerprint(path) for path in stage.files],
+            "inputs": [self.keys[name] for name in stage.inputs],
+        }
+        encoded = json.dumps(description, sort_keys=True, default=str).encode()
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+    def artifact_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}-{self.keys[name]}.joblib")
+
+    def _required(self, targets):
+        required = set()
+        pending = list(targets)
+        while pending:
+            name = pending.pop()
+            if name not in required:
+                required.add(name)
+                pending.extend(self.stages[name].inputs)
+        return required
+
+    def run(self, targets=None):
+        """
+        Brings the artifacts of the target stages and their dependencies up to date.
+
+        Parameters:
+        - targets (list, optional): Stage names to produce. Defaults to every stage.
+
+        Returns:
+        - dict: Maps every stage that was needed to {"status": "cached" or "computed", "seconds",
+          "cpu_seconds"}, plus the memory measurements of computed stages when profiling.
+        """
+        required = self._required(targets or list(self.stages))
+        done = set()
+        for name in required:
+            if os.path.exists(self.artifact_path(name)):
+                done.add(name)
+                self.timings[name] = {"status": "cached", "seconds": 0.0, "cpu_seconds": 0.0}
+
+        running = {}
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            while len(done) < len(required):
+                for name in required - done - set(running.values()):
+                    stage = self.stages[name]
+                    if all(dependency in done for dependency in stage.inputs):
+                        print(f"Running stage {name}...")
+                        future = executor.submit(_run_stage, stage.func,
+                                                 [self.artifact_path(dependency) for dependency in stage.inputs],
+                                                 stage.params, self.artifact_path(name), self.profile)
+                        running[future] = name
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    self.timings[name] = {"status": "computed", **future.result()}
+                    done.add(name)
+
+        return {name: self.timings[name] for name in self.stages if name in required}
+
+    def load(self, name):
+        """
+        Returns the artifact of a stage that has been run.
+        """
+        return joblib.load(self.artifact_path(name))
+
+    def publish(self, path, names, write):
+        """
+        Exports artifacts to a fixed path for consumers outside the pipeline, e.g. the API.
+
+        The file is only rewritten when the keys of the stages it is made from changed, so
+        unchanged artifacts keep their modification time and do not trigger a model reload.
+
+        Parameters:
+        - path (str): Destination file.
+        - names (list): Stages whose artifacts are passed to write, in order.
+        - write (callable): Called as write(tmp_path, *artifacts); must write the file at tmp_path.
+
+        Returns:
+        - bool: True if the file was rewritten.
+        """
+        manifest_path = os.path.join(self.cache_dir, PUBLISHED_MANIFEST)
+        manifest = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        key = [self.keys[name] for name in names]
+        if manifest.get(path) == key and os.path.exists(path):
+            return False
+
+        # Keep the destination's extension; np.save and friends append one otherwise
+        root, extension = os.path.splitext(path)
+        tmp_path = f"{root}.tmp{extension}"
+        with _Profiler(self.profile) as profiler:
+            write(tmp_path, *[self.load(name) for name in names])
+            os.replace(tmp_path, path)
+        self.publish_timings[os.path.basename(path)] = profiler.report()
+
+        manifest[path] = key
+        with open(manifest_path, "w") as f:
+            json.dump(manifest, f, indent=2)
+        return True
+
+    def print_report(self):
+        memory = self.profile != ProfileMode.NONE
+        memory_header = f" {'peak RSS MB':>11} {'growth MB':>9}" if memory else ""
+        print(f"{'stage':<28} {'status':<9} {'wall s':>8} {'cpu s':>8}{memory_header}  key")
+        rows = [(name, self.timings[name], self.keys[name]) for name in self.stages if name in self.timings]
+        rows += [(f"publish {filename}", timing, "") for filename, timing in self.publish_timings.items()]
+        for name, timing, key in rows:
+            status = timing.get("status", "written")
+            memory_columns = ""
+            if memory and "rss_peak" in timing:
+                memory_columns = f" {timing['rss_peak'] / 2**20:>11.0f} {timing['rss_growth'] / 2**20:>9.0f}"
+            elif memory:
+                memory_columns = f" {'':>11} {'':>9}"
+            print(f"{name:<28} {status:<9} {timing['seconds']:>8.2f} {timing['cpu_seconds']:>8.2f}{memory_columns}  {key}")
+
+        if self.profile == ProfileMode.TRACEMALLOC:
+            print("Largest blocks near each stage's traced peak:")
+            for name, timing, _ in rows:
+                for block in timing.get("largest_blocks", [])[:3]:
+                    print(f"  {name:<28} {block['bytes'] / 2**20:>8.1f} MB  {block['caller'] or block['site']}")
+
+    def profile_report(self, metadata=None):
+        """
+        Parameters:
+        - metadata (dict, optional): Run parameters to store alongside, e.g. samples per class.
+
+        Returns:
+        - dict: The profiling mode, metadata, the peak RSS over all stages, and the
+          measurements of every stage and published file of this run.
+        """
+        stages = {name: dict(self.timings[name], key=self.keys[name]) for name in self.stages if name in self.timings}
+        measured = list(self.timings.values()) + list(self.publish_timings.values())
+        return {
+            "created": time.time(),
+            "profile": self.profile.value,
+            "metadata": metadata or {},
+            "seconds": sum(timing["seconds"] for timing in measured),
+            "rss_peak": max((timing["rss_peak"] for timing in measured if "rss_peak" in timing), default=None),
+            "stages": stages,
+            "published": self.publish_timings,
+        }
+
+    def write_profile(self, path=PROFILE_LOG, metadata=None):
+        """
+        Appends `profile_report` to a JSON lines file.
+        """
+        with open(path, "a") as f:
+            f.write(json.dumps(self.profile_report(metadata)) + "\n")
@@ -0,0 +1,135 @@
+import numpy as np
+
+from common.distance_metrics import DistanceMetric
+
+
+def _distances(point, features, metric):
+    diffs = features - point
+    if metric == DistanceMetric.EUCLIDEAN:
+        return np.sqrt(np.einsum("ij,ij->i", diffs, diffs))
+    return np.sum(np.abs(diffs), axis=1)
+
+
+def build_pivot_table(features, metric=DistanceMetric.EUCLIDEAN, n_pivots=32, random_state=42):
+    """
+    Chooses pivots by farthest-first traversal, which spreads them out and tightens the
+    bounds, and computes the distance from every point to each of them.
+
+    Returns:
+    - tuple: (pivots, pivot_table) with the pivot row indices and an array of shape
+      (n_samples, n_pivots) in the dtype of the features.
+    """
+    features = np.asarray(features)
+    n_pivots = min(n_pivots, len(features))
+    pivots = [int(np.random.default_rng(random_state).integers(len(features)))]
+    table = np.empty((len(features), n_pivots), dtype=features.dtype)
+    nearest_pivot = np.full(len(features), np.inf)
+    for column in range(n_pivots):
+        table[:, column] = _distances(features[pivots[column]], features, metric)
+        nearest_pivot = np.minimum(nearest_pivot, table[:, column])
+        if column + 1 < n_pivots:
+            pivots.append(int(np.argmax(nearest_pivot)))
+    return np.array(pivots), table
+
+
+class PivotIndex:
+    """
+    Exact LAESA-style metric index for EUCLIDEAN and MANHATTAN distances.
+
+    The distance from every training point to a small set of pivots is precomputed. For
+    a query q and any point x, the triangle inequality gives the lower bound
+    max_p |d(q, p) - d(x, p)| <= d(q, x), which only needs the pivot table. Exact
+    distances are computed for the points with the smallest bounds first; every point
+    whose bound is not below the resulting k-th distance is skipped without ever being
+    compared to the query.
+    """
+
+    def __init__(self, features, metric=DistanceMetric.EUCLIDEAN, n_pivots=32, seed_candidates=64, random_state=42,
+                 pivot_table=None):
+        """
+        Builds the index, or wraps a pivot table built earlier with `build_pivot_table`.
+
+        Parameters:
+        - features (np.ndarray): Training features of shape (n_samples, n_features).
+        - metric (DistanceMetric): EUCLIDEAN or MANHATTAN.
+        - n_pivots (int): Number of pivots, chosen by farthest-first traversal.
+        - seed_candidates (int): Number of points with the smallest bounds that are compared
+          exactly first to establish the pruning radius.
+        - random_state (int): Seed for the first pivot.
+        - pivot_table (tuple, optional): (pivots, pivot_table) of these features and metric.
+        """
+        self.metric = DistanceMetric(metric)
+        if self.metric not in (DistanceMetric.EUCLIDEAN, DistanceMetric.MANHATTAN):
+            raise ValueError(f"Unsupported distance metric: {self.metric}")
+
+        self.features = np.asarray(features)
+        self.seed_candidates = seed_candidates
+        if pivot_table is None:
+            pivot_table = build_pivot_table(self.features, self.metric, n_pivots, random_state)
+        self.pivots, self.pivot_table = pivot_table
+        # Exact distance computations, including those to the pivots, for benchmarking
+        self.distance_evaluations = 0
+
+    def lower_bounds(self, point):
+        """
+        Triangle-inequality lower bounds of the distances from `point` to every training point.
+
+        Returns:
+        - tuple: (bounds, pivot_dists)
+        """
+        pivot_dists = _distances(point, self.features[self.pivots], self.metric)
+        bounds = np.max(np.abs(self.pivot_table - pivot_dists), axis=1)
+        return bounds, pivot_dists
+
+    def _query_one(self, point, k):
+        n = len(self.features)
+        bounds, pivot_dists = self.lower_bounds(point)
+
+        # The pivots' exact distances are already known
+        evaluated = np.zeros(n, dtype=bool)
+        evaluated[self.pivots] = True
+        dists = np.full(n, np.inf)
+        dists[self.pivots] = pivot_dists
+
+        # Compare the points with the smallest bounds to get a first k-th distance
+        seed = min(n, max(k, self.seed_candidates))
+        seed = np.argpartition(bounds, seed - 1)[:seed]
+        seed = seed[~evaluated[seed]]
+        dists[seed] = _distances(point, self.features[seed], self.metric)
+        evaluated[seed] = True
+        count = len(self.pivots) + len(seed)
+
+        # Only points whose bound is below the k-th distance can still make the top k
+        radius = np.partition(dists, k - 1)[k - 1]
+        remaining = np.flatnonzero((bounds < radius) & ~evaluated)
+        dists[remaining] = _distances(point, self.features[remaining], self.metric)
+        count += len(remaining)
+
+        self.distance_evaluations += count
+        nearest = np.argpartition(dists, k - 1)[:k]
+        nearest = nearest[np.argsort(dists[nearest], kind="stable")]
+        return dists[nearest], nearest
+
+    def query(self, points, k=1):
+        """
+        Finds the exact k nearest training points of every query.
+
+        Parameters:
+        - points (np.ndarray): A 1D feature vector or a 2D array of shape (n_samples, n_features).
+        - k (int): Number of neighbors; clamped to the number of training points.
+
+        Returns:
+        - tuple: (dists, indices) of shape (n_samples, k), sorted by ascending distance.
+        """
+        # Queries take the dtype of the features, so float32 indexes stay in float32
+        points = np.asarray(points, dtype=self.features.dtype).reshape(-1, self.features.shape[1])
+        k = min(k, len(self.features))
+
+        all_dists = np.empty((len(points), k))
+        all_indices = np.empty((len(points), k), dtype=np.intp)
+        for row, point in enumerate(points):
+            all_dists[row], all_indices[row] = self._query_one(point, k)
+        return all_dists, all_indices
+
+    def reset_distance_evaluations(self):
+        self.distance_evaluations = 0
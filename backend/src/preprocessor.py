@@ -1,56 +1,170 @@
 import numpy as np
 import pandas as pd
+from scipy import linalg
 from sklearn.preprocessing import StandardScaler
 from sklearn.decomposition import PCA
 
+from common.precision import Precision
+from raster import RASTER_SCALE
+
+# Rows standardized and projected at once; bounds the float64 working set of fit/transform
+DEFAULT_CHUNK_SIZE = 1024
+
+
 class Preprocessor:
     """
     Preprocessor for scaling and dimensionality reduction using StandardScaler and PCA.
 
+    Inputs may be [0, 1] float images or uint8 rasters (see `raster.py`), or datasets that
+    stream uint8 rasters through `iter_batches` (see `dataset_store.py`); uint8 rows are
+    scaled to [0, 1] chunk by chunk, so no float64 copy of the whole dataset is made.
+    Fitting always accumulates in float64; transforms produce `precision` features.
+
     Methods:
     - fit(X): Fits the scaler and PCA to the input data.
     - transform(X): Applies the fitted scaler and PCA to transform the input data.
     - fit_transform(X): Fits and transforms the input data.
+    - transform_ink(ink): Transforms sparse ink matrices without densifying them.
     - inverse_transform(X_reduced): Reconstructs the original (scaled) data from reduced form.
     - transform_only_scale(X): Applies only the fitted scaler (no PCA).
     """
 
-    def __init__(self, n_components=64):
+    def __init__(self, n_components=64, chunk_size=DEFAULT_CHUNK_SIZE, precision=Precision.FLOAT64):
         """
         Initializes the Preprocessor.
 
         Parameters:
         - n_components (int): Number of principal components to keep in PCA.
+        - chunk_size (int): Number of rows converted to floating point at a time.
+        - precision (Precision): Floating point type of the transformed chunks and features.
         """
         self.scaler = StandardScaler()
         self.pca = PCA(n_components=n_components)
+        self.chunk_size = chunk_size
+        self.precision = precision
         self.fitted = False
 
+    def __setstate__(self, state):
+        # Preprocessors pickled before chunked processing existed lack the chunk size
+        state.setdefault("chunk_size", DEFAULT_CHUNK_SIZE)
+        state.setdefault("precision", Precision.FLOAT64)
+        self.__dict__.update(state)
+
+    @property
+    def dtype(self):
+        return np.dtype(Precision(self.precision).value)
+
+    @staticmethod
+    def _as_2d(X):
+        # Memory maps and streamed datasets are kept as they are so that chunks are read lazily
+        if hasattr(X, "iter_batches"):
+            return X
+        if isinstance(X, pd.DataFrame):
+            X = X.values
+        if not hasattr(X, "dtype"):
+            X = np.asarray(X)
+        return X.reshape(1, -1) if X.ndim == 1 else X
+
+    def _chunks(self, X, dtype=np.float64):
+        """
+        Yields (start, rows in [0, 1] of the given dtype) for consecutive chunks of a 2D X
+        or of the uint8 batches of a streamed dataset.
+        """
+        if hasattr(X, "iter_batches"):
+            chunks = (batch for batch, _ in X.iter_batches(self.chunk_size, dtype=None))
+        else:
+            chunks = (X[start:start + self.chunk_size] for start in range(0, len(X), self.chunk_size))
+
+        start = 0
+        for chunk in chunks:
+            if chunk.dtype == np.uint8:
+                yield start, np.divide(chunk, RASTER_SCALE, dtype=dtype)
+            else:
+                yield start, np.asarray(chunk, dtype=dtype)
+            start += len(chunk)
+
     def fit(self, X):
         """
         Fits the scaler and PCA to the input data.
 
+        Both are fitted from running sums over chunks: the scaler with `partial_fit`, and
+        the PCA from the eigendecomposition of the covariance matrix of the standardized
+        data, which is exact rather than the randomized solver PCA picks for large inputs.
+
         Parameters:
-        - X (array-like): Input features to fit on.
+        - X (array-like): Input features to fit on, float in [0, 1] or uint8 rasters.
         """
-        X_scaled = self.scaler.fit_transform(X)
-        self.pca.fit(X_scaled)
+        X = self._as_2d(X)
+        self.scaler = StandardScaler()
+        for _, chunk in self._chunks(X):
+            self.scaler.partial_fit(chunk)
+
+        n_features = self.scaler.n_features_in_
+        n_samples = 0
+        total = np.zeros(n_features)
+        gram = np.zeros((n_features, n_features))
+        for _, chunk in self._chunks(X):
+            scaled = self.scaler.transform(chunk)
+            n_samples += len(scaled)
+            total += scaled.sum(axis=0)
+            gram += scaled.T @ scaled
+
+        # The Gram matrix becomes the covariance matrix in place
+        mean = total / n_samples
+        gram -= n_samples * np.outer(mean, mean)
+        gram /= max(n_samples - 1, 1)
+        self._set_pca(gram, mean, n_samples)
         self.fitted = True
 
+    def _set_pca(self, covariance, mean, n_samples):
+        """
+        Stores the leading eigenvectors of the covariance matrix as the fitted PCA, so
+        `self.pca` behaves like a PCA fitted on the data itself. Overwrites `covariance`.
+        """
+        n_features = len(mean)
+        n_components = min(self.pca.n_components, n_features)
+        total_variance = np.trace(covariance)
+
+        # Only the leading eigenpairs are computed, largest first after reversing
+        eigenvalues, eigenvectors = linalg.eigh(covariance, subset_by_index=[n_features - n_components, n_features - 1],
+                                                overwrite_a=True)
+        eigenvalues = np.clip(eigenvalues[::-1], 0, None)
+        components = np.ascontiguousarray(eigenvectors[:, ::-1].T)
+
+        # Same sign convention as PCA: the largest absolute loading of each component is positive
+        signs = np.sign(components[np.arange(len(components)), np.argmax(np.abs(components), axis=1)])
+        components *= signs[:, np.newaxis]
+
+        pca = self.pca
+        pca.n_features_in_ = n_features
+        pca.n_samples_ = n_samples
+        pca.n_components_ = n_components
+        pca.mean_ = mean
+        pca.components_ = components
+        pca.explained_variance_ = eigenvalues
+        pca.explained_variance_ratio_ = eigenvalues / total_variance
+        pca.singular_values_ = np.sqrt(eigenvalues * max(n_samples - 1, 1))
+        # Average variance of the discarded components
+        remaining = min(n_samples, n_features) - n_components
+        pca.noise_variance_ = max(total_variance - eigenvalues.sum(), 0.0) / remaining if remaining else 0.0
+
     def transform(self, X):
         """
         Transforms the input data using the fitted scaler and PCA.
 
         Parameters:
-        - X (array-like): Input features to transform.
+        - X (array-like): Input features to transform, float in [0, 1] or uint8 rasters.
 
         Returns:
-        - np.ndarray: Scaled and reduced features.
+        - np.ndarray: Scaled and reduced features in the preprocessor's precision.
         """
         if not self.fitted:
             raise RuntimeError("Preprocessor must be fitted before calling transform.")
-        X_scaled = self.scaler.transform(X)
-        return self.pca.transform(X_scaled)
+        X = self._as_2d(X)
+        reduced = np.empty((len(X), self.pca.n_components_), dtype=self.dtype)
+        for start, chunk in self._chunks(X, self.dtype):
+            reduced[start:start + len(chunk)] = self.pca.transform(self.scaler.transform(chunk))
+        return reduced
 
     def fit_transform(self, X):
         """
@@ -62,9 +176,29 @@ class Preprocessor:
         Returns:
         - np.ndarray: Scaled and reduced features.
         """
-        X_scaled = self.scaler.fit_transform(X)
-        self.fitted = True
-        return self.pca.fit_transform(X_scaled)
+        self.fit(X)
+        return self.transform(X)
+
+    def transform_ink(self, ink):
+        """
+        Transforms drawings given as sparse ink intensities (see `raster.ink_matrix`).
+
+        A pixel is 1 - ink / 255, so the projection of the standardized image splits into
+        the projection of an all-white image minus a term linear in the ink. Only the
+        pixels a stroke touches are visited.
+
+        Parameters:
+        - ink (scipy.sparse matrix): Ink intensities of shape (n_samples, n_pixels), 0 to 255.
+
+        Returns:
+        - np.ndarray: Scaled and reduced features, equal to `transform` of the dense rasters.
+        """
+        if not self.fitted:
+            raise RuntimeError("Preprocessor must be fitted before calling transform_ink.")
+        components = self.pca.components_
+        white = self.pca.transform(self.scaler.transform(np.ones((1, components.shape[1]))))
+        weights = (components / (self.scaler.scale_ * RASTER_SCALE)).T
+        return (white - np.asarray(ink @ weights)).astype(self.dtype, copy=False)
 
     def inverse_transform(self, X_reduced):
         """
@@ -0,0 +1,50 @@
+import numpy as np
+from scipy import sparse
+
+# Rasters are stored as uint8 with 255 for white background; dividing by RASTER_SCALE gives
+# the [0, 1] images `draw_image` returns
+RASTER_SCALE = 255
+
+
+def to_uint8(images):
+    """
+    Converts [0, 1] images to uint8 rasters.
+    """
+    return np.rint(np.asarray(images) * RASTER_SCALE).astype(np.uint8)
+
+
+def pack_binary(rasters, threshold=128):
+    """
+    Binarizes rasters into ink (pixel below threshold) and background and packs 8 pixels
+    per byte, e.g. 392 bytes instead of 3136 for a 56x56 drawing.
+
+    Parameters:
+    - rasters (np.ndarray): uint8 rasters of shape (n_samples, n_pixels).
+    - threshold (int): Pixels darker than this count as ink.
+
+    Returns:
+    - np.ndarray: Packed bits of shape (n_samples, ceil(n_pixels / 8)).
+    """
+    return np.packbits(np.asarray(rasters) < threshold, axis=1)
+
+
+def unpack_binary(packed, n_pixels):
+    """
+    Inverse of `pack_binary`: uint8 rasters with 0 for ink and 255 for background.
+    """
+    ink = np.unpackbits(np.asarray(packed), axis=1, count=n_pixels)
+    return ((1 - ink) * RASTER_SCALE).astype(np.uint8)
+
+
+def ink_matrix(rasters, dtype=np.uint8):
+    """
+    Sparse matrix of ink intensities (255 - pixel), which only stores the few pixels a
+    stroke touches. Accepted by `Preprocessor.transform_ink`.
+
+    Parameters:
+    - rasters (np.ndarray): uint8 rasters of shape (n_samples, n_pixels).
+
+    Returns:
+    - scipy.sparse.csr_matrix: Ink intensities of shape (n_samples, n_pixels).
+    """
+    return sparse.csr_matrix((RASTER_SCALE - np.asarray(rasters)).astype(dtype, copy=False))
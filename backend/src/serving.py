@@ -0,0 +1,161 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+import joblib
+import numpy as np
+
+from config import CACHE_DIR
+
+SHARED_MODEL_DIR = os.path.join(CACHE_DIR, "shared")
+SHARED_MODEL_ENV = "QUICKDRAW_SHARED_MODEL_DIR"
+
+MODEL_FILE = "knn_model.joblib"
+PREPROCESSOR_FILE = "preprocessor.joblib"
+CATEGORIES_FILE = "categories.npy"
+MANIFEST_FILE = "manifest.json"
+
+
+def _source_paths(cache_dir):
+    return {
+        MODEL_FILE: os.path.join(cache_dir, "knn_model.pkl"),
+        PREPROCESSOR_FILE: os.path.join(cache_dir, "preprocessor.pkl"),
+        CATEGORIES_FILE: os.path.join(cache_dir, "categories.npy"),
+    }
+
+
+def source_fingerprint(cache_dir=CACHE_DIR):
+    """
+    Identifies the current model artifacts by their sizes and modification times.
+
+    Returns:
+    - dict: Maps each artifact name to [size, mtime].
+
+    Raises:
+    - FileNotFoundError: If an artifact is missing.
+    """
+    fingerprint = {}
+    for name, path in _source_paths(cache_dir).items():
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Missing model artifact: {path}")
+        stat = os.stat(path)
+        fingerprint[name] = [stat.st_size, stat.st_mtime]
+    return fingerprint
+
+
+def fingerprint_version(fingerprint):
+    """
+    Short, stable version id derived from an artifact fingerprint.
+    """
+    return hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def publish_model(cache_dir=CACHE_DIR, out_dir=SHARED_MODEL_DIR):
+    """
+    Loads the cached model artifacts once and re-saves them uncompressed so that
+    every numpy array (training matrix, KD/Ball tree buffers, scaler and PCA
+    matrices) can be memory-mapped by the serving workers.
+
+    Worker processes that attach with `load_shared_model` map the same file pages
+    read-only, so the OS page cache holds a single copy no matter how many
+    workers are running.
+
+    Each model version is published to its own subdirectory, named after the
+    artifact fingerprint, and moved into place atomically. Published files are never
+    rewritten, so workers still mapping an older version are unaffected, and
+    publishing an already published version is a no-op.
+
+    Parameters:
+    - cache_dir (str): Directory holding `knn_model.pkl`, `preprocessor.pkl` and `categories.npy`.
+    - out_dir (str): Root directory to publish the memory-mappable artifacts under.
+
+    Returns:
+    - str: The version directory the artifacts were published to.
+    """
+    sources = _source_paths(cache_dir)
+    fingerprint = source_fingerprint(cache_dir)
+    version_dir = os.path.join(out_dir, fingerprint_version(fingerprint))
+    if os.path.exists(os.path.join(version_dir, MANIFEST_FILE)):
+        return version_dir
+
+    tmp_dir = os.path.join(out_dir, f".tmp-{os.getpid()}-{os.path.basename(version_dir)}")
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    # compress=0 keeps arrays as raw buffers inside the pickle, which joblib can mmap
+    joblib.dump(joblib.load(sources[MODEL_FILE]), os.path.join(tmp_dir, MODEL_FILE), compress=0)
+    joblib.dump(joblib.load(sources[PREPROCESSOR_FILE]), os.path.join(tmp_dir, PREPROCESSOR_FILE), compress=0)
+    shutil.copyfile(sources[CATEGORIES_FILE], os.path.join(tmp_dir, CATEGORIES_FILE))
+
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w") as f:
+        json.dump(fingerprint, f)
+
+    try:
+        os.rename(tmp_dir, version_dir)
+        print(f"Published shared model artifacts to: {version_dir}")
+    except OSError:
+        # Another worker published the same version first
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return version_dir
+
+
+def prune_published_versions(out_dir=SHARED_MODEL_DIR, keep=2):
+    """
+    Deletes all but the `keep` most recently published versions. Only call this while
+    no worker has the pruned versions mapped, e.g. before the server starts.
+    """
+    if not os.path.isdir(out_dir):
+        return
+    versions = [os.path.join(out_dir, name) for name in os.listdir(out_dir)]
+    # Only published versions; other models of the pool are published under models/
+    versions = [path for path in versions if os.path.exists(os.path.join(path, MANIFEST_FILE))]
+    versions = sorted(versions, key=os.path.getmtime, reverse=True)
+    for path in versions[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def load_shared_model(version_dir, load_preprocessor=joblib.load):
+    """
+    Attaches to a version published by `publish_model` without copying it.
+
+    Every array is opened as a read-only memory map, so pages are shared with the
+    other workers through the OS page cache instead of being duplicated per process.
+
+    Parameters:
+    - version_dir (str): Directory returned by `publish_model`.
+    - load_preprocessor (callable): Loads the preprocessor file, like `joblib.load`.
+
+    Returns:
+    - tuple: (model, preprocessor, categories)
+    """
+    model = joblib.load(os.path.join(version_dir, MODEL_FILE), mmap_mode="r")
+    preprocessor = load_preprocessor(os.path.join(version_dir, PREPROCESSOR_FILE), mmap_mode="r")
+    categories = np.load(os.path.join(version_dir, CATEGORIES_FILE))
+    return model, preprocessor, categories
+
+
+def serve(workers=4, host="127.0.0.1", port=8000, out_dir=SHARED_MODEL_DIR):
+    """
+    Publishes the model once and runs the API under uvicorn with `workers` processes
+    that all attach to the shared, memory-mapped artifacts.
+    """
+    version_dir = publish_model(out_dir=out_dir)
+    os.utime(version_dir)
+    prune_published_versions(out_dir)
+    env = dict(os.environ)
+    env[SHARED_MODEL_ENV] = out_dir
+    command = [sys.executable, "-m", "uvicorn", "api:app", "--host", host,
+               "--port", str(port), "--workers", str(workers)]
+    return subprocess.call(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the API from shared, memory-mapped model artifacts.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    sys.exit(serve(workers=args.workers, host=args.host, port=args.port))
@@ -0,0 +1,171 @@
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from common.distance_metrics import DistanceMetric
+from common.indexing_structures import IndexingStructure
+from knn import KNN
+from utils import timeit
+
+# The sub-index owned by the current shard worker process
+_shard_model = None
+
+
+def _init_shard(features, labels, k, metric):
+    global _shard_model
+    _shard_model = KNN.from_data(features, labels, k=k, metric=metric)
+
+
+def _shard_size():
+    return len(_shard_model.training_labels)
+
+
+def _query_shard(testing_points, k, metric, indexing, batch_size):
+    return _shard_model.query_neighbors(testing_points, k=k, metric=metric, indexing=indexing,
+                                        batch_size=batch_size)
+
+
+class ShardedKNN:
+    """
+    Weighted KNN whose training set is partitioned across local worker processes.
+
+    Each worker owns a `KNN` sub-index over its shard. A query is scattered to every
+    shard, each shard returns its local top-k, and the coordinator merges those
+    candidates into the global top-k before the inverse-distance weighted vote.
+    Because every true nearest neighbor is in the top-k of its own shard, the
+    merged result is identical to searching a single index over all points.
+    """
+
+    def __init__(self, n_shards=4, best_k=3):
+        """
+        Initializes the sharded classifier.
+
+        Parameters:
+        - n_shards (int): Number of shard worker processes.
+        - best_k (int): Default number of neighbors to consider during prediction.
+        """
+        self.n_shards = n_shards
+        self.best_k = best_k
+        self.shard_sizes = []
+        self._executors = []
+
+    def fit(self, features, labels, k=3, metric=DistanceMetric.EUCLIDEAN, random_state=42):
+        """
+        Partitions the training set and builds one sub-index per worker process.
+
+        Points are shuffled before splitting so every shard holds a similar class mix.
+        Returns once every worker has started and built its sub-index, so process start-up
+        is part of fitting rather than of the first query.
+
+        Parameters:
+        - features (array-like): A 2D array of shape (n_samples, n_features).
+        - labels (array-like): A 1D array of shape (n_samples,).
+        - k (int): Default number of neighbors.
+        - metric (DistanceMetric): Metric the shards' KD trees are built for.
+        - random_state (int): Seed for the shard assignment.
+        """
+        features = np.asarray(features)
+        labels = np.asarray(labels)
+
+        if features.shape[0] != labels.shape[0]:
+            raise ValueError(f"Number of feature vectors ({features.shape[0]}) "
+                             f"does not match number of labels ({labels.shape[0]}).")
+        if self.n_shards < 1 or self.n_shards > len(features):
+            raise ValueError(f"n_shards must be between 1 and {len(features)}, got {self.n_shards}.")
+
+        self.close()
+        self.best_k = k
+
+        order = np.random.default_rng(random_state).permutation(len(features))
+        self.shard_sizes = []
+        for shard_indices in np.array_split(order, self.n_shards):
+            executor = ProcessPoolExecutor(
+                max_workers=1,
+                initializer=_init_shard,
+                initargs=(features[shard_indices], labels[shard_indices], k, metric),
+            )
+            self._executors.append(executor)
+            self.shard_sizes.append(len(shard_indices))
+
+        # A pool only starts its worker on the first submitted task; the shards start in parallel
+        futures = [executor.submit(_shard_size) for executor in self._executors]
+        for future in futures:
+            future.result()
+
+    def query_neighbors(self, testing_points, k=None, metric=DistanceMetric.EUCLIDEAN,
+                        indexing=IndexingStructure.KD_TREE, batch_size=100):
+        """
+        Scatters the queries to all shards and merges their local top-k lists.
+
+        Returns:
+        - tuple: (dists, labels), both of shape (n_samples, k), sorted by ascending distance.
+        """
+        if not self._executors:
+            raise RuntimeError("ShardedKNN must be fitted before querying.")
+        if k is None:
+            k = self.best_k
+
+        testing_points = np.atleast_2d(np.asarray(testing_points))
+        futures = [
+            executor.submit(_query_shard, testing_points, k, metric, indexing, batch_size)
+            for executor in self._executors
+        ]
+        results = [future.result() for future in futures]
+
+        dists = np.concatenate([shard_dists for shard_dists, _ in results], axis=1)
+        labels = np.concatenate([shard_labels for _, shard_labels in results], axis=1)
+
+        order = np.argsort(dists, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(dists, order, axis=1), np.take_along_axis(labels, order, axis=1)
+
+    def adaptive_prediction(self, test_point, k=5, metric=DistanceMetric.EUCLIDEAN, indexing=IndexingStructure.KD_TREE):
+        """
+        Predicts the label of a single query, mirroring `KNN.adaptive_prediction`.
+        """
+        dists, labels = self.query_neighbors(test_point, k=k, metric=metric, indexing=indexing)
+        return KNN.weighted_vote(dists[0], labels[0])
+
+    @timeit
+    def adaptive_prediction_batch(self, testing_points, k=5, metric=DistanceMetric.EUCLIDEAN,
+                                  indexing=IndexingStructure.KD_TREE, batch_size=100):
+        """
+        Predicts labels for a batch of queries. Each batch is sent to the shards as a
+        single message, so the inter-process overhead is paid once per batch.
+
+        Returns:
+        - np.ndarray: Predicted labels for each test point in the input array.
+        """
+        testing_points = np.asarray(testing_points)
+        predictions = []
+
+        for start in range(0, len(testing_points), batch_size):
+            batch = testing_points[start:start + batch_size]
+            dists, labels = self.query_neighbors(batch, k=k, metric=metric, indexing=indexing,
+                                                 batch_size=batch_size)
+            predictions.extend(KNN.weighted_vote(d, l) for d, l in zip(dists, labels))
+
+        return np.array(predictions)
+
+    def close(self):
+        """
+        Shuts down the shard worker processes.
+        """
+        for executor in self._executors:
+            executor.shutdown(wait=True)
+        self._executors = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @classmethod
+    def from_data(cls, features, labels, k=3, metric=DistanceMetric.EUCLIDEAN, n_shards=4):
+        """
+        Factory method to create and fit a ShardedKNN instance.
+
+        Returns:
+        - ShardedKNN: A fitted instance with running shard workers.
+        """
+        instance = cls(n_shards=n_shards, best_k=k)
+        instance.fit(features, labels, k=k, metric=metric)
+        return instance
@@ -0,0 +1,99 @@
+import numpy as np
+
+# Default tolerance of `simplify_strokes`, in pixels of the rendered raster
+SIMPLIFY_TOLERANCE = 0.5
+
+
+def _segment_distances(points, starts, ends):
+    """
+    Distance of every point to the segment between the start and end on the same row.
+    """
+    direction = ends - starts
+    length_sq = np.einsum("ij,ij->i", direction, direction)
+    t = np.einsum("ij,ij->i", points - starts, direction) / np.where(length_sq > 0, length_sq, 1)
+    closest = starts + np.clip(t, 0, 1)[:, np.newaxis] * direction
+    return np.hypot(*(points - closest).T)
+
+
+def simplify_strokes(strokes, size=56, padding=10, tolerance=SIMPLIFY_TOLERANCE):
+    """
+    Drops the points of a drawing that a size x size raster cannot show.
+
+    The tolerance is converted from raster pixels to drawing units with the scale
+    `draw_image` uses for these strokes. Two vectorized passes then run over all strokes
+    at once, each moving the stroke centerlines by at most half the tolerance:
+
+    - Resampling: of consecutive points in the same grid cell only the first is kept.
+      The cell diagonal is half the tolerance.
+    - Ramer-Douglas-Peucker: segments are split at their farthest point until every
+      dropped point lies within half the tolerance of its segment. All segments are
+      refined together, one level per iteration.
+
+    Stroke endpoints and the points on the bounding box are always kept, so the drawing
+    is scaled and positioned exactly as before. Every point of the simplified strokes is
+    within `tolerance` pixels of the original strokes, and the other way round.
+
+    Parameters:
+    - strokes (list): (xs, ys) pairs, as lists or NumPy arrays.
+    - size (int): Width and height of the raster the strokes will be rendered to.
+    - padding (float): The `draw_image` padding, in percent.
+    - tolerance (float): Maximum displacement of the strokes, in raster pixels.
+
+    Returns:
+    - list: (xs, ys) float64 array pairs, accepted by `draw_image`.
+    """
+    xs = [np.asarray(stroke[0], dtype=np.float64) for stroke in strokes]
+    ys = [np.asarray(stroke[1], dtype=np.float64) for stroke in strokes]
+    lengths = np.array([len(x) for x in xs], dtype=np.intp)
+    if not lengths.sum():
+        return list(zip(xs, ys))
+
+    points = np.column_stack([np.concatenate(xs), np.concatenate(ys)])
+    extent = np.ptp(points, axis=0).max()
+    if extent == 0:
+        return list(zip(xs, ys))
+    # Drawing units per raster pixel, as in draw_image
+    pixel = extent * (1 + 2 * padding / 100) / size
+
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    present = lengths > 0
+    forced = np.zeros(len(points), dtype=bool)
+    forced[starts[present]] = True
+    forced[ends[present] - 1] = True
+    forced[np.argmin(points, axis=0)] = True
+    forced[np.argmax(points, axis=0)] = True
+
+    # Resampling: every dropped point is within a cell diagonal of the last kept point
+    cells = np.floor(points / (tolerance * pixel / (2 * np.sqrt(2))))
+    candidates = forced.copy()
+    candidates[1:] |= np.any(cells[1:] != cells[:-1], axis=1)
+    candidates = np.flatnonzero(candidates)
+
+    # Ramer-Douglas-Peucker over the remaining points. Stroke endpoints are anchors, so
+    # no segment spans two strokes.
+    remaining = points[candidates]
+    kept = forced[candidates]
+    epsilon = tolerance * pixel / 2
+    while True:
+        anchors = np.flatnonzero(kept)
+        interior = np.flatnonzero(~kept)
+        if not len(interior):
+            break
+        segment = np.searchsorted(anchors, interior) - 1
+        dists = _segment_distances(remaining[interior], remaining[anchors[segment]], remaining[anchors[segment + 1]])
+
+        # The farthest point of every segment
+        order = np.lexsort((-dists, segment))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = segment[order][1:] != segment[order][:-1]
+        farthest = order[first]
+        split = farthest[dists[farthest] > epsilon]
+        if not len(split):
+            break
+        kept[interior[split]] = True
+
+    selected = candidates[kept]
+    bounds = np.searchsorted(selected, np.concatenate([[0], ends]))
+    return [(points[selected[start:end], 0], points[selected[start:end], 1])
+            for start, end in zip(bounds[:-1], bounds[1:])]
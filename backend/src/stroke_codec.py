@@ -0,0 +1,86 @@
+import base64
+import binascii
+import struct
+
+import numpy as np
+
+# Content type of the binary `/predict/binary` payload, raw or base64 encoded
+STROKES_CONTENT_TYPE = "application/x-quickdraw-strokes"
+
+# Little-endian layout:
+#   "QDS" + format version (4 bytes), number of strokes and number of points (uint32 each),
+#   the end offset of every stroke in points (uint32 each), then (dx, dy) int16 pairs: the
+#   first point relative to (0, 0) and every other one relative to the point before it,
+#   across stroke boundaries.
+MAGIC = b"QDS\x01"
+_HEADER = struct.Struct("<4sII")
+
+
+def encode_strokes(strokes):
+    """
+    Encodes strokes into the binary payload. Coordinates are rounded to integers.
+
+    Parameters:
+    - strokes (list): (xs, ys) pairs, as in the QuickDraw "drawing" field or the JSON format.
+
+    Returns:
+    - bytes: The payload.
+
+    Raises:
+    - ValueError: If two consecutive points are more than 32767 apart on an axis.
+    """
+    xs = [np.rint(np.asarray(stroke[0], dtype=np.float64)).astype(np.int64) for stroke in strokes]
+    ys = [np.rint(np.asarray(stroke[1], dtype=np.float64)).astype(np.int64) for stroke in strokes]
+    ends = np.cumsum([len(x) for x in xs], dtype=np.uint32)
+
+    points = np.empty((int(ends[-1]) if len(ends) else 0, 2), dtype=np.int64)
+    if len(points):
+        points[:, 0] = np.concatenate(xs)
+        points[:, 1] = np.concatenate(ys)
+    deltas = np.diff(points, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    if len(deltas) and np.abs(deltas).max() > np.iinfo(np.int16).max:
+        raise ValueError("Consecutive points are too far apart for int16 deltas.")
+
+    return b"".join([
+        _HEADER.pack(MAGIC, len(ends), len(points)),
+        ends.astype("<u4").tobytes(),
+        deltas.astype("<i2").tobytes(),
+    ])
+
+
+def decode_strokes(payload):
+    """
+    Decodes a binary payload into strokes without building Python lists of coordinates.
+
+    Parameters:
+    - payload (bytes): The payload, raw or base64 encoded.
+
+    Returns:
+    - list: (xs, ys) float64 array pairs, views of one point array, accepted by `draw_image`.
+
+    Raises:
+    - ValueError: If the payload is malformed.
+    """
+    if not payload.startswith(MAGIC):
+        try:
+            payload = base64.b64decode(payload, validate=True)
+        except binascii.Error:
+            raise ValueError("Stroke payload is neither binary nor base64 encoded.")
+    if len(payload) < _HEADER.size:
+        raise ValueError("Stroke payload is truncated.")
+
+    magic, n_strokes, n_points = _HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError("Unsupported stroke payload format.")
+    if len(payload) != _HEADER.size + 4 * n_strokes + 4 * n_points:
+        raise ValueError(f"Stroke payload of {len(payload)} bytes does not hold "
+                         f"{n_strokes} strokes and {n_points} points.")
+
+    ends = np.frombuffer(payload, dtype="<u4", count=n_strokes, offset=_HEADER.size).astype(np.intp)
+    starts = np.concatenate([[0], ends[:-1]])
+    if np.any(ends < starts) or (n_strokes and ends[-1] != n_points):
+        raise ValueError("Stroke offsets are not consistent with the number of points.")
+
+    deltas = np.frombuffer(payload, dtype="<i2", count=2 * n_points, offset=_HEADER.size + 4 * n_strokes)
+    points = np.cumsum(deltas.reshape(-1, 2), axis=0, dtype=np.float64)
+    return [(points[start:end, 0], points[start:end, 1]) for start, end in zip(starts, ends)]
@@ -0,0 +1,272 @@
+import argparse
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+from common.access_pattern import AccessPattern
+from common.distance_metrics import DistanceMetric
+from common.indexing_structures import IndexingStructure
+from config import CACHE_DIR
+from kernels import numba_available
+from knn import DEFAULT_BATCH_SIZE, KNN
+
+TUNING_PROFILE_FILE = "tuning_profile.json"
+# A profile applies to models whose training set is at most this much larger or smaller
+# than the one it was tuned on
+TRAINING_SIZE_TOLERANCE = 0.1
+
+# Batch predictor of every structure the tuner tries; all of them return exact neighbors
+# except CASCADE, which has to clear the accuracy floor
+PREDICTORS = {
+    IndexingStructure.KD_TREE: lambda model, X, b: model.predict_with_kd_tree_weighted_batch(X, batch_size=b),
+    IndexingStructure.BALL_TREE: lambda model, X, b: model.predict_with_ball_tree_weighted_batch(X, batch_size=b),
+    IndexingStructure.BRUTE_FORCE: lambda model, X, b: model.predict_weighted_batch(X, batch_size=b),
+    IndexingStructure.BRUTE_FORCE_FUSED: lambda model, X, b: model.predict_weighted_fused_batch(X),
+    IndexingStructure.CASCADE: lambda model, X, b: model.predict_cascade_batch(X, batch_size=b),
+    IndexingStructure.PIVOT: lambda model, X, b: model.predict_with_pivot_index_batch(X, batch_size=b),
+}
+TREE_INDEXINGS = (IndexingStructure.KD_TREE, IndexingStructure.BALL_TREE)
+
+
+def _predict_one(model, indexing, query, k):
+    # The search and vote of `adaptive_prediction`, without its timing printout
+    if indexing == IndexingStructure.BRUTE_FORCE_FUSED:
+        return model.predict_weighted_fused_batch(query, k=k)[0]
+    dists, labels = model.query_neighbors(query, k=k, indexing=indexing)
+    return model.weighted_vote(dists[0], labels[0])
+
+
+def _run_trial(model, indexing, queries, labels, batch_size, k, n_single):
+    # The first calls build lazily created state and are not timed
+    PREDICTORS[indexing](model, queries[:1], batch_size)
+    _predict_one(model, indexing, queries[0], k)
+
+    start = time.perf_counter()
+    predicted = PREDICTORS[indexing](model, queries, batch_size)
+    seconds = time.perf_counter() - start
+
+    single_seconds = []
+    for query in queries[:n_single]:
+        start = time.perf_counter()
+        _predict_one(model, indexing, query, k)
+        single_seconds.append(time.perf_counter() - start)
+
+    return {
+        "indexing": indexing.value,
+        "leaf_size": model.leaf_size,
+        "batch_size": batch_size,
+        "accuracy": float(np.mean(predicted == labels)),
+        "queries_per_second": len(queries) / seconds,
+        "single_ms": float(np.median(single_seconds) * 1000),
+    }
+
+
+def auto_tune(X, y, k=5, access_pattern=AccessPattern.SINGLE, sample_size=None, n_queries=1000, n_single_queries=200,
+              accuracy_tolerance=0.005, min_accuracy=None, leaf_sizes=(10, 20, 40, 80),
+              batch_sizes=(10, 25, 50, 100, 200), thread_counts=None, max_batch_bytes=512 * 1024 ** 2,
+              random_state=42):
+    """
+    Picks the fastest search configuration for this machine and training set by timing
+    predictions of held-out training points on models fitted on the rest.
+
+    Which structure is fastest depends on the training set size and on whether queries
+    arrive one at a time or in batches, so trials use the whole training set by default
+    and are ranked by `access_pattern`: median single-query latency, as /predict serves
+    queries, or batch throughput. The profile records the training set size and metric it
+    was tuned for; `profile_mismatch` tells whether it fits a given model.
+
+    The search runs in three stages, each keeping the winner of the previous one: the
+    index structure and tree leaf size, then the batch size (ranked by throughput, since
+    only batch predictions use it), then the thread count. Only configurations that reach
+    the accuracy floor are eligible.
+
+    Parameters:
+    - X (np.ndarray): Training features of shape (n_samples, n_features).
+    - y (np.ndarray): Training labels of shape (n_samples,).
+    - k (int): Number of neighbors.
+    - access_pattern (AccessPattern): What the structure and thread count are ranked by.
+    - sample_size (int, optional): Number of training points the trial models are fitted on.
+      Defaults to all of them except the held-out queries. A profile tuned on a sample
+      does not apply to models trained on the full set.
+    - n_queries (int): Number of held-out points every trial predicts in one batch.
+    - n_single_queries (int): Number of those points also timed one at a time.
+    - accuracy_tolerance (float): How far below the exact KD tree's accuracy a configuration may be.
+    - min_accuracy (float, optional): Absolute accuracy floor; overrides accuracy_tolerance.
+    - leaf_sizes (tuple): Tree leaf sizes to try.
+    - batch_sizes (tuple): Batch sizes to try.
+    - thread_counts (tuple, optional): Thread counts to try. Defaults to 1, half and all cores.
+    - max_batch_bytes (int): Brute-force batch sizes whose distance arrays would exceed this are skipped.
+    - random_state (int): Seed for the sample.
+
+    Returns:
+    - dict: The tuning profile.
+    """
+    access_pattern = AccessPattern(access_pattern)
+    X = np.asarray(X)
+    y = np.asarray(y)
+    order = np.random.default_rng(random_state).permutation(len(X))
+    n_queries = min(n_queries, len(X) // 5)
+    query_rows = order[:n_queries]
+    train_rows = order[n_queries:] if sample_size is None else order[n_queries:n_queries + sample_size]
+    X_train, y_train = X[train_rows], y[train_rows]
+    queries, labels = X[query_rows], y[query_rows]
+    n_single = min(n_single_queries, n_queries)
+
+    if thread_counts is None:
+        cores = os.cpu_count() or 1
+        thread_counts = sorted({1, max(1, cores // 2), cores})
+
+    trials = []
+    models = {}
+    for leaf_size in leaf_sizes:
+        models[leaf_size] = KNN(best_k=k, leaf_size=leaf_size)
+        models[leaf_size].fit(X_train, y_train, k=k)
+
+    # Stage 1: index structure and leaf size
+    for indexing in PREDICTORS:
+        for leaf_size in (leaf_sizes if indexing in TREE_INDEXINGS else leaf_sizes[:1]):
+            if indexing == IndexingStructure.BRUTE_FORCE_FUSED and not numba_available():
+                continue
+            trials.append({**_run_trial(models[leaf_size], indexing, queries, labels, DEFAULT_BATCH_SIZE, k, n_single),
+                           "stage": "indexing"})
+
+    exact = [t for t in trials if t["indexing"] == IndexingStructure.KD_TREE.value]
+    baseline = max(t["accuracy"] for t in exact)
+    floor = min_accuracy if min_accuracy is not None else baseline - accuracy_tolerance
+
+    def fastest(candidates, pattern=access_pattern):
+        eligible = [t for t in candidates if t["accuracy"] >= floor]
+        if not eligible:
+            raise ValueError(f"No configuration reached the accuracy floor of {floor:.4f}.")
+        if pattern == AccessPattern.SINGLE:
+            return min(eligible, key=lambda t: t["single_ms"])
+        return max(eligible, key=lambda t: t["queries_per_second"])
+
+    best = fastest(trials)
+    indexing = IndexingStructure(best["indexing"])
+    model = models[best["leaf_size"]]
+
+    # Stage 2: batch size; the fused kernel blocks its queries itself
+    if indexing != IndexingStructure.BRUTE_FORCE_FUSED:
+        bytes_per_query = len(X_train) * (X_train.shape[1] + 1) * X_train.itemsize
+        for batch_size in batch_sizes:
+            if indexing == IndexingStructure.BRUTE_FORCE and batch_size * bytes_per_query > max_batch_bytes:
+                continue
+            trials.append({**_run_trial(model, indexing, queries, labels, batch_size, k, n_single),
+                           "stage": "batch_size"})
+        best = fastest([t for t in trials if t["stage"] == "batch_size"] or [best], AccessPattern.BATCH)
+
+    # Stage 3: threads for the BLAS libraries and the Numba kernel
+    for threads in thread_counts:
+        model.threads = threads
+        trials.append({**_run_trial(model, indexing, queries, labels, best["batch_size"], k, n_single),
+                       "stage": "threads", "threads": threads})
+    model.threads = None
+    best = fastest([t for t in trials if t["stage"] == "threads"])
+
+    return {
+        "indexing": best["indexing"],
+        "leaf_size": best["leaf_size"],
+        "batch_size": best["batch_size"],
+        "threads": best["threads"],
+        "accuracy": best["accuracy"],
+        "queries_per_second": best["queries_per_second"],
+        "single_ms": best["single_ms"],
+        "accuracy_floor": floor,
+        "baseline_accuracy": baseline,
+        "access_pattern": access_pattern.value,
+        "k": k,
+        # Size of the training data the trials were drawn from, the trial models' plus the queries
+        "n_train": len(train_rows) + len(query_rows),
+        "n_features": X_train.shape[1],
+        "metric": DistanceMetric.EUCLIDEAN.value,
+        "machine": {"cpu_count": os.cpu_count(), "processor": platform.processor(), "platform": platform.platform()},
+        "created": time.time(),
+        "trials": trials,
+    }
+
+
+def profile_mismatch(profile, model, access_pattern=AccessPattern.SINGLE):
+    """
+    Checks whether a tuning profile was tuned for a model like this one: the same metric,
+    number of features and access pattern, and a training set of about the same size.
+
+    Returns:
+    - str or None: Why the profile does not fit the model, or None if it can be applied.
+    """
+    # Profiles written before the access pattern was recorded were ranked by batch throughput
+    tuned_pattern = profile.get("access_pattern", AccessPattern.BATCH.value)
+    if tuned_pattern != AccessPattern(access_pattern).value:
+        return f"tuned for {tuned_pattern} queries, not {AccessPattern(access_pattern).value} ones"
+    metric = profile.get("metric", DistanceMetric.EUCLIDEAN.value)
+    if metric != DistanceMetric(model.metric).value:
+        return f"tuned for the {metric} metric, the model uses {DistanceMetric(model.metric).value}"
+    n_train, n_features = model.training_features.shape
+    if profile.get("n_features") != n_features:
+        return f"tuned for {profile.get('n_features')} features, the model has {n_features}"
+    if abs(profile.get("n_train", 0) - n_train) > TRAINING_SIZE_TOLERANCE * n_train:
+        return f"tuned on {profile.get('n_train')} training points, the model has {n_train}"
+    if profile.get("indexing") == IndexingStructure.KD_TREE.value and model.kd_tree is None:
+        return "tuned for the KD tree, which the model does not have"
+    return None
+
+
+def save_tuning_profile(profile, cache_dir=CACHE_DIR):
+    """
+    Writes a tuning profile next to the model, replacing the previous one atomically.
+
+    Returns:
+    - str: Path of the profile.
+    """
+    path = os.path.join(cache_dir, TUNING_PROFILE_FILE)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(profile, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_tuning_profile(cache_dir=CACHE_DIR):
+    """
+    Returns:
+    - dict or None: The tuning profile in cache_dir, or None if none was written.
+    """
+    path = os.path.join(cache_dir, TUNING_PROFILE_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time search configurations on the training set and save the fastest.")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--access-pattern", choices=[pattern.value for pattern in AccessPattern],
+                        default=AccessPattern.SINGLE.value,
+                        help="rank by single-query latency (as /predict serves) or batch throughput")
+    parser.add_argument("--sample-size", type=int, default=None,
+                        help="fit the trial models on a sample; the API ignores profiles tuned on a much smaller set")
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--accuracy-tolerance", type=float, default=0.005)
+    parser.add_argument("--min-accuracy", type=float, default=None)
+    args = parser.parse_args()
+
+    X_train = np.load(os.path.join(CACHE_DIR, "X_train.npy"))
+    y_train = np.load(os.path.join(CACHE_DIR, "y_train.npy"))
+    profile = auto_tune(X_train, y_train, k=args.k, access_pattern=args.access_pattern, sample_size=args.sample_size,
+                        n_queries=args.queries, accuracy_tolerance=args.accuracy_tolerance,
+                        min_accuracy=args.min_accuracy)
+
+    print(f"{'stage':<10} {'indexing':<18} {'leaf':>5} {'batch':>6} {'threads':>7} {'accuracy':>9} {'q/s':>9} {'single ms':>10}")
+    for trial in profile["trials"]:
+        print(f"{trial['stage']:<10} {trial['indexing']:<18} {trial['leaf_size']:>5} {trial['batch_size']:>6} "
+              f"{trial.get('threads', '-'):>7} {trial['accuracy']:>9.4f} {trial['queries_per_second']:>9.0f} "
+              f"{trial['single_ms']:>10.3f}")
+    print(f"Selected {profile['indexing']} for {profile['access_pattern']} queries on {profile['n_train']} training points "
+          f"(leaf size {profile['leaf_size']}, batch size {profile['batch_size']}, {profile['threads']} threads): "
+          f"{profile['single_ms']:.3f} ms per query, {profile['queries_per_second']:.0f} q/s in batches, "
+          f"accuracy {profile['accuracy']:.4f} (floor {profile['accuracy_floor']:.4f}).")
+    print(f"Profile saved to: {save_tuning_profile(profile)}")
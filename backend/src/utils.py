@@ -1,8 +1,8 @@
 import json
 import numpy as np
-import matplotlib.pyplot as plt
 from matplotlib.figure import Figure
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
+from simplify import SIMPLIFY_TOLERANCE, simplify_strokes
 import os
 
 import time
@@ -30,16 +30,19 @@ def create_dataset(datasets_dict, samples_per_class=1000):
     - X (np.ndarray): Array of flattened grayscale images.
     - y (np.ndarray): Array of corresponding labels.
     """
-    X = []
+    # Preallocated, so the images are not held twice while a list is converted to an array
+    n_samples = sum(len(drawings[:samples_per_class]) for drawings in datasets_dict.values())
+    X = np.empty((n_samples, 56 * 56))
     y = []
-    
+
+    row = 0
     for i, (label, drawings) in enumerate(datasets_dict.items()):
         for item in drawings[:samples_per_class]:
-            img = draw_image(item["drawing"], size=56)
-            X.append(img.flatten())  # Flatten image to 1D array
+            X[row] = draw_image(item["drawing"], size=56, tolerance=SIMPLIFY_TOLERANCE).ravel()
             y.append(label)
+            row += 1
         print(f"Done with dataset #{i+1}")
-    return np.array(X), np.array(y)
+    return X, np.array(y)
 
 def get_data(filename, max_items):
     """
@@ -67,15 +70,17 @@ def get_data(filename, max_items):
     return data
 
 
-def draw_image(strokes, size=56, padding=10):
+def draw_image(strokes, size=56, padding=10, tolerance=None):
     """
     Renders strokes into a centered, proportionally scaled grayscale image.
     Keeps aspect ratio and uses matplotlib for anti-aliasing.
 
     Parameters:
-        strokes: list of (xs, ys) pairs
+        strokes: list of (xs, ys) pairs, as lists or NumPy arrays (see `stroke_codec.py`)
         size: final image size in pixels
         padding: percentage (0–50) of space around the drawing
+        tolerance: if set, strokes are first simplified with `simplify_strokes`, moving them
+            by at most this many pixels
 
     Returns:
         np.ndarray of shape (size, size) with values in [0, 1]
@@ -84,16 +89,21 @@ def draw_image(strokes, size=56, padding=10):
     canvas = FigureCanvas(fig)
     ax = fig.add_axes([0, 0, 1, 1])  # no margins
 
+    if tolerance is not None:
+        strokes = simplify_strokes(strokes, size=size, padding=padding, tolerance=tolerance)
+
     # Flatten all points
-    all_x = [x for stroke in strokes for x in stroke[0]]
-    all_y = [y for stroke in strokes for y in stroke[1]]
-    
-    if not all_x or not all_y:
+    xs = [np.asarray(stroke[0], dtype=np.float64) for stroke in strokes]
+    ys = [np.asarray(stroke[1], dtype=np.float64) for stroke in strokes]
+    all_x = np.concatenate(xs) if xs else np.empty(0)
+    all_y = np.concatenate(ys) if ys else np.empty(0)
+
+    if not all_x.size or not all_y.size:
         return np.ones((size, size), dtype=np.float32)
 
     # Bounding box
-    min_x, max_x = min(all_x), max(all_x)
-    min_y, max_y = min(all_y), max(all_y)
+    min_x, max_x = all_x.min(), all_x.max()
+    min_y, max_y = all_y.min(), all_y.max()
     width = max_x - min_x
     height = max_y - min_y
 
@@ -110,7 +120,7 @@ def draw_image(strokes, size=56, padding=10):
     ax.invert_yaxis()
     ax.axis('off')
 
-    for x, y in strokes:
+    for x, y in zip(xs, ys):
         ax.plot(x, y, color='black', linewidth=3)
 
     canvas.draw()
@@ -127,6 +137,9 @@ def display_vector_drawing(strokes):
     Parameters:
     - strokes (list): List of stroke coordinate pairs [[x_points], [y_points], ...].
     """
+    # pyplot is only needed for interactive display, keep it out of the import path of the API
+    import matplotlib.pyplot as plt
+
     plt.figure(figsize=(3, 3))
     for x, y in strokes:
         plt.plot(x, y, color='black', linewidth=3)
@@ -143,6 +156,8 @@ def display_pixel_drawing(image):
     Parameters:
     - image (list): A Matrix of pixels with values ranging from 0 -> 1.
     """   
+    import matplotlib.pyplot as plt
+
     plt.imshow(image, cmap='gray')
     plt.title("Input Drawing")
     plt.axis('off')
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+SRC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, SRC_DIR)
+
+# The API is imported once per session; keep it from polling the cache and timing searches
+os.environ.setdefault("QUICKDRAW_WATCH_MODEL", "0")
+os.environ.setdefault("QUICKDRAW_CALIBRATE_LATENCY", "0")
+
+
+@pytest.fixture(scope="session")
+def api():
+    """
+    The `api` module, serving the trained model in the cache directory. Skips the test
+    if `main.py` has not been run yet.
+    """
+    from config import CACHE_DIR
+
+    if not all(os.path.exists(os.path.join(CACHE_DIR, name))
+               for name in ("knn_model.pkl", "preprocessor.pkl", "categories.npy")):
+        pytest.skip("No trained model in the cache directory; run main.py first.")
+    import api
+    return api
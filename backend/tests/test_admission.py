@@ -0,0 +1,48 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi.testclient import TestClient
+
+from admission import AdmissionController
+
+STROKES = [[[10, 40, 80], [20, 60, 30]]]
+
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out waiting for the server."
+        time.sleep(0.01)
+
+
+def test_full_queue_is_rejected_with_503(api, monkeypatch):
+    admission = AdmissionController(max_concurrency=1, max_queue=1)
+    monkeypatch.setattr(api, "admission", admission)
+
+    release = threading.Event()
+
+    def slow_predict(strokes, req, start):
+        release.wait(10)
+        return {"prediction": "house", "strategy": {}}
+
+    monkeypatch.setattr(api, "_predict", slow_predict)
+
+    with TestClient(api.app) as client, ThreadPoolExecutor(2) as executor:
+        try:
+            running = executor.submit(client.post, "/predict", json={"strokes": STROKES})
+            wait_for(lambda: admission.running == 1)
+            queued = executor.submit(client.post, "/predict", json={"strokes": STROKES})
+            wait_for(lambda: admission.waiting == 1)
+
+            rejected = client.post("/predict", json={"strokes": STROKES})
+            assert rejected.status_code == 503
+            assert admission.metrics()["rejected"] == 1
+        finally:
+            release.set()
+
+        assert running.result().status_code == 200
+        assert queued.result().status_code == 200
+        assert queued.result().json()["strategy"]["queue_ms"] > 0
+    assert admission.running == admission.waiting == 0
+
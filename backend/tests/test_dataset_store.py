@@ -0,0 +1,44 @@
+import numpy as np
+
+from dataset_store import RenderedDatasetStore
+from preprocessor import Preprocessor
+
+
+def drawings(n, offset=0):
+    return [{"drawing": [[[0, 50 + i + offset, 100], [0, 100 - i, 30 + offset]]]} for i in range(n)]
+
+
+def test_views_of_earlier_builds_survive_changed_drawings(tmp_path):
+    store = RenderedDatasetStore(root=str(tmp_path), size=16, chunk_size=4)
+    store.build("cat", drawings(6), 6)
+    old_view = store.dataset(["cat"])
+    old_rows = np.array(old_view.images()[0])
+
+    # The last three drawings change, so those rows are rendered again
+    store.build("cat", drawings(3) + drawings(3, offset=200)[:3], 6)
+    new_view = store.dataset(["cat"])
+    assert new_view.parts[0][1] != old_view.parts[0][1]
+    np.testing.assert_array_equal(old_view.images()[0], old_rows)
+    np.testing.assert_array_equal(new_view.images()[0][:3], old_rows[:3])
+    assert not np.array_equal(new_view.images()[0][3:], old_rows[3:])
+
+    # Growing the set keeps the rows and the file views point at
+    store.build("cat", drawings(3) + drawings(3, offset=200)[:3] + drawings(2, offset=400), 8)
+    assert store.dataset(["cat"]).parts[0][1] == new_view.parts[0][1]
+    np.testing.assert_array_equal(store.dataset(["cat"]).images()[0][:6], new_view.images()[0])
+
+
+def test_preprocessor_streams_datasets_like_arrays(tmp_path):
+    store = RenderedDatasetStore(root=str(tmp_path), size=16, chunk_size=4)
+    store.build("cat", drawings(10), 10)
+    store.build("dog", drawings(10, offset=100), 10)
+    dataset = store.dataset(["cat", "dog"])
+
+    streamed = Preprocessor(n_components=4, chunk_size=3).fit_transform(dataset)
+    X, _ = dataset.to_arrays()
+    in_memory = Preprocessor(n_components=4, chunk_size=3).fit_transform(X)
+    np.testing.assert_allclose(streamed, in_memory, atol=1e-8)
+
+    batches = list(dataset.iter_batches(batch_size=4, dtype=None))
+    assert all(batch.dtype == np.uint8 for batch, _ in batches)
+    assert sum(len(batch) for batch, _ in batches) == len(dataset)
@@ -0,0 +1,58 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from config import CACHE_DIR
+from knn import KNN
+from model_registry import ModelRegistry
+
+ARTIFACTS = ("knn_model.pkl", "preprocessor.pkl", "categories.npy")
+
+
+def test_categories_only_in_the_delta_buffer_are_searchable():
+    rng = np.random.default_rng(0)
+    model = KNN.from_data(rng.normal(size=(60, 4)), np.repeat(["a", "b", "c"], 20), k=3)
+    model.add(rng.normal(size=(2, 4)) + 10, ["new", "new"])
+
+    dists, labels = model.category_neighbors(np.full(4, 10.0), ["new"], k=3)
+    assert labels.tolist() == [["new", "new"]]
+
+    dists, labels = model.category_neighbors(np.full(4, 10.0), ["a", "new"], k=3)
+    assert labels[0, :2].tolist() == ["new", "new"] and labels[0, 2] == "a"
+
+    with pytest.raises(ValueError, match="Unknown categories: old"):
+        model.category_neighbors(np.zeros(4), ["a", "old"])
+
+
+@pytest.fixture
+def model_dir(tmp_path):
+    if not all(os.path.exists(os.path.join(CACHE_DIR, name)) for name in ARTIFACTS):
+        pytest.skip("No trained model in the cache directory; run main.py first.")
+    for name in ARTIFACTS:
+        shutil.copy2(os.path.join(CACHE_DIR, name), tmp_path / name)
+    return str(tmp_path)
+
+
+def test_added_drawings_reach_other_workers_and_new_versions(model_dir):
+    # Two registries over one directory stand in for two worker processes
+    first, second = ModelRegistry(cache_dir=model_dir), ModelRegistry(cache_dir=model_dir)
+    first.load()
+    second.load()
+    label = str(first.current.categories[0])
+    strokes = [[[10, 60, 110], [10, 90, 10]]]
+
+    assert first.add_drawing(strokes, label) == 1
+    with pytest.raises(ValueError):
+        first.add_drawing(strokes, "not a category")
+
+    assert second.current.model.delta_size == 0
+    assert second.sync_drawings(second.current) == 1
+    assert second.current.model.delta_size == 1
+
+    # A reloaded version replays the log before it is swapped in
+    assert first.load(force=True)
+    assert first.current.model.delta_size == 1
+    features = first.current.model._snapshot.delta_features
+    np.testing.assert_allclose(features, second.current.model._snapshot.delta_features)
@@ -0,0 +1,90 @@
+import numpy as np
+from fastapi.testclient import TestClient
+
+from simplify import SIMPLIFY_TOLERANCE, simplify_strokes
+from stroke_codec import STROKES_CONTENT_TYPE, encode_strokes
+
+SIZE = 56
+PADDING = 10
+
+
+def canvas_strokes(seed=0, n_strokes=3, n_points=400):
+    """
+    Dense, jittery integer strokes like the ones a canvas records.
+    """
+    rng = np.random.default_rng(seed)
+    strokes = []
+    for _ in range(n_strokes):
+        points = rng.integers(0, 400, size=2) + np.cumsum(rng.integers(-3, 4, size=(n_points, 2)), axis=0)
+        strokes.append((points[:, 0].astype(float), points[:, 1].astype(float)))
+    return strokes
+
+
+def polyline_distance(points, strokes):
+    """
+    Distance of every point to the nearest segment (or single point) of the strokes.
+    """
+    starts = np.concatenate([np.column_stack(stroke)[:max(len(stroke[0]) - 1, 1)] for stroke in strokes])
+    ends = np.concatenate([np.column_stack(stroke)[min(1, len(stroke[0]) - 1):] for stroke in strokes])
+    direction = ends - starts
+    length_sq = np.maximum(np.einsum("ij,ij->i", direction, direction), 1e-12)
+    offsets = points[:, np.newaxis, :] - starts[np.newaxis, :, :]
+    t = np.clip(np.einsum("pij,ij->pi", offsets, direction) / length_sq, 0, 1)
+    closest = starts + t[:, :, np.newaxis] * direction
+    return np.min(np.hypot(*np.moveaxis(points[:, np.newaxis, :] - closest, 2, 0)), axis=1)
+
+
+def pixel_error(original, rendered):
+    """
+    Largest distance between the original and the rendered strokes, in raster pixels.
+    """
+    original_points = np.concatenate([np.column_stack(stroke) for stroke in original])
+    rendered_points = np.concatenate([np.column_stack(stroke) for stroke in rendered])
+    pixel = np.ptp(original_points, axis=0).max() * (1 + 2 * PADDING / 100) / SIZE
+    error = max(polyline_distance(original_points, rendered).max(), polyline_distance(rendered_points, original).max())
+    return error / pixel
+
+
+def rendered_strokes(api, monkeypatch, query, strokes):
+    """
+    Posts strokes to /predict/binary.
+
+    Returns:
+    - tuple: (strokes the server rasterizes, tolerance it simplified them with)
+    """
+    captured = {}
+    draw_image = api.draw_image
+
+    def capture(strokes, size=SIZE, padding=PADDING, tolerance=None):
+        captured["strokes"], captured["tolerance"] = strokes, tolerance
+        if tolerance is not None:
+            captured["strokes"] = simplify_strokes(strokes, size=size, padding=padding, tolerance=tolerance)
+        return draw_image(strokes, size=size, padding=padding, tolerance=tolerance)
+
+    monkeypatch.setattr(api, "draw_image", capture)
+    with TestClient(api.app) as client:
+        response = client.post(f"/predict/binary?{query}", content=encode_strokes(strokes),
+                               headers={"Content-Type": STROKES_CONTENT_TYPE})
+    assert response.status_code == 200
+    return captured["strokes"], captured["tolerance"]
+
+
+def test_client_simplified_strokes_are_not_simplified_again(api, monkeypatch):
+    original = canvas_strokes()
+    # What the frontend's simplifyStrokes sends
+    client = simplify_strokes(original, size=SIZE, padding=PADDING)
+
+    rendered, tolerance = rendered_strokes(api, monkeypatch, "simplified=true", client)
+
+    assert tolerance is None
+    assert pixel_error(original, rendered) <= SIMPLIFY_TOLERANCE
+
+
+def test_raw_strokes_are_simplified_once(api, monkeypatch):
+    original = canvas_strokes(seed=1)
+
+    rendered, tolerance = rendered_strokes(api, monkeypatch, "", original)
+
+    assert tolerance == SIMPLIFY_TOLERANCE
+    assert sum(len(xs) for xs, _ in rendered) < sum(len(xs) for xs, _ in original)
+    assert pixel_error(original, rendered) <= SIMPLIFY_TOLERANCE
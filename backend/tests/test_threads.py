@@ -0,0 +1,27 @@
+import numpy as np
+from threadpoolctl import threadpool_info
+
+from knn import KNN, _thread_limited
+
+
+def blas_threads():
+    return [library["num_threads"] for library in threadpool_info()]
+
+
+def test_tuning_profile_threads_only_apply_during_searches():
+    rng = np.random.default_rng(0)
+    model = KNN.from_data(rng.normal(size=(200, 8)), rng.integers(0, 3, size=200), k=3)
+    before = blas_threads()
+
+    model.apply_tuning_profile({"threads": 1})
+    assert model.threads == 1
+    assert blas_threads() == before
+
+    @_thread_limited
+    def search(model):
+        return blas_threads()
+
+    assert all(threads == 1 for threads in search(model))
+    assert blas_threads() == before
+    model.adaptive_prediction(np.zeros(8), k=3)
+    assert blas_threads() == before
@@ -7,6 +7,8 @@ import { faTrash, faArrowRotateLeft, faPlus } from '@fortawesome/free-solid-svg-
 import SettingsButton from "../components/SettingsButton";
 
 import { useCategoryService } from "../services/categoryService";
+import { encodeStrokes, STROKES_CONTENT_TYPE } from "../services/strokeCodec";
+import { simplifyStrokes } from "../services/strokeSimplify";
 
 import { toast, type ToastReturnType } from "../context/ToastContext";
 import { useCookie } from "../hooks/useCookie";
@@ -117,10 +119,14 @@ useEffect(() => {
     if (!userHasDrawn || !canvasRef.current) return;
     try {
       const strokes = canvasRef.current.getStrokes();
-      const res = await fetch("http://localhost:8000/predict", {
+      // Strokes go simplified and as compact binary; the options are query parameters. The
+      // server renders simplified strokes as they are instead of simplifying them again.
+      const params = new URLSearchParams({ k: String(advancedSettings.k), metric: advancedSettings.distanceMetric, indexing: advancedSettings.indexAlgorithm, simplified: "true" });
+      selectedCategories.filter((cat: string) => realCategories.includes(cat)).forEach((cat: string) => params.append("categories", cat));
+      const res = await fetch(`http://localhost:8000/predict/binary?${params}`, {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ strokes: strokes, k: advancedSettings.k, metric: advancedSettings.distanceMetric, indexing: advancedSettings.indexAlgorithm }),
+        headers: { "Content-Type": STROKES_CONTENT_TYPE },
+        body: encodeStrokes(simplifyStrokes(strokes)),
       });
       const data = await res.json();
       setPrediction(data.prediction);
@@ -0,0 +1,49 @@
+export const STROKES_CONTENT_TYPE = "application/x-quickdraw-strokes";
+
+// "QDS" + format version
+const MAGIC = [0x51, 0x44, 0x53, 0x01];
+const HEADER_BYTES = 12;
+const INT16_MAX = 32767;
+
+/**
+ * Encodes strokes into the binary /predict/binary payload (see backend/src/stroke_codec.py):
+ * a header, the end offset of every stroke and int16 deltas between consecutive points.
+ * Coordinates are rounded to integers.
+ */
+export function encodeStrokes(strokes: [number[], number[]][]): ArrayBuffer {
+  const nPoints = strokes.reduce((total, [xs]) => total + xs.length, 0);
+  const buffer = new ArrayBuffer(HEADER_BYTES + 4 * strokes.length + 4 * nPoints);
+  const view = new DataView(buffer);
+
+  MAGIC.forEach((byte, i) => view.setUint8(i, byte));
+  view.setUint32(4, strokes.length, true);
+  view.setUint32(8, nPoints, true);
+
+  let offset = HEADER_BYTES;
+  let end = 0;
+  for (const [xs] of strokes) {
+    end += xs.length;
+    view.setUint32(offset, end, true);
+    offset += 4;
+  }
+
+  let lastX = 0;
+  let lastY = 0;
+  for (const [xs, ys] of strokes) {
+    for (let i = 0; i < xs.length; i++) {
+      const x = Math.round(xs[i]);
+      const y = Math.round(ys[i]);
+      const dx = x - lastX;
+      const dy = y - lastY;
+      if (Math.abs(dx) > INT16_MAX || Math.abs(dy) > INT16_MAX) {
+        throw new RangeError("Consecutive points are too far apart for int16 deltas.");
+      }
+      view.setInt16(offset, dx, true);
+      view.setInt16(offset + 2, dy, true);
+      offset += 4;
+      lastX = x;
+      lastY = y;
+    }
+  }
+  return buffer;
+}
@@ -0,0 +1,92 @@
+type Strokes = [number[], number[]][];
+
+// Same defaults as backend/src/simplify.py and draw_image
+export const RASTER_SIZE = 56;
+export const RASTER_PADDING = 10;
+export const SIMPLIFY_TOLERANCE = 0.5;
+
+function segmentDistance(px: number, py: number, ax: number, ay: number, bx: number, by: number): number {
+  const dx = bx - ax;
+  const dy = by - ay;
+  const lengthSq = dx * dx + dy * dy;
+  const t = lengthSq > 0 ? Math.min(1, Math.max(0, ((px - ax) * dx + (py - ay) * dy) / lengthSq)) : 0;
+  return Math.hypot(px - (ax + t * dx), py - (ay + t * dy));
+}
+
+/**
+ * Drops the points the server's raster cannot show before upload, mirroring
+ * `simplify_strokes` in backend/src/simplify.py. Grid resampling and Ramer-Douglas-Peucker
+ * each move the strokes by at most half the tolerance (in raster pixels). Stroke endpoints
+ * and the points on the bounding box are kept, so the server scales the drawing the same way.
+ */
+export function simplifyStrokes(
+  strokes: Strokes,
+  size = RASTER_SIZE,
+  padding = RASTER_PADDING,
+  tolerance = SIMPLIFY_TOLERANCE
+): Strokes {
+  const allX = strokes.flatMap(([xs]) => xs);
+  const allY = strokes.flatMap(([, ys]) => ys);
+  if (allX.length === 0) return strokes;
+
+  // The first point on each side of the bounding box, as np.argmin/np.argmax pick them.
+  // A loop rather than Math.min(...allX), which overflows the call stack on long drawings.
+  let [minXAt, maxXAt, minYAt, maxYAt] = [0, 0, 0, 0];
+  for (let i = 1; i < allX.length; i++) {
+    if (allX[i] < allX[minXAt]) minXAt = i;
+    if (allX[i] > allX[maxXAt]) maxXAt = i;
+    if (allY[i] < allY[minYAt]) minYAt = i;
+    if (allY[i] > allY[maxYAt]) maxYAt = i;
+  }
+  const extent = Math.max(allX[maxXAt] - allX[minXAt], allY[maxYAt] - allY[minYAt]);
+  if (extent === 0) return strokes;
+  const boxPoints = new Set([minXAt, maxXAt, minYAt, maxYAt]);
+
+  // Drawing units per raster pixel, as in draw_image
+  const pixel = (extent * (1 + (2 * padding) / 100)) / size;
+  const cellSize = (tolerance * pixel) / (2 * Math.SQRT2);
+  const epsilon = (tolerance * pixel) / 2;
+
+  let offset = 0;
+  let previousCell: string | null = null;
+  return strokes.map(([xs, ys]) => {
+    const n = xs.length;
+    const forced = (i: number) => i === 0 || i === n - 1 || boxPoints.has(offset + i);
+
+    // Resampling: of consecutive points in the same grid cell only the first is kept
+    const candidates: number[] = [];
+    for (let i = 0; i < n; i++) {
+      const cell = `${Math.floor(xs[i] / cellSize)},${Math.floor(ys[i] / cellSize)}`;
+      if (forced(i) || cell !== previousCell) candidates.push(i);
+      previousCell = cell;
+    }
+
+    // Ramer-Douglas-Peucker between the forced points
+    const kept = candidates.map((i) => forced(i));
+    const anchors = kept.flatMap((isKept, j) => (isKept ? [j] : []));
+    const pending: [number, number][] = [];
+    for (let a = 0; a + 1 < anchors.length; a++) pending.push([anchors[a], anchors[a + 1]]);
+    while (pending.length) {
+      const [start, end] = pending.pop()!;
+      const [s, e] = [candidates[start], candidates[end]];
+      let farthest = -1;
+      let farthestDistance = epsilon;
+      for (let j = start + 1; j < end; j++) {
+        const i = candidates[j];
+        const distance = segmentDistance(xs[i], ys[i], xs[s], ys[s], xs[e], ys[e]);
+        if (distance > farthestDistance) {
+          farthest = j;
+          farthestDistance = distance;
+        }
+      }
+      if (farthest >= 0) {
+        kept[farthest] = true;
+        pending.push([start, farthest], [farthest, end]);
+      }
+    }
+
+    offset += n;
+    const selected = candidates.filter((_, j) => kept[j]);
+    return [selected.map((i) => xs[i]), selected.map((i) => ys[i])];
+  });
+}